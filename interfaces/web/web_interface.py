@@ -7,11 +7,15 @@ import sys
 import os
 sys.path.append('../../src')
 
-from flask import Flask, render_template, request, jsonify
+import argparse
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import json
+import threading
 from datetime import datetime
 from models.history_ai import HistoryAIModel
 from models.history_ai_ru import HistoryAIModelRU
+from batch_generation import MicroBatchScheduler
+from answer_cache import AnswerCache
 
 app = Flask(__name__)
 
@@ -19,6 +23,20 @@ app = Flask(__name__)
 english_model = None
 russian_model = None
 
+# Пакетная генерация /api/generate: одновременные запросы объединяются в один generate
+BATCH_MAX_SIZE = 8
+BATCH_MAX_WAIT_MS = 20
+schedulers = {}
+schedulers_lock = threading.Lock()
+
+# Квантование моделей для инференса на CPU (--quantize int8)
+QUANTIZE = None
+
+# Кеш ответов /api/generate; записи модели сбрасываются после ее переобучения
+answer_cache = AnswerCache('../../data/cache/answers')
+# Пути, из которых загружены модели (по id модели), для отпечатка весов в ключе кеша
+model_paths = {}
+
 def load_models():
     """Загружает обе модели"""
     global english_model, russian_model
@@ -27,7 +45,8 @@ def load_models():
         # Загружаем английскую модель
         print("🔄 Загружаем английскую модель...")
         english_model = HistoryAIModel()
-        english_model.load_trained_model('../../models/history_ai_trained')
+        english_model.load_trained_model('../../models/history_ai_trained', quantize=QUANTIZE)
+        model_paths[id(english_model)] = '../../models/history_ai_trained'
         print("✅ Английская модель загружена")
         
         # Загружаем русскую модель (если есть)
@@ -36,11 +55,12 @@ def load_models():
             russian_model = HistoryAIModelRU()
             # Сначала пытаемся загрузить обученную модель, если не получается - предобученную
             try:
-                russian_model.load_trained_model('../../models/history_ai_ru_trained')
+                russian_model.load_trained_model('../../models/history_ai_ru_trained', quantize=QUANTIZE)
+                model_paths[id(russian_model)] = '../../models/history_ai_ru_trained'
                 print("✅ Обученная русская модель загружена")
             except:
                 print("🔄 Загружаем предобученную русскую модель...")
-                russian_model.load_model('generation')
+                russian_model.load_model('generation', quantize=QUANTIZE)
                 print("✅ Предобученная русская модель загружена")
         except Exception as e:
             print(f"⚠️ Русская модель не найдена: {e}")
@@ -69,56 +89,94 @@ def generate_text():
         if not prompt:
             return jsonify({'error': 'Промпт не может быть пустым'}), 400
         
-        # Выбираем модель в зависимости от языка
-        if language == 'russian' and russian_model:
-            model = russian_model
-            model_name = "Русская модель (rugpt3small)"
-        elif language == 'english' and english_model:
-            model = english_model
-            model_name = "Английская модель (distilgpt2)"
-        else:
-            # Fallback на доступную модель
-            if russian_model:
-                model = russian_model
-                model_name = "Русская модель (rugpt3small)"
-            elif english_model:
-                model = english_model
-                model_name = "Английская модель (distilgpt2)"
-            else:
-                return jsonify({'error': 'Модели не загружены'}), 500
+        model, model_name = select_model(language)
+        if model is None:
+            return jsonify({'error': 'Модели не загружены'}), 500
         
-        # Генерируем текст
-        result = model.generate_text(
-            prompt=prompt,
-            max_length=max_length,
-            temperature=temperature
-        )
+        # Повторный вопрос к той же модели с теми же параметрами берется из кеша
+        model_path = model_paths.get(id(model), model.model_name)
+        result = answer_cache.get(prompt, model_path, max_length=max_length, temperature=temperature,
+                                  quantize=QUANTIZE)
+        if result is not None:
+            metrics = {'cached': True}
+        else:
+            # Генерируем текст в пакете с одновременными запросами
+            result, metrics = get_scheduler(model).generate(
+                prompt=prompt,
+                max_length=max_length,
+                temperature=temperature
+            )
+            answer_cache.put(prompt, model_path, result, max_length=max_length, temperature=temperature,
+                             quantize=QUANTIZE)
         
         # Сохраняем в историю
-        history_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'prompt': prompt,
-            'result': result,
-            'language': language,
-            'model': model_name,
-            'parameters': {
-                'max_length': max_length,
-                'temperature': temperature
-            }
-        }
-        
+        history_entry = make_history_entry(prompt, result, language, model_name, max_length, temperature)
         save_to_history(history_entry)
         
         return jsonify({
             'success': True,
             'result': result,
             'model': model_name,
-            'timestamp': history_entry['timestamp']
+            'timestamp': history_entry['timestamp'],
+            'metrics': metrics
         })
         
     except Exception as e:
         return jsonify({'error': f'Ошибка генерации: {str(e)}'}), 500
 
+@app.route('/api/generate/stream')
+def generate_text_stream():
+    """
+    API потоковой генерации текста (server-sent events)
+    
+    Параметры передаются в строке запроса (prompt, language, max_length,
+    temperature). События: без имени - фрагмент текста {"text": ...} по мере
+    генерации; done - итоговый ответ в формате /api/generate; error - ошибка.
+    При закрытии соединения клиентом генерация останавливается.
+    """
+    prompt = request.args.get('prompt', '').strip()
+    language = request.args.get('language', 'russian')
+    max_length = int(request.args.get('max_length', 100))
+    temperature = float(request.args.get('temperature', 0.7))
+    
+    if not prompt:
+        return jsonify({'error': 'Промпт не может быть пустым'}), 400
+    
+    model, model_name = select_model(language)
+    if model is None:
+        return jsonify({'error': 'Модели не загружены'}), 500
+    
+    def sse(data, event=None):
+        payload = json.dumps(data, ensure_ascii=False)
+        return (f"event: {event}\n" if event else "") + f"data: {payload}\n\n"
+    
+    def events():
+        stop_event = threading.Event()
+        chunks = []
+        try:
+            for text in model.generate_text_stream(prompt, max_length=max_length, temperature=temperature,
+                                                   stop_event=stop_event):
+                chunks.append(text)
+                yield sse({'text': text})
+            
+            result = model.finalize_generated_text(''.join(chunks))
+            history_entry = make_history_entry(prompt, result, language, model_name, max_length, temperature)
+            save_to_history(history_entry)
+            yield sse({
+                'success': True,
+                'result': result,
+                'model': model_name,
+                'timestamp': history_entry['timestamp']
+            }, event='done')
+        except Exception as e:
+            yield sse({'error': f'Ошибка генерации: {str(e)}'}, event='error')
+        finally:
+            # Клиент отключился или генерация завершена
+            stop_event.set()
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/history')
 def get_history():
     """Получить историю запросов"""
@@ -134,9 +192,56 @@ def get_status():
     return jsonify({
         'english_model': english_model is not None,
         'russian_model': russian_model is not None,
+        'batching': {
+            ('english' if model is english_model else 'russian'): scheduler.get_stats()
+            for model, scheduler in schedulers.values()
+        },
+        'answer_cache': answer_cache.get_stats(),
+        'quantize': QUANTIZE,
         'timestamp': datetime.now().isoformat()
     })
 
+def select_model(language):
+    """
+    Выбирает модель по языку (с переходом на доступную модель)
+    
+    Returns:
+        Модель и ее название или (None, None), если модели не загружены
+    """
+    if language == 'russian' and russian_model:
+        return russian_model, "Русская модель (rugpt3small)"
+    if language == 'english' and english_model:
+        return english_model, "Английская модель (distilgpt2)"
+    
+    # Fallback на доступную модель
+    if russian_model:
+        return russian_model, "Русская модель (rugpt3small)"
+    if english_model:
+        return english_model, "Английская модель (distilgpt2)"
+    return None, None
+
+def get_scheduler(model):
+    """Возвращает планировщик пакетной генерации модели (создается при первом запросе)"""
+    with schedulers_lock:
+        if id(model) not in schedulers:
+            schedulers[id(model)] = (model, MicroBatchScheduler(model, max_batch_size=BATCH_MAX_SIZE,
+                                                                max_wait_ms=BATCH_MAX_WAIT_MS))
+        return schedulers[id(model)][1]
+
+def make_history_entry(prompt, result, language, model_name, max_length, temperature):
+    """Создает запись истории запросов"""
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'prompt': prompt,
+        'result': result,
+        'language': language,
+        'model': model_name,
+        'parameters': {
+            'max_length': max_length,
+            'temperature': temperature
+        }
+    }
+
 def save_to_history(entry):
     """Сохраняет запись в историю"""
     try:
@@ -172,6 +277,17 @@ def load_history():
         return []
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Веб-интерфейс ИИ модели изучения истории')
+    parser.add_argument('--max-batch-size', type=int, default=BATCH_MAX_SIZE,
+                        help='Максимальное количество запросов в одном пакете генерации')
+    parser.add_argument('--max-wait-ms', type=float, default=BATCH_MAX_WAIT_MS,
+                        help='Максимальное время сбора пакета генерации, мс')
+    parser.add_argument('--quantize', choices=['int8'], help='Квантование моделей для инференса на CPU')
+    args = parser.parse_args()
+    BATCH_MAX_SIZE = args.max_batch_size
+    BATCH_MAX_WAIT_MS = args.max_wait_ms
+    QUANTIZE = args.quantize
+    
     print("🌐 Запуск веб-интерфейса для ИИ модели изучения истории")
     print("=" * 60)
     
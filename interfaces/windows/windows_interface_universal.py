@@ -37,9 +37,13 @@ logger = logging.getLogger(__name__)
 class UniversalHistoryInterface:
     def __init__(self):
         self.root = tk.Tk()
+        self.inference_client = None
+        self.answer_cache = None
+        self.generation_cancel = None
         self.setup_paths()
         self.setup_ui()
         self.load_models()
+        self.start_inference_worker()
         
     def is_exe(self):
         """Проверяет, запущен ли скрипт как exe файл"""
@@ -353,6 +357,20 @@ class UniversalHistoryInterface:
         )
         self.generate_btn.pack(side='left', padx=(0, 10))
         
+        self.stop_btn = tk.Button(
+            generate_buttons_frame,
+            text="⏹️ Остановить",
+            font=self.button_font,
+            command=self.stop_generation,
+            bg='#e67e22',
+            fg='white',
+            relief='flat',
+            padx=20,
+            pady=10,
+            state='disabled'
+        )
+        self.stop_btn.pack(side='left', padx=(0, 10))
+        
         self.clear_btn = tk.Button(
             generate_buttons_frame,
             text="🗑️ Очистить",
@@ -508,6 +526,53 @@ class UniversalHistoryInterface:
             logger.error(f"Ошибка загрузки моделей: {e}")
             self.update_status(f"❌ Ошибка загрузки моделей: {e}")
     
+    def start_inference_worker(self):
+        """
+        Запускает в фоне постоянный процесс генерации с загруженной моделью
+        
+        Модель загружается и прогревается один раз при старте интерфейса;
+        все запросы генерации переиспользуют этот процесс.
+        """
+        if not (self.MODELS_DIR / "history_ai_trained").exists():
+            return
+        
+        client = self.get_inference_client()
+        
+        def start_thread():
+            try:
+                client.start()
+                self.root.after(0, lambda: self.update_status("✅ Модель загружена в процесс генерации"))
+            except Exception as e:
+                logger.error(f"Не удалось запустить процесс генерации: {e}")
+        
+        threading.Thread(target=start_thread, daemon=True).start()
+    
+    def get_inference_client(self):
+        """Возвращает клиент процесса генерации (создается при первом обращении)"""
+        if self.inference_client is None:
+            if str(self.SRC_DIR) not in sys.path:
+                sys.path.append(str(self.SRC_DIR))
+            from inference_server import InferenceClient
+            self.inference_client = InferenceClient("models/history_ai_trained", cwd=str(self.BASE_DIR))
+        return self.inference_client
+    
+    def get_answer_cache(self):
+        """Возвращает кеш ответов (создается при первом обращении)"""
+        if self.answer_cache is None:
+            if str(self.SRC_DIR) not in sys.path:
+                sys.path.append(str(self.SRC_DIR))
+            from answer_cache import AnswerCache
+            self.answer_cache = AnswerCache(str(self.BASE_DIR / "data" / "cache" / "answers"))
+        return self.answer_cache
+    
+    def restart_inference_worker(self):
+        """Перезапускает процесс генерации после переобучения модели"""
+        if self.inference_client is not None:
+            self.inference_client.close()
+        # Ответы прежней модели больше не актуальны
+        self.get_answer_cache().invalidate(str(self.MODELS_DIR / "history_ai_trained"))
+        self.start_inference_worker()
+    
     def upload_file(self):
         """Загружает файлы в папку data/raw"""
         try:
@@ -702,11 +767,11 @@ class UniversalHistoryInterface:
                 self.update_status("Начинаем переобучение английской модели...")
                 self.update_progress(10, "Подготовка данных...")
                 
-                # Запускаем скрипт инкрементального обучения
+                # Запускаем скрипт инкрементального обучения (обучаются только адаптеры LoRA)
                 script_path = self.SRC_DIR / "train_model_incremental.py"
                 if script_path.exists():
                     result = subprocess.run(
-                        [sys.executable, str(script_path), "--data", str(self.DATA_DIR / "raw"), "--epochs", "1", "--model", "distilgpt2"],
+                        [sys.executable, str(script_path), "--data", str(self.DATA_DIR / "raw"), "--epochs", "1", "--model", "distilgpt2", "--lora"],
                         cwd=str(self.BASE_DIR),
                         capture_output=True,
                         text=True,
@@ -717,6 +782,7 @@ class UniversalHistoryInterface:
                     if result.returncode == 0:
                         self.update_progress(100, "Переобучение завершено!")
                         self.update_status("Английская модель переобучена успешно")
+                        self.restart_inference_worker()
                         # Выводим информацию о процессе в консоль
                         print(f"\n{'='*60}")
                         print("ПЕРЕОБУЧЕНИЕ АНГЛИЙСКОЙ МОДЕЛИ ЗАВЕРШЕНО")
@@ -760,11 +826,11 @@ class UniversalHistoryInterface:
                 self.update_status("Начинаем переобучение русской модели...")
                 self.update_progress(10, "Подготовка данных...")
                 
-                # Запускаем скрипт инкрементального обучения русской модели
+                # Запускаем скрипт инкрементального обучения русской модели (только адаптеры LoRA)
                 script_path = self.SRC_DIR / "train_model_incremental.py"
                 if script_path.exists():
                     result = subprocess.run(
-                        [sys.executable, str(script_path), "--data", str(self.DATA_DIR / "raw"), "--epochs", "1", "--model", "ai-forever/rugpt3small_based_on_gpt2"],
+                        [sys.executable, str(script_path), "--data", str(self.DATA_DIR / "raw"), "--epochs", "1", "--model", "ai-forever/rugpt3small_based_on_gpt2", "--lora"],
                         cwd=str(self.BASE_DIR),
                         capture_output=True,
                         text=True,
@@ -775,6 +841,7 @@ class UniversalHistoryInterface:
                     if result.returncode == 0:
                         self.update_progress(100, "Переобучение завершено!")
                         self.update_status("Русская модель переобучена успешно")
+                        self.restart_inference_worker()
                         # Выводим информацию о процессе в консоль
                         print(f"\n{'='*60}")
                         print("ПЕРЕОБУЧЕНИЕ РУССКОЙ МОДЕЛИ ЗАВЕРШЕНО")
@@ -824,75 +891,58 @@ class UniversalHistoryInterface:
             model_type = self.model_var.get()
             
             # Используем обученную модель
-            model_path = "models/history_ai_trained"
             model_display_name = "обученной"
             
+            # Повторный вопрос к той же модели берется из кеша без генерации
+            answer_cache = self.get_answer_cache()
+            model_path = str(self.MODELS_DIR / "history_ai_trained")
+            cached = answer_cache.get(prompt, model_path, max_length=10000, temperature=0.1)
+            if cached is not None:
+                self.display_response(cached)
+                self.update_status("Ответ взят из кеша")
+                return
+            
             self.update_status(f"Генерация ответа с помощью {model_display_name} модели...")
             
+            client = self.get_inference_client()
+            cancel_event = threading.Event()
+            self.generation_cancel = cancel_event
+            self.generate_btn.config(state='disabled')
+            self.stop_btn.config(state='normal')
+            self.display_response("")
+            
             # Запускаем генерацию в отдельном потоке
             def generate_thread():
                 try:
-                    self.generate_btn.config(state='disabled')
                     
-                    # Запускаем скрипт генерации
-                    script_path = self.SRC_DIR / "generate_text.py"
-                    if script_path.exists():
-                        # Устанавливаем переменные окружения для правильной кодировки
-                        env = os.environ.copy()
-                        env['PYTHONIOENCODING'] = 'utf-8'
-                        env['PYTHONUTF8'] = '1'
-                        
-                        result = subprocess.run(
-                            [sys.executable, str(script_path), "--prompt", prompt, "--model", model_path],
-                            cwd=str(self.BASE_DIR),
-                            capture_output=True,
-                            text=True,
-                            encoding='utf-8',
-                            errors='replace',
-                            env=env
-                        )
-                        
-                        if result.returncode == 0:
-                            # Извлекаем ответ ИИ из нового формата вывода
-                            output_lines = result.stdout.strip().split('\n')
-                            response = ""
-                            in_answer_section = False
-                            
-                            for line in output_lines:
-                                if line.startswith("ОТВЕТ ИИ:"):
-                                    in_answer_section = True
-                                    continue
-                                elif line.startswith("="*60) and in_answer_section:
-                                    break
-                                elif in_answer_section and line.strip():
-                                    response += line + "\n"
-                            
-                            if not response:
-                                response = result.stdout.strip()
-                            
-                            # Дополнительная очистка кодировки
-                            if response:
-                                try:
-                                    # Пытаемся исправить кодировку
-                                    response = response.encode('utf-8', errors='ignore').decode('utf-8')
-                                except:
-                                    pass
-                            
-                            # Выводим ответ в консоль
-                            print(f"\n{'='*60}")
-                            print(f"ОТВЕТ ИИ (из интерфейса):")
-                            print(f"{'='*60}")
-                            print(response)
-                            print(f"{'='*60}")
-                            print(f"Длина ответа: {len(response)} символов")
-                            print(f"{'='*60}")
-                            
-                            self.root.after(0, lambda: self.display_response(response))
-                            self.update_status("Ответ сгенерирован и выведен в консоль")
-                        else:
-                            raise Exception(f"Ошибка генерации: {result.stderr}")
+                    # Генерируем в постоянном процессе: модель загружается только при его запуске
+                    if not client.is_running():
+                        self.root.after(0, lambda: self.update_status("Загрузка модели в процесс генерации..."))
+                    
+                    # Текст выводится в поле ответа по мере генерации, затем
+                    # заменяется очищенным итоговым ответом
+                    response = client.generate(
+                        prompt, max_length=10000, temperature=0.1,
+                        on_token=lambda text: self.root.after(0, lambda: self.append_response(text)),
+                        cancel_event=cancel_event
+                    )
+                    
+                    # Выводим ответ в консоль
+                    print(f"\n{'='*60}")
+                    print(f"ОТВЕТ ИИ (из интерфейса):")
+                    print(f"{'='*60}")
+                    print(response)
+                    print(f"{'='*60}")
+                    print(f"Длина ответа: {len(response)} символов")
+                    print(f"{'='*60}")
+                    
+                    self.root.after(0, lambda: self.display_response(response))
+                    if cancel_event.is_set():
+                        self.update_status("Генерация остановлена")
                     else:
-                        raise Exception("Скрипт генерации не найден")
+                        # Остановленный ответ неполный, в кеш попадают только завершенные
+                        answer_cache.put(prompt, model_path, response, max_length=10000, temperature=0.1)
+                        self.update_status("Ответ сгенерирован и выведен в консоль")
                         
                 except Exception as e:
                     error_msg = str(e)
@@ -901,6 +951,7 @@ class UniversalHistoryInterface:
                     self.root.after(0, lambda: self.update_status(f"❌ Ошибка генерации: {error_msg}"))
                 finally:
                     self.root.after(0, lambda: self.generate_btn.config(state='normal'))
+                    self.root.after(0, lambda: self.stop_btn.config(state='disabled'))
             
             thread = threading.Thread(target=generate_thread, daemon=True)
             thread.start()
@@ -909,6 +960,19 @@ class UniversalHistoryInterface:
             logger.error(f"Ошибка генерации: {e}")
             messagebox.showerror("Ошибка", f"Ошибка генерации:\n{e}")
     
+    def stop_generation(self):
+        """Останавливает текущую генерацию"""
+        if self.generation_cancel is not None:
+            self.generation_cancel.set()
+            self.update_status("Останавливаем генерацию...")
+    
+    def append_response(self, text):
+        """Дописывает фрагмент ответа в текстовое поле"""
+        self.response_text.config(state='normal')
+        self.response_text.insert(tk.END, text)
+        self.response_text.see(tk.END)
+        self.response_text.config(state='disabled')
+    
     def display_response(self, response):
         """Отображает ответ в текстовом поле"""
         self.response_text.config(state='normal')
@@ -1030,7 +1094,11 @@ class UniversalHistoryInterface:
     
     def run(self):
         """Запускает приложение"""
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            if self.inference_client is not None:
+                self.inference_client.close()
 
 def main():
     """Главная функция"""
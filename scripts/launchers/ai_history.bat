@@ -74,7 +74,7 @@ goto menu
 echo.
 echo 📖 Обучаем модель на PDF данных...
 echo.
-python src/train_model.py --data data/processed/pdf_history_data.json --task generation --epochs 1 --model distilgpt2
+python src/train_model.py --data data/raw --task generation --epochs 1 --model distilgpt2
 pause
 goto menu
 
@@ -106,7 +106,7 @@ if exist "models\history_ai_trained" (
     echo Английская модель: ❌ Нет
 )
 
-if exist "data\processed\pdf_history_data.json" (
+if exist "data\processed\pdf_history_data.jsonl" (
     echo PDF данные: ✅ Есть
 ) else (
     echo PDF данные: ❌ Нет
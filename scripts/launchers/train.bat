@@ -48,7 +48,7 @@ goto end
 
 :train_pdf
 echo [TRAINING] Training model on PDF data...
-python src/train_model.py --data data/processed/pdf_history_data.json --task generation --epochs 1 --model distilgpt2
+python src/train_model.py --data data/raw --task generation --epochs 1 --model distilgpt2
 goto end
 
 :train_csv
@@ -112,7 +112,7 @@ if exist "models\history_ai_trained" (
     echo Trained model: [NO] Not available
 )
 
-if exist "data\processed\pdf_history_data.json" (
+if exist "data\processed\pdf_history_data.jsonl" (
     echo PDF data: [OK] Available
 ) else (
     echo PDF data: [NO] Not available
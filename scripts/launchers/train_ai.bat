@@ -40,13 +40,13 @@ goto train_ai
 echo.
 echo 📖 Обучение на PDF учебнике...
 echo.
-if not exist "data\processed\pdf_history_data.json" (
+if not exist "data\processed\pdf_history_data.jsonl" (
     echo ❌ PDF данные не найдены!
     echo 💡 Сначала запустите: python src/pdf_reader.py
     pause
     goto train_ai
 )
-python src/train_model.py --data data/processed/pdf_history_data.json --task generation --epochs 1 --model distilgpt2
+python src/train_model.py --data data/raw --task generation --epochs 1 --model distilgpt2
 echo.
 echo ✅ Обучение на PDF завершено!
 pause
@@ -43,7 +43,7 @@ goto end
 
 :train_pdf
 echo [ОБУЧЕНИЕ] Обучаем модель на PDF данных...
-python src/train_model.py --data data/processed/pdf_history_data.json --task generation --epochs 1 --model distilgpt2
+python src/train_model.py --data data/raw --task generation --epochs 1 --model distilgpt2
 goto end
 
 :train_csv
@@ -92,7 +92,7 @@ if exist "models\history_ai_trained" (
     echo Обученная модель: [NO] Нет
 )
 
-if exist "data\processed\pdf_history_data.json" (
+if exist "data\processed\pdf_history_data.jsonl" (
     echo PDF данные: [OK] Есть
 ) else (
     echo PDF данные: [NO] Нет
@@ -94,13 +94,13 @@ goto training_menu
 :pdf_train
 echo.
 echo 📖 Обучение на PDF учебнике...
-if not exist "data\processed\pdf_history_data.json" (
+if not exist "data\processed\pdf_history_data.jsonl" (
     echo ❌ PDF данные не найдены!
     echo 💡 Сначала запустите: python src/pdf_reader.py
     pause
     goto training_menu
 )
-python src/train_model.py --data data/processed/pdf_history_data.json --task generation --epochs 1 --model distilgpt2
+python src/train_model.py --data data/raw --task generation --epochs 1 --model distilgpt2
 echo ✅ Обучение на PDF завершено!
 pause
 goto training_menu
@@ -223,7 +223,7 @@ if exist "models\history_ai_trained" (
     echo Английская модель: ❌ Нет
 )
 
-if exist "data\processed\pdf_history_data.json" (
+if exist "data\processed\pdf_history_data.jsonl" (
     echo PDF данные: ✅ Есть
 ) else (
     echo PDF данные: ❌ Нет
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение скорости и результатов BookMetadataFilter и FusedMetadataFilter
+"""
+
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent.parent.parent / "src"))
+
+from metadata_filter import BookMetadataFilter, FusedMetadataFilter
+
+# Фрагменты для синтетического текста: обычный текст учебника и метаданные
+CONTENT_LINES = [
+    "В 1380 году на Куликовом поле войско Дмитрия Донского разбило армию Мамая.",
+    "Петр I провел реформы, создал регулярную армию и флот, основал Санкт-Петербург.",
+    "Отечественная война 1812 года завершилась изгнанием армии Наполеона из России.",
+    "Крещение Руси при князе Владимире стало важнейшим событием X века.",
+    "Глава 3. Русские земли в XIII веке",
+]
+METADATA_LINES = [
+    "Издательство: Просвещение",
+    "Тираж: 5000 экземпляров",
+    "ISBN: 978-5-09-012345-6",
+    "Формат: 70×100/16. Переплет: твердый",
+    "ББК: 63.3(2)я72 УДК: 94(470)",
+    "© 2020 Издательство Дрофа. Все права защищены",
+    "12.05.2020",
+    "СОДЕРЖАНИЕ",
+    "стр. 125",
+]
+
+def build_text(size_mb: float, seed: int = 0) -> str:
+    """Собирает синтетический текст книги заданного размера"""
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size_mb * 1024 * 1024:
+        line = rng.choice(METADATA_LINES) if rng.random() < 0.05 else rng.choice(CONTENT_LINES)
+        lines.append(line)
+        total += len(line.encode('utf-8')) + 1
+    return '\n'.join(lines)
+
+def measure(filter_obj, text: str, repeats: int):
+    """Возвращает лучшее время и результат фильтрации"""
+    best = None
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = filter_obj.filter_metadata(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк фильтра метаданных')
+    parser.add_argument('files', nargs='*', help='Файлы книг (по умолчанию - синтетический текст)')
+    parser.add_argument('--size-mb', type=float, default=5.0, help='Размер синтетического текста, МБ')
+    parser.add_argument('--repeats', type=int, default=3, help='Количество повторов')
+    args = parser.parse_args()
+    
+    if args.files:
+        from data_processing import load_file
+        texts = [(Path(f).name, load_file(f)) for f in args.files]
+    else:
+        texts = [(f"синтетический текст {args.size_mb} МБ", build_text(args.size_mb))]
+    
+    reference = BookMetadataFilter()
+    fused = FusedMetadataFilter()
+    
+    print("⏱️ Бенчмарк фильтра метаданных")
+    print("=" * 60)
+    
+    all_identical = True
+    for name, text in texts:
+        reference_time, reference_result = measure(reference, text, args.repeats)
+        fused_time, fused_result = measure(fused, text, args.repeats)
+        identical = reference_result == fused_result
+        all_identical = all_identical and identical
+        
+        print(f"\n📄 {name}: {len(text):,} символов")
+        print(f"   BookMetadataFilter:  {reference_time:.3f} с")
+        print(f"   FusedMetadataFilter: {fused_time:.3f} с")
+        print(f"   Ускорение: {reference_time / fused_time:.1f}x")
+        print(f"   Результаты {'✅ совпадают' if identical else '❌ РАЗЛИЧАЮТСЯ'}")
+    
+    return all_identical
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
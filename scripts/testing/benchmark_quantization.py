@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение модели fp32 и динамически квантованной int8 на CPU:
+время загрузки, размер весов, задержка генерации и качество ответов
+на вопросах ModelEvaluator
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent.parent.parent / "src"))
+
+from models.history_ai import HistoryAIModel
+from model_evaluation import BASIC_QUESTIONS, ModelEvaluator
+from quantization import model_size_bytes
+
+def load(model_path: str, quantize):
+    """Загружает модель на CPU и возвращает ее с временем загрузки"""
+    started = time.perf_counter()
+    model = HistoryAIModel(device="cpu")
+    model.load_trained_model(model_path, task_type='generation', quantize=quantize)
+    model.model.eval()
+    return model, time.perf_counter() - started
+
+def generate(model: HistoryAIModel, question: str, max_new_tokens: int):
+    """Жадная генерация фиксированного числа токенов; возвращает ответ и время"""
+    inputs = model.tokenizer(question, return_tensors="pt")
+    started = time.perf_counter()
+    with torch.no_grad():
+        outputs = model.model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=model.tokenizer.pad_token_id
+        )
+    elapsed = time.perf_counter() - started
+    answer = model.tokenizer.decode(outputs[0, inputs.input_ids.shape[1]:], skip_special_tokens=True)
+    return answer.strip(), elapsed
+
+def next_token_agreement(reference: HistoryAIModel, quantized: HistoryAIModel, texts) -> float:
+    """Доля позиций, где наиболее вероятный следующий токен у моделей совпадает"""
+    matches = 0
+    total = 0
+    for text in texts:
+        inputs = reference.tokenizer(text, return_tensors="pt")
+        with torch.no_grad():
+            reference_tokens = reference.model(**inputs).logits.argmax(-1)
+            quantized_tokens = quantized.model(**inputs).logits.argmax(-1)
+        matches += int((reference_tokens == quantized_tokens).sum())
+        total += reference_tokens.numel()
+    return matches / total if total else 0.0
+
+def measure(model: HistoryAIModel, evaluator: ModelEvaluator, repeats: int, max_new_tokens: int):
+    """Лучшая задержка на токен и средняя оценка качества ответов"""
+    best_per_token = []
+    scores = []
+    answers = []
+    for question_data in BASIC_QUESTIONS:
+        best = None
+        for _ in range(repeats):
+            answer, elapsed = generate(model, question_data["question"], max_new_tokens)
+            best = elapsed if best is None else min(best, elapsed)
+        best_per_token.append(best / max_new_tokens)
+        scores.append(evaluator._analyze_answer_quality(answer, question_data["keywords"],
+                                                        question_data["expected"]))
+        answers.append(answer)
+    return sum(best_per_token) / len(best_per_token), sum(scores) / len(scores), answers
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк квантованной int8 модели')
+    parser.add_argument('--model', type=str, default='models/history_ai_trained', help='Путь к обученной модели')
+    parser.add_argument('--repeats', type=int, default=3, help='Количество повторов генерации')
+    parser.add_argument('--max-new-tokens', type=int, default=32, help='Количество генерируемых токенов')
+    parser.add_argument('--threads', type=int, help='Количество потоков PyTorch')
+    args = parser.parse_args()
+    
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    
+    print("⏱️ Бенчмарк квантования int8 (CPU)")
+    print("=" * 60)
+    
+    reference, reference_load = load(args.model, None)
+    quantized, quantized_load = load(args.model, "int8")
+    # Повторная загрузка берет квантованную модель из кеша
+    quantized, cached_load = load(args.model, "int8")
+    
+    evaluator = ModelEvaluator(args.model)
+    evaluator.device = "cpu"
+    
+    # Прогрев
+    generate(reference, BASIC_QUESTIONS[0]["question"], 4)
+    generate(quantized, BASIC_QUESTIONS[0]["question"], 4)
+    
+    reference_latency, reference_score, reference_answers = measure(reference, evaluator, args.repeats,
+                                                                    args.max_new_tokens)
+    quantized_latency, quantized_score, quantized_answers = measure(quantized, evaluator, args.repeats,
+                                                                    args.max_new_tokens)
+    
+    texts = [f"{q['question']} {q['expected']}" for q in BASIC_QUESTIONS]
+    agreement = next_token_agreement(reference, quantized, texts)
+    identical = sum(a == b for a, b in zip(reference_answers, quantized_answers))
+    
+    reference_size = model_size_bytes(reference.model)
+    quantized_size = model_size_bytes(quantized.model)
+    
+    print(f"\n📦 Модель: {args.model}, вопросов: {len(BASIC_QUESTIONS)}, токенов: {args.max_new_tokens}")
+    print(f"{'':28}{'fp32':>12}{'int8':>12}")
+    print(f"{'Загрузка, с':28}{reference_load:>12.2f}{quantized_load:>12.2f}")
+    print(f"{'Загрузка из кеша, с':28}{'':>12}{cached_load:>12.2f}")
+    print(f"{'Размер весов, МБ':28}{reference_size / 1024 ** 2:>12.1f}{quantized_size / 1024 ** 2:>12.1f}")
+    print(f"{'Задержка на токен, мс':28}{reference_latency * 1000:>12.2f}{quantized_latency * 1000:>12.2f}")
+    print(f"{'Оценка качества':28}{reference_score:>12.3f}{quantized_score:>12.3f}")
+    print(f"\n   Ускорение: {reference_latency / quantized_latency:.2f}x, "
+          f"сжатие: {reference_size / quantized_size:.2f}x")
+    print(f"   Совпадение следующего токена: {agreement:.1%}")
+    print(f"   Одинаковых ответов: {identical} из {len(BASIC_QUESTIONS)}")
+    
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -11,7 +11,8 @@ from transformers import (
     AutoModelForCausalLM,
     TrainingArguments,
     Trainer,
-    DataCollatorForLanguageModeling
+    DataCollatorForLanguageModeling,
+    default_data_collator
 )
 import logging
 from pathlib import Path
@@ -34,7 +35,8 @@ def load_and_process_data(data_path):
             texts = process_data_directory(data_path)
         else:
             logger.info("Обрабатываем один файл")
-            text = load_file(data_path)
+            # Один большой файл - извлекаем PDF постранично во всех ядрах
+            text = load_file(data_path, pdf_workers=None)
             texts = [text] if text else []
         
         if not texts:
@@ -47,34 +49,24 @@ def load_and_process_data(data_path):
         logger.error(f"Ошибка загрузки данных: {e}")
         raise
 
-def create_dataset(texts, tokenizer, max_length=512):
-    """Создает датасет для обучения"""
-    # Подготавливаем данные
-    formatted_texts = []
-    for text in texts:
-        # Добавляем специальные токены
-        formatted_text = f"<|startoftext|>{text}<|endoftext|>"
-        formatted_texts.append(formatted_text)
+def create_dataset(texts, tokenizer, max_length=512, stride=64, pack=False):
+    """
+    Создает датасет для обучения
     
-    # Токенизируем
-    tokenized_data = []
-    for text in formatted_texts:
-        tokens = tokenizer(
-            text,
-            truncation=True,
-            padding=True,
-            max_length=max_length,
-            return_tensors="pt"
-        )
-        tokenized_data.append({
-            "input_ids": tokens["input_ids"].squeeze(),
-            "attention_mask": tokens["attention_mask"].squeeze(),
-            "labels": tokens["input_ids"].squeeze()
-        })
+    Тексты токенизируются один раз и режутся на окна ровно по max_length
+    токенов, поэтому при обучении ничего не отбрасывается усечением.
+    Дополнение и labels формирует DataCollatorForLanguageModeling.
+    При pack=True документы склеиваются через EOS в полные блоки по
+    max_length токенов без дополнения.
+    """
+    sys.path.append(str(Path(__file__).parent.parent.parent / "src"))
+    from token_chunker import build_chunk_dataset, build_packed_dataset
     
-    return tokenized_data
+    if pack:
+        return build_packed_dataset(texts, tokenizer, block_size=max_length)
+    return build_chunk_dataset(texts, tokenizer, max_length=max_length, stride=stride)
 
-def train_russian_model(data_path, model_name="ai-forever/rugpt3small_based_on_gpt2", output_dir="models/russian_model", num_epochs=3):
+def train_russian_model(data_path, model_name="ai-forever/rugpt3small_based_on_gpt2", output_dir="models/russian_model", num_epochs=3, pack=False):
     """Обучает русскую модель"""
     try:
         logger.info("Начинаем обучение русской модели...")
@@ -102,7 +94,7 @@ def train_russian_model(data_path, model_name="ai-forever/rugpt3small_based_on_g
         
         # Создаем датасет
         logger.info("Создаем датасет...")
-        dataset = create_dataset(texts, tokenizer)
+        dataset = create_dataset(texts, tokenizer, pack=pack)
         
         # Настройки обучения
         training_args = TrainingArguments(
@@ -123,17 +115,23 @@ def train_russian_model(data_path, model_name="ai-forever/rugpt3small_based_on_g
             remove_unused_columns=False,
         )
         
-        # Создаем тренер
-        data_collator = DataCollatorForLanguageModeling(
-            tokenizer=tokenizer,
-            mlm=False,
-        )
+        # Создаем тренер. Упакованные блоки одной длины собираются без дополнения;
+        # коллатор-обертка считает реальные токены для логов скорости и дополнения
+        from training_stats import ThroughputCallback, TokenCountingCollator
+        if pack:
+            data_collator = TokenCountingCollator(default_data_collator)
+        else:
+            data_collator = TokenCountingCollator(DataCollatorForLanguageModeling(
+                tokenizer=tokenizer,
+                mlm=False,
+            ))
         
         trainer = Trainer(
             model=model,
             args=training_args,
             train_dataset=dataset,
             data_collator=data_collator,
+            callbacks=[ThroughputCallback(data_collator)],
         )
         
         # Обучаем модель
@@ -161,6 +159,8 @@ def main():
     parser.add_argument("--model", default="ai-forever/rugpt3small_based_on_gpt2", help="Название модели")
     parser.add_argument("--output", default="models/russian_model", help="Директория для сохранения")
     parser.add_argument("--epochs", type=int, default=3, help="Количество эпох")
+    parser.add_argument("--pack", action="store_true",
+                        help="Упаковывать документы в полные блоки токенов без дополнения")
     
     args = parser.parse_args()
     
@@ -175,7 +175,8 @@ def main():
         data_path=args.data_path,
         model_name=args.model,
         output_dir=args.output,
-        num_epochs=args.epochs
+        num_epochs=args.epochs,
+        pack=args.pack
     )
     
     if success:
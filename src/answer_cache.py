@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш ответов генерации для повторяющихся вопросов
+Ключ - нормализованный промпт, отпечаток весов модели и параметры генерации;
+записи хранятся в памяти (LRU) и на диске с ограничением времени жизни и размера
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Файлы модели, изменение которых означает новые веса
+MODEL_FILES = ("config.json", "model.safetensors", "model.safetensors.index.json", "pytorch_model.bin",
+               "pytorch_model.bin.index.json", "adapter_config.json", "adapter_model.safetensors")
+
+# Ответ модели, когда содержательный текст не сгенерирован; в кеш не сохраняется
+NO_ANSWER_MESSAGE = ("Извините, не удалось сгенерировать содержательный ответ. "
+                     "Попробуйте изменить промпт или параметры генерации.")
+
+_punctuation_re = re.compile(r"[^\w\s]+")
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Приводит промпт к виду, одинаковому для вопросов, отличающихся только
+    регистром, буквой ё, пунктуацией и пробелами
+    
+    Args:
+        prompt: Промпт пользователя
+    
+    Returns:
+        Нормализованный промпт
+    """
+    prompt = _punctuation_re.sub(' ', prompt.lower().replace('ё', 'е'))
+    return ' '.join(prompt.split())
+
+def model_fingerprint(model_path: str) -> str:
+    """
+    Отпечаток сохраненной модели по размерам и времени изменения ее файлов
+    
+    Args:
+        model_path: Директория модели или название модели с Hugging Face Hub
+    
+    Returns:
+        Шестнадцатеричный отпечаток (меняется после переобучения)
+    """
+    path = Path(model_path)
+    if not path.is_dir():
+        return hashlib.blake2b(str(model_path).encode('utf-8'), digest_size=8).hexdigest()
+    
+    fingerprint = hashlib.blake2b(digest_size=8)
+    for name in MODEL_FILES:
+        file_path = path / name
+        if file_path.exists():
+            stat = file_path.stat()
+            fingerprint.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+    return fingerprint.hexdigest()
+
+class AnswerCache:
+    """
+    Двухуровневый кеш ответов
+    
+    Записи лежат в <cache_dir>/<отпечаток модели>/. Когда у модели меняется
+    отпечаток (модель переобучена), записи старого отпечатка удаляются.
+    Дисковый уровень вытесняет давно не использованные записи по времени
+    модификации, как TextCache.
+    """
+    
+    def __init__(self, cache_dir: str = "data/cache/answers", max_memory_entries: int = 1024,
+                 max_size_mb: int = 64, ttl_seconds: float = 7 * 24 * 3600):
+        """
+        Инициализация кеша
+        
+        Args:
+            cache_dir: Директория дискового уровня
+            max_memory_entries: Максимальное количество записей в памяти
+            max_size_mb: Максимальный размер дискового уровня в мегабайтах
+            ttl_seconds: Время жизни записи в секундах
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_memory_entries = max_memory_entries
+        self.max_size = max_size_mb * 1024 * 1024
+        self.ttl = ttl_seconds
+        self.models_file = self.cache_dir / "models.json"
+        
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_size = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def _load_models(self) -> Dict[str, str]:
+        try:
+            with open(self.models_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def _save_models(self, models: Dict[str, str]):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=self.models_file.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(models, f, ensure_ascii=False)
+            os.replace(tmp_path, self.models_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def _fingerprint(self, model_path: str) -> str:
+        """Отпечаток модели; при его изменении записи прежних весов удаляются"""
+        fingerprint = model_fingerprint(model_path)
+        key = str(Path(model_path).resolve()) if Path(model_path).is_dir() else str(model_path)
+        models = self._load_models()
+        previous = models.get(key)
+        if previous != fingerprint:
+            if previous is not None:
+                logger.info(f"Модель {model_path} изменилась, удаляем ее ответы из кеша")
+                self._drop_fingerprint(previous)
+            models[key] = fingerprint
+            self._save_models(models)
+        return fingerprint
+    
+    def _drop_fingerprint(self, fingerprint: str):
+        for key in [key for key in self._memory if key.startswith(fingerprint + "/")]:
+            del self._memory[key]
+        shutil.rmtree(self.cache_dir / fingerprint, ignore_errors=True)
+        self._total_size = None
+        self.invalidations += 1
+    
+    @staticmethod
+    def _entry_key(fingerprint: str, prompt: str, params: Dict) -> str:
+        payload = json.dumps([normalize_prompt(prompt), sorted(params.items())], ensure_ascii=False)
+        return f"{fingerprint}/{hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()}"
+    
+    def _blob_path(self, key: str) -> Path:
+        fingerprint, digest = key.split("/")
+        return self.cache_dir / fingerprint / digest[:2] / f"{digest}.json"
+    
+    def get(self, prompt: str, model_path: str, **params) -> Optional[str]:
+        """
+        Возвращает сохраненный ответ
+        
+        Args:
+            prompt: Промпт
+            model_path: Путь к модели, которой генерируется ответ
+            **params: Параметры генерации (max_length, temperature, ...)
+        
+        Returns:
+            Ответ или None, если записи нет или она устарела
+        """
+        with self._lock:
+            key = self._entry_key(self._fingerprint(model_path), prompt, params)
+            now = time.time()
+            
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+            
+            blob_path = self._blob_path(key)
+            try:
+                with open(blob_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            except Exception as e:
+                logger.warning(f"Поврежденная запись кеша ответов {blob_path.name}: {e}")
+                self.misses += 1
+                return None
+            
+            if data["expires"] <= now:
+                blob_path.unlink(missing_ok=True)
+                self.misses += 1
+                return None
+            
+            # Отмечаем использование записи для LRU
+            try:
+                os.utime(blob_path)
+            except OSError:
+                pass
+            self._remember(key, data["answer"], data["expires"])
+            self.disk_hits += 1
+            return data["answer"]
+    
+    def put(self, prompt: str, model_path: str, answer: str, **params):
+        """
+        Сохраняет ответ (пустой ответ и NO_ANSWER_MESSAGE не сохраняются)
+        
+        Args:
+            prompt: Промпт
+            model_path: Путь к модели, которой сгенерирован ответ
+            answer: Ответ
+            **params: Параметры генерации (те же, что при get)
+        """
+        if not answer or answer == NO_ANSWER_MESSAGE:
+            return
+        
+        with self._lock:
+            key = self._entry_key(self._fingerprint(model_path), prompt, params)
+            expires = time.time() + self.ttl
+            self._remember(key, answer, expires)
+            
+            blob_path = self._blob_path(key)
+            try:
+                blob_path.parent.mkdir(parents=True, exist_ok=True)
+                data = json.dumps({"answer": answer, "expires": expires}, ensure_ascii=False).encode('utf-8')
+                fd, tmp_path = tempfile.mkstemp(dir=blob_path.parent, suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_path, blob_path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить ответ в кеш: {e}")
+                return
+            
+            if self._total_size is not None:
+                self._total_size += len(data)
+            self._evict_if_needed()
+    
+    def _remember(self, key: str, answer: str, expires: float):
+        """Кладет запись в память, вытесняя давно не использованные"""
+        self._memory[key] = (answer, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+    
+    def _iter_blobs(self):
+        if not self.cache_dir.exists():
+            return
+        yield from self.cache_dir.glob("*/*/*.json")
+    
+    def _evict_if_needed(self):
+        """Удаляет давно не использованные записи, пока дисковый уровень превышает лимит"""
+        if self._total_size is not None and self._total_size <= self.max_size:
+            return
+        
+        blobs = []
+        for blob_path in self._iter_blobs():
+            try:
+                stat = blob_path.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, blob_path))
+        
+        self._total_size = sum(size for _, size, _ in blobs)
+        if self._total_size <= self.max_size:
+            return
+        
+        blobs.sort()
+        removed = 0
+        for _, size, blob_path in blobs:
+            if self._total_size <= self.max_size:
+                break
+            blob_path.unlink(missing_ok=True)
+            self._total_size -= size
+            removed += 1
+        
+        logger.info(f"Из кеша ответов вытеснено {removed} записей")
+    
+    def invalidate(self, model_path: Optional[str] = None):
+        """
+        Удаляет ответы модели (например, сразу после ее переобучения)
+        
+        Args:
+            model_path: Путь к модели; None - очистить весь кеш
+        """
+        with self._lock:
+            if model_path is None:
+                self._memory.clear()
+                shutil.rmtree(self.cache_dir, ignore_errors=True)
+                self._total_size = None
+                self.invalidations += 1
+                return
+            
+            key = str(Path(model_path).resolve()) if Path(model_path).is_dir() else str(model_path)
+            models = self._load_models()
+            if key in models:
+                self._drop_fingerprint(models.pop(key))
+                self._save_models(models)
+    
+    def get_stats(self) -> Dict:
+        """
+        Возвращает статистику кеша
+        
+        Returns:
+            Счетчики попаданий (в память и на диск), промахов и сбросов,
+            количество записей в памяти
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "ttl_seconds": self.ttl
+            }
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пакетная генерация текста для нескольких промптов
+Планировщик собирает одновременные запросы за короткое окно и выполняет их одним вызовом generate
+"""
+
+import copy
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Количество последних запросов, по которым считается статистика ожидания
+STATS_WINDOW = 1000
+
+def generate_batch(ai_model, prompts: List[str], max_length: int = 100,
+                   temperature: float = 0.7, tokenizer=None) -> List[str]:
+    """
+    Генерирует ответы на несколько промптов одним вызовом generate
+    
+    Промпты дополняются слева, поэтому генерация для всех начинается с одной
+    позиции. Каждый ответ обрезается до max_length токенов вместе со своим
+    промптом, как при генерации по одному.
+    
+    Args:
+        ai_model: HistoryAIModel или HistoryAIModelRU с загруженной моделью
+        prompts: Промпты
+        max_length: Максимальная длина промпта вместе с ответом в токенах
+        temperature: Температура генерации
+        tokenizer: Токенизатор (по умолчанию токенизатор модели). Быстрый
+            токенизатор меняет свое состояние дополнения при каждом вызове и не
+            допускает одновременных вызовов с другими настройками из разных потоков
+    
+    Returns:
+        Итоговые ответы в порядке prompts
+    """
+    tokenizer = tokenizer or ai_model.tokenizer
+    inputs = tokenizer(
+        prompts,
+        return_tensors="pt",
+        padding=True,
+        padding_side="left",
+        truncation=True,
+        max_length=512
+    ).to(ai_model.device)
+    
+    prompt_lengths = inputs.attention_mask.sum(dim=1).tolist()
+    budgets = [max(max_length - length, 0) for length in prompt_lengths]
+    kwargs = ai_model._generation_kwargs(inputs, max_length, temperature)
+    del kwargs["max_length"]
+    kwargs["max_new_tokens"] = max(max(budgets), 1)
+    
+    with torch.no_grad():
+        outputs = ai_model.model.generate(**kwargs)
+    
+    results = []
+    input_length = inputs.input_ids.shape[1]
+    for row, budget in enumerate(budgets):
+        generated = tokenizer.decode(outputs[row, input_length:input_length + budget],
+                                     skip_special_tokens=True, clean_up_tokenization_spaces=True)
+        results.append(ai_model.finalize_generated_text(generated.strip()))
+    return results
+
+class _Request:
+    """Запрос в очереди планировщика"""
+    
+    def __init__(self, prompt: str, max_length: int, temperature: float):
+        self.prompt = prompt
+        self.max_length = max_length
+        self.temperature = temperature
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+class MicroBatchScheduler:
+    """
+    Планировщик, объединяющий одновременные запросы генерации в пакеты
+    
+    Первый запрос в очереди ждет до max_wait_ms, пока соберутся другие
+    (но не больше max_batch_size). Запросы с одинаковыми max_length и
+    temperature выполняются одним вызовом generate в потоке планировщика.
+    У планировщика своя копия токенизатора: токенизатор модели одновременно
+    вызывается другими обработчиками (например, /api/generate/stream) с
+    другими настройками дополнения.
+    """
+    
+    def __init__(self, ai_model, max_batch_size: int = 8, max_wait_ms: float = 20):
+        """
+        Инициализация планировщика
+        
+        Args:
+            ai_model: HistoryAIModel или HistoryAIModelRU с загруженной моделью
+            max_batch_size: Максимальное количество промптов в одном generate
+            max_wait_ms: Максимальное время сбора пакета в миллисекундах
+        """
+        self.ai_model = ai_model
+        self.tokenizer = copy.deepcopy(ai_model.tokenizer)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._queue_times = deque(maxlen=STATS_WINDOW)
+        self._requests = 0
+        self._batches = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="micro-batch")
+        self._thread.start()
+    
+    def submit(self, prompt: str, max_length: int = 100, temperature: float = 0.7) -> Future:
+        """
+        Ставит запрос в очередь
+        
+        Returns:
+            Future с кортежем (ответ, метрики запроса)
+        """
+        request = _Request(prompt, max_length, temperature)
+        self._queue.put(request)
+        return request.future
+    
+    def generate(self, prompt: str, max_length: int = 100, temperature: float = 0.7,
+                 timeout: Optional[float] = None) -> Tuple[str, Dict]:
+        """
+        Генерирует ответ, дожидаясь своей очереди
+        
+        Returns:
+            Ответ и метрики запроса: queue_ms (ожидание до начала генерации),
+            generate_ms (время generate пакета) и batch_size
+        """
+        return self.submit(prompt, max_length, temperature).result(timeout)
+    
+    def _collect_batch(self) -> List[_Request]:
+        """Ждет первый запрос и собирает к нему остальные в пределах окна"""
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            
+            groups: Dict[Tuple[int, float], List[_Request]] = {}
+            for request in batch:
+                groups.setdefault((request.max_length, request.temperature), []).append(request)
+            
+            for (max_length, temperature), requests in groups.items():
+                started = time.perf_counter()
+                try:
+                    results = generate_batch(self.ai_model, [r.prompt for r in requests],
+                                             max_length=max_length, temperature=temperature,
+                                             tokenizer=self.tokenizer)
+                except Exception as e:
+                    logger.error(f"Ошибка пакетной генерации: {e}")
+                    for request in requests:
+                        request.future.set_exception(e)
+                    continue
+                
+                generate_ms = (time.perf_counter() - started) * 1000
+                with self._stats_lock:
+                    self._batches += 1
+                    self._requests += len(requests)
+                    for request in requests:
+                        self._queue_times.append((started - request.enqueued_at) * 1000)
+                for request, result in zip(requests, results):
+                    request.future.set_result((result, {
+                        "queue_ms": round((started - request.enqueued_at) * 1000, 1),
+                        "generate_ms": round(generate_ms, 1),
+                        "batch_size": len(requests)
+                    }))
+    
+    def get_stats(self) -> Dict:
+        """
+        Статистика планировщика
+        
+        Returns:
+            Количество запросов и пакетов, средний размер пакета, длина очереди
+            и время ожидания (среднее и 95-й перцентиль) по последним запросам
+        """
+        with self._stats_lock:
+            queue_times = sorted(self._queue_times)
+            requests, batches = self._requests, self._batches
+        
+        stats = {
+            "requests": requests,
+            "batches": batches,
+            "avg_batch_size": round(requests / batches, 2) if batches else 0.0,
+            "queued": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000
+        }
+        if queue_times:
+            stats["avg_queue_ms"] = round(sum(queue_times) / len(queue_times), 1)
+            stats["p95_queue_ms"] = round(queue_times[min(len(queue_times) - 1, int(len(queue_times) * 0.95))], 1)
+        return stats
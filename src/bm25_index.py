@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Инвертированный индекс корпуса с ранжированием BM25
+Списки вхождений хранятся массивами numpy в сегментах рядом с корпусом; новые записи
+корпуса добавляются новым сегментом
+"""
+
+import json
+import os
+import re
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Версия формата индекса; при изменении индекс строится заново
+BM25_INDEX_VERSION = "1"
+
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# При большем количестве сегментов они объединяются в один
+MAX_SEGMENTS = 8
+
+_word_re = re.compile(r"[0-9a-zа-я]+")
+
+# Частые служебные слова, не влияющие на поиск
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было
+вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас
+нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их
+чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой
+совсем ним здесь этом один почти мой тем чтобы нее были куда зачем всех никогда можно при наконец
+два об другой хоть после над больше тот через эти нас про всего них какая много разве три эту моя
+впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно всю между
+the a an of in on at to and or is are was were be by for with as from that this it which who what
+""".split())
+
+# Окончания русских слов, отбрасываемые при стемминге (от длинных к коротким)
+_RU_ENDINGS = tuple(sorted("""
+иями ями ами иях ях ах ией ей ой ий ый ая яя ое ее ые ие ого его ому ему ыми ими ом ем ам ям ов ев
+ую юю ою ею ия ья ье ью а я о е ы и у ю ь й
+""".split(), key=len, reverse=True))
+
+def stem(word: str) -> str:
+    """
+    Упрощенный стемминг: отбрасывает одно окончание, оставляя основу не короче 3 букв
+    
+    Args:
+        word: Слово в нижнем регистре
+    
+    Returns:
+        Основа слова
+    """
+    if word.isdigit():
+        return word
+    if 'а' <= word[0] <= 'я':
+        for ending in _RU_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= 3:
+                return word[:-len(ending)]
+        return word
+    if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def tokenize(text: str) -> List[str]:
+    """
+    Разбивает текст на основы слов без служебных слов
+    
+    Args:
+        text: Текст
+    
+    Returns:
+        Основы слов в порядке текста
+    """
+    words = _word_re.findall(text.lower().replace('ё', 'е'))
+    return [stem(word) for word in words if word not in STOP_WORDS]
+
+class _Segment:
+    """Списки вхождений части корпуса (номера записей возрастают)"""
+    
+    def __init__(self, term_ids: np.ndarray, offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray):
+        self.term_ids = term_ids
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+    
+    @classmethod
+    def build(cls, postings: Iterable[Tuple[int, int, int]]) -> "_Segment":
+        """Строит сегмент из троек (термин, запись, частота)"""
+        data = np.array(list(postings), dtype=np.int64).reshape(-1, 3)
+        data = data[np.lexsort((data[:, 1], data[:, 0]))]
+        term_ids, counts = np.unique(data[:, 0], return_counts=True)
+        offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(term_ids.astype(np.int32), offsets, data[:, 1].astype(np.int32), data[:, 2].astype(np.int32))
+    
+    @classmethod
+    def merge(cls, segments: List["_Segment"]) -> "_Segment":
+        """Объединяет сегменты в один"""
+        terms = np.concatenate([np.repeat(s.term_ids, np.diff(s.offsets)) for s in segments])
+        docs = np.concatenate([s.doc_ids for s in segments])
+        tfs = np.concatenate([s.tfs for s in segments])
+        order = np.lexsort((docs, terms))
+        term_ids, counts = np.unique(terms[order], return_counts=True)
+        offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(term_ids.astype(np.int32), offsets, docs[order], tfs[order])
+    
+    @classmethod
+    def load(cls, path: Path) -> "_Segment":
+        with np.load(path) as data:
+            return cls(data["term_ids"], data["offsets"], data["doc_ids"], data["tfs"])
+    
+    def save(self, path: Path):
+        with open(path, 'wb') as f:
+            np.savez(f, term_ids=self.term_ids, offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs)
+    
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Записи, содержащие термин, и частоты термина в них"""
+        i = int(np.searchsorted(self.term_ids, term_id))
+        if i == len(self.term_ids) or self.term_ids[i] != term_id:
+            return self.doc_ids[:0], self.tfs[:0]
+        return self.doc_ids[self.offsets[i]:self.offsets[i + 1]], self.tfs[self.offsets[i]:self.offsets[i + 1]]
+    
+    def document_frequencies(self, vocab_size: int) -> np.ndarray:
+        df = np.zeros(vocab_size, dtype=np.int64)
+        df[self.term_ids] = np.diff(self.offsets)
+        return df
+
+class BM25Index:
+    """
+    Полнотекстовый поиск по записям корпуса с ранжированием BM25
+    
+    Индекс хранится в директории <корпус>.bm25 рядом с корпусом:
+        manifest.json - идентификатор корпуса, количество проиндексированных записей
+            и список сегментов
+        vocab.json - словарь основ слов (номер термина = позиция в списке)
+        doc_lengths.bin - длины записей в терминах (int32)
+        seg-<номер>.npz - списки вхождений сегмента
+    Сегменты и длины пишутся до manifest.json, поэтому прерванное обновление
+    не портит индекс.
+    """
+    
+    def __init__(self, corpus, index_dir: Optional[str] = None):
+        """
+        Инициализация индекса
+        
+        Args:
+            corpus: CorpusStore или список записей (для списка индекс не сохраняется)
+            index_dir: Директория индекса (по умолчанию <корпус>.bm25)
+        """
+        self.corpus = corpus
+        corpus_file = getattr(corpus, 'corpus_file', None)
+        if index_dir is None and corpus_file is not None:
+            index_dir = corpus_file.with_name(corpus_file.name + ".bm25")
+        self.index_dir = Path(index_dir) if index_dir else None
+        
+        self.manifest = self._load_manifest()
+        self.vocab: Dict[str, int] = {}
+        self.doc_lengths = np.empty(0, dtype=np.int32)
+        self.segments: List[_Segment] = []
+        if self.manifest["records"]:
+            try:
+                self._load()
+            except Exception as e:
+                logger.warning(f"Ошибка загрузки индекса BM25, индекс строится заново: {e}")
+                self.manifest = self._empty_manifest()
+                self.vocab, self.doc_lengths, self.segments = {}, np.empty(0, dtype=np.int32), []
+        self._update_statistics()
+    
+    def _empty_manifest(self) -> Dict:
+        return {"version": BM25_INDEX_VERSION, "corpus": None, "records": 0, "segments": [], "next_segment": 0}
+    
+    def _load_manifest(self) -> Dict:
+        manifest_file = self.index_dir / "manifest.json" if self.index_dir else None
+        if manifest_file and manifest_file.exists():
+            try:
+                with open(manifest_file, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get("version") == BM25_INDEX_VERSION:
+                    return manifest
+            except Exception as e:
+                logger.warning(f"Ошибка загрузки индекса BM25: {e}")
+        return self._empty_manifest()
+    
+    def _load(self):
+        with open(self.index_dir / "vocab.json", 'r', encoding='utf-8') as f:
+            self.vocab = {term: term_id for term_id, term in enumerate(json.load(f))}
+        self.doc_lengths = np.fromfile(self.index_dir / "doc_lengths.bin", dtype=np.int32,
+                                       count=self.manifest["records"])
+        if len(self.doc_lengths) < self.manifest["records"]:
+            raise ValueError("файл длин записей короче индекса")
+        self.segments = [_Segment.load(self.index_dir / name) for name in self.manifest["segments"]]
+    
+    def _write_json(self, path: Path, data):
+        """Атомарно сохраняет JSON"""
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def _update_statistics(self):
+        """Пересчитывает документные частоты и среднюю длину записи"""
+        self.df = np.zeros(len(self.vocab), dtype=np.int64)
+        for segment in self.segments:
+            self.df += segment.document_frequencies(len(self.vocab))
+        self.avg_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+    
+    def __len__(self) -> int:
+        return self.manifest["records"]
+    
+    def update(self) -> int:
+        """
+        Индексирует записи, добавленные в корпус после последнего обновления
+        
+        Returns:
+            Количество проиндексированных записей
+        """
+        corpus_id = getattr(self.corpus, 'corpus_id', None)
+        indexed_id = self.manifest.get("corpus")
+        if corpus_id and indexed_id and corpus_id != indexed_id or self.manifest["records"] > len(self.corpus):
+            logger.warning("Индекс BM25 построен по другому корпусу и строится заново")
+            self.reset()
+        self.manifest["corpus"] = corpus_id
+        start = self.manifest["records"]
+        if start == len(self.corpus):
+            return 0
+        
+        records = self.corpus.iter_records(start) if hasattr(self.corpus, 'iter_records') else self.corpus[start:]
+        postings, lengths = [], []
+        for doc_id, record in enumerate(records, start):
+            terms = tokenize(record.get('text', ''))
+            lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                postings.append((term_id, doc_id, tf))
+        
+        self.segments.append(_Segment.build(postings))
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.array(lengths, dtype=np.int32)])
+        self.manifest["records"] = len(self.doc_lengths)
+        merged = len(self.segments) > MAX_SEGMENTS
+        if merged:
+            self.segments = [_Segment.merge(self.segments)]
+        self._update_statistics()
+        if self.index_dir:
+            self._save(start, merged)
+        
+        logger.info(f"Индекс BM25 обновлен: {len(lengths)} записей, {len(self.vocab)} терминов")
+        return len(lengths)
+    
+    def _save(self, start: int, merged: bool):
+        """Сохраняет новый сегмент (или объединенный сегмент) и manifest.json"""
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        new_segments = self.segments if merged else self.segments[-1:]
+        names = [] if merged else list(self.manifest["segments"])
+        for segment in new_segments:
+            name = f"seg-{self.manifest['next_segment']:05d}.npz"
+            self.manifest["next_segment"] += 1
+            segment.save(self.index_dir / name)
+            names.append(name)
+        
+        with open(self.index_dir / "doc_lengths.bin", 'ab') as f:
+            f.truncate(start * 4)
+            self.doc_lengths[start:].tofile(f)
+        self._write_json(self.index_dir / "vocab.json", list(self.vocab))
+        
+        old_names = set(self.manifest["segments"]) - set(names)
+        self.manifest["segments"] = names
+        self._write_json(self.index_dir / "manifest.json", self.manifest)
+        for name in old_names:
+            (self.index_dir / name).unlink(missing_ok=True)
+    
+    def search(self, query: str, top_k: int = 10,
+               doc_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """
+        Ищет записи по запросу
+        
+        Термины обрабатываются по убыванию idf. Когда сумма максимальных
+        вкладов оставшихся терминов меньше текущего k-го результата, новые
+        записи уже не могут попасть в ответ, и частые термины досчитываются
+        только для оставшихся кандидатов.
+        
+        Args:
+            query: Поисковый запрос
+            top_k: Количество результатов
+            doc_ids: Искать только среди этих записей (например, выбранных фасетами)
+        
+        Returns:
+            Номера записей и оценки BM25 по убыванию оценки
+        """
+        term_ids = {self.vocab[term] for term in tokenize(query) if term in self.vocab}
+        term_ids = [t for t in term_ids if self.df[t]]
+        if not term_ids or not len(self):
+            return []
+        
+        count = len(self)
+        idf = {t: float(np.log(1 + (count - self.df[t] + 0.5) / (self.df[t] + 0.5))) for t in term_ids}
+        term_ids.sort(key=lambda t: -idf[t])
+        # Максимальный вклад термина в оценку записи
+        remaining = sum(idf.values()) * (BM25_K1 + 1)
+        
+        scores = np.zeros(count, dtype=np.float32)
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / max(self.avg_length, 1e-9))
+        candidates = None
+        if doc_ids is not None:
+            candidates = np.unique(np.fromiter(doc_ids, dtype=np.int64))
+            candidates = candidates[candidates < count]
+        for term_id in term_ids:
+            remaining -= idf[term_id] * (BM25_K1 + 1)
+            for segment in self.segments:
+                docs, tfs = segment.postings(term_id)
+                if candidates is not None:
+                    if not len(candidates):
+                        break
+                    positions = np.minimum(np.searchsorted(candidates, docs), len(candidates) - 1)
+                    keep = candidates[positions] == docs
+                    docs, tfs = docs[keep], tfs[keep]
+                scores[docs] += idf[term_id] * tfs * (BM25_K1 + 1) / (tfs + length_norm[docs])
+            
+            scored = np.flatnonzero(scores)
+            if len(scored) > top_k:
+                kth = np.partition(scores[scored], len(scored) - top_k)[len(scored) - top_k]
+                if remaining < kth:
+                    candidates = scored[scores[scored] + remaining >= kth]
+        
+        scored = np.flatnonzero(scores)
+        top = scored[np.argsort(-scores[scored], kind='stable')[:top_k]]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in top]
+    
+    def reset(self):
+        """Удаляет данные индекса"""
+        if self.index_dir and self.index_dir.exists():
+            for path in self.index_dir.iterdir():
+                path.unlink()
+        self.manifest = self._empty_manifest()
+        self.vocab, self.doc_lengths, self.segments = {}, np.empty(0, dtype=np.int32), []
+        self._update_statistics()
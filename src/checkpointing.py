@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Контрольные точки обучения с возможностью продолжения
+Состояние обучения копируется в память синхронно, а на диск пишется в фоновом потоке
+"""
+
+import copy
+import os
+import random
+import re
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+import numpy as np
+import torch
+from transformers import Trainer
+from transformers.trainer import OPTIMIZER_NAME, SCALER_NAME, SCHEDULER_NAME, TRAINER_STATE_NAME
+from transformers.trainer_callback import ExportableState
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+
+logger = logging.getLogger(__name__)
+
+# Файлы весов, по которым контрольная точка считается полной
+WEIGHTS_NAMES = ("model.safetensors", "model.safetensors.index.json",
+                 "pytorch_model.bin", "pytorch_model.bin.index.json")
+
+# Суффикс директории, в которую контрольная точка пишется до переименования
+TMP_SUFFIX = ".tmp"
+
+_checkpoint_re = re.compile(rf"^{PREFIX_CHECKPOINT_DIR}-(\d+)$")
+
+def list_checkpoints(output_dir: str) -> List[Path]:
+    """
+    Возвращает полные контрольные точки директории обучения
+    
+    Полной считается директория checkpoint-<шаг> с весами модели, состоянием
+    оптимизатора, планировщика и Trainer. Недописанные контрольные точки
+    (процесс прерван во время записи) пропускаются.
+    
+    Args:
+        output_dir: Директория обучения (output_dir Trainer)
+    
+    Returns:
+        Пути контрольных точек по возрастанию шага
+    """
+    root = Path(output_dir)
+    if not root.is_dir():
+        return []
+    
+    checkpoints = []
+    for path in root.iterdir():
+        match = _checkpoint_re.match(path.name)
+        if not match or not path.is_dir():
+            continue
+        required = (TRAINER_STATE_NAME, OPTIMIZER_NAME, SCHEDULER_NAME)
+        if all((path / name).exists() for name in required) and \
+                any((path / name).exists() for name in WEIGHTS_NAMES):
+            checkpoints.append((int(match.group(1)), path))
+    
+    return [path for _, path in sorted(checkpoints)]
+
+def find_last_checkpoint(output_dir: str) -> Optional[str]:
+    """
+    Находит последнюю полную контрольную точку
+    
+    Args:
+        output_dir: Директория обучения
+    
+    Returns:
+        Путь к контрольной точке или None
+    """
+    checkpoints = list_checkpoints(output_dir)
+    return str(checkpoints[-1]) if checkpoints else None
+
+def remove_checkpoints(output_dir: str):
+    """
+    Удаляет контрольные точки директории обучения (в том числе недописанные)
+    
+    Вызывается после успешного завершения обучения, чтобы следующий запуск
+    с продолжением не начал с состояния уже законченного обучения.
+    
+    Args:
+        output_dir: Директория обучения
+    """
+    root = Path(output_dir)
+    if not root.is_dir():
+        return
+    
+    for path in root.iterdir():
+        name = path.name[:-len(TMP_SUFFIX)] if path.name.endswith(TMP_SUFFIX) else path.name
+        if path.is_dir() and _checkpoint_re.match(name):
+            shutil.rmtree(path, ignore_errors=True)
+
+def _copy_to_cpu(obj, memo: Dict[int, torch.Tensor]):
+    """
+    Рекурсивно копирует тензоры структуры на CPU
+    
+    Тензоры с общим хранилищем (связанные веса) копируются один раз,
+    чтобы связь сохранилась в копии.
+    """
+    if isinstance(obj, torch.Tensor):
+        key = obj.untyped_storage().data_ptr() if obj.numel() else id(obj)
+        key = (key, obj.storage_offset(), tuple(obj.shape), obj.dtype)
+        if key not in memo:
+            memo[key] = obj.detach().to("cpu", copy=True)
+        return memo[key]
+    if isinstance(obj, dict):
+        return type(obj)((k, _copy_to_cpu(v, memo)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_copy_to_cpu(v, memo) for v in obj)
+    return copy.deepcopy(obj)
+
+class AsyncCheckpointTrainer(Trainer):
+    """
+    Trainer, записывающий контрольные точки в фоновом потоке
+    
+    В момент сохранения веса модели, состояние оптимизатора, планировщика,
+    генераторов случайных чисел и Trainer копируются в память, после чего
+    обучение продолжается, а копия пишется в checkpoint-<шаг>.tmp и
+    переименовывается в checkpoint-<шаг>. Одновременно пишется не больше
+    одной контрольной точки. Формат совпадает с форматом Trainer, поэтому
+    обучение продолжается обычным train(resume_from_checkpoint=...); позиция
+    в данных восстанавливается по номеру шага.
+    
+    В распределенном обучении и с DeepSpeed/FSDP используется обычное
+    синхронное сохранение Trainer.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._checkpoint_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending_checkpoint: Optional[Future] = None
+    
+    def _can_save_async(self) -> bool:
+        """Проверяет, что состояние обучения целиком находится в этом процессе"""
+        return (self.args.world_size <= 1 and not self.is_deepspeed_enabled
+                and not self.is_fsdp_enabled and not self.args.save_only_model
+                and not getattr(self.args, "push_to_hub", False))
+    
+    def wait_for_checkpoint(self):
+        """Дожидается записи текущей контрольной точки"""
+        if self._pending_checkpoint is None:
+            return
+        try:
+            self._pending_checkpoint.result()
+        except Exception as e:
+            logger.error(f"Ошибка записи контрольной точки: {e}")
+        self._pending_checkpoint = None
+    
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            self.wait_for_checkpoint()
+    
+    def _save_checkpoint(self, model, trial, *args, **kwargs):
+        if not self._can_save_async() or trial is not None:
+            return super()._save_checkpoint(model, trial, *args, **kwargs)
+        
+        # Предыдущая контрольная точка должна быть записана: в памяти держим одну копию
+        self.wait_for_checkpoint()
+        
+        if self.hp_search_backend is None:
+            self.store_flos()
+        for callback in self.callback_handler.callbacks + [self.control]:
+            if isinstance(callback, ExportableState):
+                name = callback.__class__.__name__
+                if isinstance(self.state.stateful_callbacks.get(name), list):
+                    self.state.stateful_callbacks[name].append(callback.state())
+                else:
+                    self.state.stateful_callbacks[name] = callback.state()
+        
+        memo = {}
+        unwrapped = self.accelerator.unwrap_model(self.model)
+        scaler = getattr(self.accelerator, "scaler", None)
+        snapshot = {
+            "model": unwrapped,
+            "model_state": _copy_to_cpu(unwrapped.state_dict(), memo),
+            "optimizer": _copy_to_cpu(self.optimizer.state_dict(), memo),
+            "scheduler": copy.deepcopy(self.lr_scheduler.state_dict()),
+            "scaler": copy.deepcopy(scaler.state_dict()) if scaler is not None else None,
+            "rng": self._rng_state(),
+            "trainer_state": copy.deepcopy(self.state)
+        }
+        
+        output_dir = Path(self._get_output_dir(trial=trial)) / f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}"
+        self._pending_checkpoint = self._checkpoint_executor.submit(self._write_checkpoint, snapshot, output_dir)
+    
+    @staticmethod
+    def _rng_state() -> Dict:
+        """Состояние генераторов случайных чисел в формате Trainer (rng_state.pth)"""
+        rng_state = {
+            "python": random.getstate(),
+            "numpy": np.random.get_state(),
+            "cpu": torch.random.get_rng_state()
+        }
+        if torch.cuda.is_available():
+            rng_state["cuda"] = torch.cuda.random.get_rng_state()
+        return rng_state
+    
+    def _write_checkpoint(self, snapshot: Dict, output_dir: Path):
+        """Записывает копию состояния на диск (выполняется в фоновом потоке)"""
+        tmp_dir = output_dir.with_name(output_dir.name + TMP_SUFFIX)
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+        
+        snapshot["model"].save_pretrained(tmp_dir, state_dict=snapshot["model_state"])
+        processing_class = self.processing_class if hasattr(self, "processing_class") else self.tokenizer
+        if processing_class is not None:
+            processing_class.save_pretrained(tmp_dir)
+        torch.save(self.args, tmp_dir / "training_args.bin")
+        torch.save(snapshot["optimizer"], tmp_dir / OPTIMIZER_NAME)
+        torch.save(snapshot["scheduler"], tmp_dir / SCHEDULER_NAME)
+        if snapshot["scaler"] is not None:
+            torch.save(snapshot["scaler"], tmp_dir / SCALER_NAME)
+        torch.save(snapshot["rng"], tmp_dir / "rng_state.pth")
+        # Состояние Trainer пишется последним: без него контрольная точка не считается полной
+        snapshot["trainer_state"].save_to_json(str(tmp_dir / TRAINER_STATE_NAME))
+        
+        if output_dir.exists():
+            shutil.rmtree(output_dir)
+        os.replace(tmp_dir, output_dir)
+        logger.info(f"Контрольная точка сохранена: {output_dir}")
+        
+        self._remove_old_checkpoints(output_dir.parent)
+    
+    def _remove_old_checkpoints(self, run_dir: Path):
+        """Оставляет save_total_limit последних контрольных точек"""
+        limit = self.args.save_total_limit
+        if not limit:
+            return
+        for path in list_checkpoints(str(run_dir))[:-limit]:
+            logger.info(f"Удаляем старую контрольную точку {path}")
+            shutil.rmtree(path, ignore_errors=True)
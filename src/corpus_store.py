@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Хранилище корпуса обработанных текстов в формате JSON Lines
+Записи только дописываются в конец файла; небольшой индекс рядом с корпусом
+хранит количество записей, смещения строк и диапазоны записей по источникам
+"""
+
+import json
+import os
+import tempfile
+import uuid
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Размер одного смещения в файле смещений (беззнаковое 64-битное число)
+OFFSET_SIZE = 8
+
+class CorpusStore:
+    """
+    Корпус записей вида {'filename': ..., 'text': ..., ...} в файле .jsonl
+    
+    Рядом с корпусом хранятся:
+        <корпус>.offsets - смещения начала каждой записи (массив uint64)
+        <корпус>.idx.json - количество записей, размер корпуса, диапазоны
+            номеров записей для каждого источника и идентификатор корпуса
+            (новый после каждого reset)
+    Количество записей, добавление и чтение записи по номеру не требуют
+    разбора всего корпуса.
+    """
+    
+    def __init__(self, corpus_file: str = "data/processed/pdf_history_data.jsonl",
+                 legacy_json: Optional[str] = None):
+        """
+        Инициализация хранилища
+        
+        Args:
+            corpus_file: Путь к файлу корпуса .jsonl
+            legacy_json: Путь к корпусу в старом формате (JSON-массив). Если корпус
+                .jsonl еще не создан, записи из него переносятся при открытии
+        """
+        self.corpus_file = Path(corpus_file)
+        self.offsets_file = self.corpus_file.with_name(self.corpus_file.name + ".offsets")
+        self.index_file = self.corpus_file.with_name(self.corpus_file.name + ".idx.json")
+        
+        if legacy_json and not self.corpus_file.exists() and Path(legacy_json).exists():
+            self.import_json(legacy_json)
+        
+        self.index = self._load_index()
+    
+    def _empty_index(self, corpus_id: Optional[str] = None) -> Dict:
+        """Индекс пустого корпуса"""
+        return {"count": 0, "size": 0, "sources": {}, "id": corpus_id or uuid.uuid4().hex}
+    
+    def _load_index(self) -> Dict:
+        """
+        Загружает индекс и проверяет его соответствие корпусу
+        
+        Если корпус дописан после сохранения индекса (например, процесс упал
+        между записью данных и индекса), недостающие записи индексируются заново.
+        
+        Returns:
+            Словарь индекса
+        """
+        index = self._empty_index()
+        if self.index_file.exists():
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            except Exception as e:
+                logger.warning(f"Ошибка загрузки индекса корпуса: {e}")
+                index = self._empty_index()
+        
+        corpus_size = self.corpus_file.stat().st_size if self.corpus_file.exists() else 0
+        offsets_count = (self.offsets_file.stat().st_size // OFFSET_SIZE) if self.offsets_file.exists() else 0
+        
+        if index["size"] > corpus_size or offsets_count < index["count"]:
+            logger.warning("Индекс корпуса не соответствует данным, перестраиваем")
+            return self.rebuild_index(index.get("id"))
+        
+        if "id" not in index:
+            # Индекс, сохраненный до появления идентификатора корпуса
+            index["id"] = uuid.uuid4().hex
+            if self.corpus_file.exists():
+                self._save_index(index)
+        
+        if index["size"] < corpus_size:
+            index = self._index_tail(index)
+        
+        return index
+    
+    def _index_tail(self, index: Dict) -> Dict:
+        """
+        Индексирует записи, дописанные после сохранения индекса
+        
+        Неполная последняя строка (прерванная запись) отрезается.
+        
+        Args:
+            index: Текущий индекс
+        
+        Returns:
+            Обновленный индекс
+        """
+        offsets = array('Q')
+        position = index["size"]
+        count = index["count"]
+        
+        with open(self.corpus_file, 'rb') as f:
+            f.seek(position)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                offsets.append(position)
+                self._add_source_range(index, record, count)
+                position += len(line)
+                count += 1
+        
+        if position < self.corpus_file.stat().st_size:
+            logger.warning(f"Отрезаем неполную запись в конце корпуса {self.corpus_file}")
+            with open(self.corpus_file, 'r+b') as f:
+                f.truncate(position)
+        
+        # Смещения после последней проиндексированной записи недействительны
+        with open(self.offsets_file, 'ab') as f:
+            f.truncate(index["count"] * OFFSET_SIZE)
+            offsets.tofile(f)
+        
+        index["count"] = count
+        index["size"] = position
+        self._save_index(index)
+        return index
+    
+    def rebuild_index(self, corpus_id: Optional[str] = None) -> Dict:
+        """
+        Полностью перестраивает индекс по файлу корпуса
+        
+        Args:
+            corpus_id: Идентификатор корпуса (сохраняется, т.к. данные не меняются)
+        
+        Returns:
+            Новый индекс
+        """
+        if self.offsets_file.exists():
+            self.offsets_file.unlink()
+        index = self._empty_index(corpus_id or getattr(self, "index", {}).get("id"))
+        if self.corpus_file.exists():
+            index = self._index_tail(index)
+        else:
+            self._save_index(index)
+        logger.info(f"Индекс корпуса перестроен: {index['count']} записей")
+        return index
+    
+    @staticmethod
+    def _record_source(record: Dict) -> str:
+        """Возвращает имя источника записи"""
+        return str(record.get("filename") or record.get("source") or "неизвестно")
+    
+    def _add_source_range(self, index: Dict, record: Dict, record_id: int):
+        """Добавляет номер записи в диапазоны ее источника"""
+        ranges = index["sources"].setdefault(self._record_source(record), [])
+        if ranges and ranges[-1][1] == record_id:
+            ranges[-1][1] = record_id + 1
+        else:
+            ranges.append([record_id, record_id + 1])
+    
+    def _save_index(self, index: Dict):
+        """Атомарно сохраняет индекс"""
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.index_file.parent, prefix=self.index_file.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def append(self, records: List[Dict]) -> Tuple[int, int]:
+        """
+        Дописывает записи в конец корпуса
+        
+        Args:
+            records: Новые записи
+        
+        Returns:
+            Диапазон номеров добавленных записей [начало, конец)
+        """
+        start = self.index["count"]
+        if not records:
+            return start, start
+        
+        self.corpus_file.parent.mkdir(parents=True, exist_ok=True)
+        offsets = array('Q')
+        position = self.index["size"]
+        lines = []
+        for record_id, record in enumerate(records, start):
+            line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+            lines.append(line)
+            offsets.append(position)
+            self._add_source_range(self.index, record, record_id)
+            position += len(line)
+        
+        # Порядок записи: данные, смещения, индекс. После сбоя на любом шаге
+        # индекс догоняется по данным при следующем открытии
+        with open(self.corpus_file, 'ab') as f:
+            f.write(b''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.offsets_file, 'ab') as f:
+            offsets.tofile(f)
+        
+        self.index["count"] = start + len(records)
+        self.index["size"] = position
+        self._save_index(self.index)
+        
+        logger.info(f"В корпус {self.corpus_file} добавлено {len(records)} записей")
+        return start, self.index["count"]
+    
+    @property
+    def corpus_id(self) -> str:
+        """Идентификатор корпуса: меняется, когда корпус удаляется и строится заново"""
+        return self.index["id"]
+    
+    def __len__(self) -> int:
+        """Количество записей в корпусе"""
+        return self.index["count"]
+    
+    def get(self, record_id: int) -> Dict:
+        """
+        Читает запись по номеру
+        
+        Args:
+            record_id: Номер записи (с нуля, допускаются отрицательные)
+        
+        Returns:
+            Запись корпуса
+        """
+        if record_id < 0:
+            record_id += self.index["count"]
+        if not 0 <= record_id < self.index["count"]:
+            raise IndexError(f"Нет записи с номером {record_id}")
+        
+        with open(self.offsets_file, 'rb') as f:
+            f.seek(record_id * OFFSET_SIZE)
+            offset = array('Q', f.read(OFFSET_SIZE))[0]
+        with open(self.corpus_file, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+    
+    def iter_records(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Последовательно читает записи корпуса, не загружая его целиком
+        
+        Args:
+            start: Номер первой записи
+            stop: Номер записи, следующей за последней (None - до конца)
+        
+        Yields:
+            Записи корпуса
+        """
+        stop = self.index["count"] if stop is None else min(stop, self.index["count"])
+        if start >= stop:
+            return
+        
+        with open(self.offsets_file, 'rb') as f:
+            f.seek(start * OFFSET_SIZE)
+            offset = array('Q', f.read(OFFSET_SIZE))[0]
+        
+        with open(self.corpus_file, 'rb') as f:
+            f.seek(offset)
+            for _ in range(stop - start):
+                yield json.loads(f.readline())
+    
+    def iter_source(self, source: str) -> Iterator[Dict]:
+        """
+        Читает записи одного источника (файла)
+        
+        Args:
+            source: Имя файла-источника
+        
+        Yields:
+            Записи источника
+        """
+        for start, stop in self.index["sources"].get(source, []):
+            yield from self.iter_records(start, stop)
+    
+    def get_sources(self) -> Dict[str, int]:
+        """Возвращает количество записей по каждому источнику"""
+        return {
+            source: sum(stop - start for start, stop in ranges)
+            for source, ranges in self.index["sources"].items()
+        }
+    
+    def import_json(self, json_file: str) -> int:
+        """
+        Переносит записи из корпуса в старом формате (JSON-массив)
+        
+        Args:
+            json_file: Путь к JSON-файлу
+        
+        Returns:
+            Количество перенесенных записей
+        """
+        with open(json_file, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        
+        if not hasattr(self, "index"):
+            self.index = self._empty_index()
+        self.append([record for record in records if isinstance(record, dict)])
+        logger.info(f"Из {json_file} перенесено {len(records)} записей в {self.corpus_file}")
+        return len(records)
+    
+    def reset(self):
+        """Удаляет корпус и его индекс"""
+        for path in (self.corpus_file, self.offsets_file, self.index_file):
+            if path.exists():
+                path.unlink()
+        self.index = self._empty_index()
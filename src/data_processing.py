@@ -6,13 +6,24 @@
 
 import os
 import json
+import time
 import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from corpus_store import CorpusStore
+from text_cache import get_text_cache
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Версии загрузчиков и очистки: увеличиваются при любом изменении результата,
+# чтобы записи кеша текстов, созданные старым кодом, больше не использовались
+EXTRACTOR_VERSION = "1"
+CLEANER_VERSION = "1"
+
 def load_txt_file(file_path):
     """Загружает текстовый файл"""
     try:
@@ -57,37 +68,103 @@ def load_json_file(file_path):
         logger.error(f"Ошибка загрузки JSON: {e}")
         return ""
 
-def load_pdf_file(file_path):
-    """Загружает PDF файл"""
-    text = ""
+def _get_pdf_page_count(file_path):
+    """Возвращает количество страниц PDF (0, если открыть файл не удалось)"""
+    try:
+        import pdfplumber
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+    except ImportError:
+        pass
+    except Exception:
+        pass
+    
+    try:
+        import PyPDF2
+        with open(file_path, 'rb') as f:
+            return len(PyPDF2.PdfReader(f).pages)
+    except ImportError:
+        logger.warning("PyPDF2 не установлен")
+    except Exception as e:
+        logger.error(f"Ошибка загрузки PDF: {e}")
+    
+    return 0
+
+def _extract_pdf_pages_pypdf2(file_path, page_numbers):
+    """Извлекает указанные страницы PDF с помощью PyPDF2 (номер страницы -> текст)"""
+    parts = {}
+    try:
+        import PyPDF2
+        with open(file_path, 'rb') as f:
+            pdf_reader = PyPDF2.PdfReader(f)
+            for page_num in page_numbers:
+                try:
+                    parts[page_num] = pdf_reader.pages[page_num].extract_text() + "\n"
+                except Exception as e:
+                    logger.warning(f"PyPDF2: ошибка чтения страницы {page_num + 1}: {e}")
+    except ImportError:
+        logger.warning("PyPDF2 не установлен")
+    except Exception as e:
+        logger.error(f"Ошибка загрузки PDF: {e}")
+    return parts
+
+def extract_pdf_shard(file_path, start_page, end_page):
+    """
+    Извлекает текст диапазона страниц PDF [start_page, end_page)
+    
+    Сначала используется pdfplumber; страницы, на которых он упал, повторно
+    извлекаются через PyPDF2. Если pdfplumber не дал текста для всего диапазона,
+    на PyPDF2 переводится только этот диапазон, а не весь документ.
+    
+    Args:
+        file_path: Путь к PDF файлу
+        start_page: Первая страница диапазона (с нуля)
+        end_page: Страница, следующая за последней
+        
+    Returns:
+        Список текстов страниц диапазона (с переносом строки в конце)
+    """
+    parts = {}
+    failed_pages = []
     
     # Пробуем pdfplumber (лучше для сложных PDF)
     try:
         import pdfplumber
         with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+            for page_num in range(start_page, end_page):
+                try:
+                    page_text = pdf.pages[page_num].extract_text()
+                    if page_text:
+                        parts[page_num] = page_text + "\n"
+                except Exception:
+                    failed_pages.append(page_num)
     except ImportError:
         logger.warning("pdfplumber не установлен, используем PyPDF2")
+        failed_pages = list(range(start_page, end_page))
     except Exception:
-        pass
+        failed_pages = list(range(start_page, end_page))
     
-    # Fallback на PyPDF2
-    if not text:
-        try:
-            import PyPDF2
-            with open(file_path, 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-        except ImportError:
-            logger.warning("PyPDF2 не установлен")
-        except Exception as e:
-            logger.error(f"Ошибка загрузки PDF: {e}")
+    # Fallback на PyPDF2 в пределах диапазона
+    if not parts:
+        failed_pages = list(range(start_page, end_page))
+    if failed_pages:
+        parts.update(_extract_pdf_pages_pypdf2(file_path, failed_pages))
     
-    return text
+    return [parts[page_num] for page_num in sorted(parts)]
+
+def load_pdf_file(file_path, max_workers=1, pages_per_shard=50):
+    """
+    Загружает PDF файл
+    
+    Документ делится на диапазоны страниц, которые извлекаются независимо
+    (при max_workers > 1 - в отдельных процессах) и склеиваются один раз в конце.
+    
+    Args:
+        file_path: Путь к PDF файлу
+        max_workers: Количество процессов для извлечения (None - по числу ядер)
+        pages_per_shard: Количество страниц в одном диапазоне
+    """
+    return ''.join(iter_pdf_segments(file_path, max_workers=max_workers, pages_per_shard=pages_per_shard))
 
 def load_doc_file(file_path):
     """Загружает DOC файл (старый формат Microsoft Word)"""
@@ -285,13 +362,46 @@ def load_fb2_file(file_path):
         logger.error(f"Ошибка загрузки FB2 файла: {e}")
         return ""
 
-def load_file(file_path):
-    """Загружает файл любого поддерживаемого формата"""
+def load_file(file_path, pdf_workers=1, use_cache=True):
+    """
+    Загружает файл любого поддерживаемого формата
+    
+    Извлеченный текст берется из кеша текстов, если файл с таким же
+    содержимым уже загружался текущей версией загрузчиков.
+    
+    Args:
+        file_path: Путь к файлу
+        pdf_workers: Количество процессов для постраничного извлечения PDF
+            (None - по числу ядер)
+        use_cache: Использовать кеш извлеченного текста
+    """
     file_path = Path(file_path)
     extension = file_path.suffix.lower()
     
+    cache = get_text_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        try:
+            cache_key = cache.file_key(file_path, f"{extension[1:]}-v{EXTRACTOR_VERSION}")
+            cached_text = cache.get(cache_key, 'raw')
+            if cached_text is not None:
+                logger.info(f"Файл {file_path.name} взят из кеша ({len(cached_text)} символов)")
+                return cached_text
+        except OSError as e:
+            logger.warning(f"Кеш текстов недоступен для {file_path.name}: {e}")
+            cache_key = None
+    
     logger.info(f"Загружаем файл: {file_path.name} (формат: {extension})")
     
+    text = _load_file_uncached(file_path, extension, pdf_workers)
+    
+    if cache_key is not None and text:
+        cache.put(cache_key, 'raw', text)
+    
+    return text
+
+def _load_file_uncached(file_path, extension, pdf_workers):
+    """Выбирает загрузчик по расширению файла"""
     if extension == '.txt':
         return load_txt_file(file_path)
     elif extension == '.csv':
@@ -299,7 +409,7 @@ def load_file(file_path):
     elif extension == '.json':
         return load_json_file(file_path)
     elif extension == '.pdf':
-        return load_pdf_file(file_path)
+        return load_pdf_file(file_path, max_workers=pdf_workers)
     elif extension == '.doc':
         return load_doc_file(file_path)
     elif extension == '.docx':
@@ -312,10 +422,30 @@ def load_file(file_path):
         logger.warning(f"Неподдерживаемый формат файла: {extension}")
         return ""
 
-def clean_text(text):
-    """Очищает текст для обучения"""
-    import re
+def clean_text(text, use_cache=True):
+    """
+    Очищает текст для обучения
+    
+    Args:
+        text: Исходный текст
+        use_cache: Использовать кеш очищенного текста
+    """
+    cache = get_text_cache() if use_cache and text else None
+    if cache is not None:
+        cache_key = cache.text_key(text, f"clean-v{CLEANER_VERSION}")
+        cached_text = cache.get(cache_key, 'clean')
+        if cached_text is not None:
+            return cached_text
+    
+    cleaned_text = _clean_text_uncached(text)
+    
+    if cache is not None and cleaned_text:
+        cache.put(cache_key, 'clean', cleaned_text)
     
+    return cleaned_text
+
+def _clean_text_uncached(text):
+    """Фильтрует метаданные и нормализует текст"""
     # Сначала фильтруем метаданные книг
     try:
         from metadata_filter import filter_book_metadata
@@ -326,6 +456,12 @@ def clean_text(text):
     except Exception as e:
         logger.warning(f"Ошибка при фильтрации метаданных: {e}")
     
+    return _normalize_text(text)
+
+def _normalize_text(text):
+    """Нормализует пробелы и удаляет специальные символы"""
+    import re
+    
     # Удаляем лишние пробелы
     text = re.sub(r'\s+', ' ', text)
     
@@ -337,8 +473,43 @@ def clean_text(text):
     
     return text.strip()
 
+def clean_text_stream(segments, block_size=None):
+    """
+    Потоковая очистка текста
+    
+    Принимает итератор страниц или абзацев от загрузчика и выдает очищенные
+    фрагменты по мере готовности, поэтому очистка идет параллельно с
+    извлечением, а в памяти находится только текущий блок. Склеенные через
+    пробел фрагменты совпадают с clean_text для всего текста, кроме
+    метаданных, разрезанных границей блока.
+    
+    Args:
+        segments: Итератор фрагментов исходного текста
+        block_size: Размер блока в символах (None - по умолчанию фильтра)
+        
+    Yields:
+        Очищенные фрагменты текста
+    """
+    try:
+        from metadata_filter import STREAM_BLOCK_SIZE, filter_book_metadata_stream
+    except ImportError:
+        logger.warning("Модуль фильтрации метаданных не найден, пропускаем фильтрацию")
+        blocks = segments
+    else:
+        blocks = filter_book_metadata_stream(segments, block_size or STREAM_BLOCK_SIZE)
+    
+    for block in blocks:
+        cleaned = _normalize_text(block)
+        if cleaned:
+            yield cleaned
+
 def split_text_into_chunks(text, chunk_size=512, overlap=50):
-    """Разбивает текст на чанки для обучения"""
+    """
+    Разбивает текст на чанки по словам
+    
+    Для обучения используйте token_chunker: размер чанка в словах не
+    соответствует длине в токенах, и большая часть чанка теряется при усечении.
+    """
     words = text.split()
     chunks = []
     
@@ -349,7 +520,258 @@ def split_text_into_chunks(text, chunk_size=512, overlap=50):
     
     return chunks
 
-def process_data_directory(data_dir, output_file=None):
+def split_text_stream(segments, chunk_size=512, overlap=50):
+    """
+    Потоково разбивает текст на чанки для обучения
+    
+    Результат совпадает с split_text_into_chunks для текста, склеенного из
+    фрагментов через пробел, но в памяти хранится не больше одного чанка слов.
+    
+    Args:
+        segments: Итератор фрагментов текста
+        chunk_size: Размер чанка в словах
+        overlap: Перекрытие соседних чанков в словах
+        
+    Yields:
+        Чанки текста
+    """
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError("overlap должен быть меньше chunk_size")
+    
+    words = []
+    for segment in segments:
+        words.extend(segment.split())
+        while len(words) >= chunk_size:
+            yield ' '.join(words[:chunk_size])
+            del words[:step]
+    
+    while words:
+        yield ' '.join(words[:chunk_size])
+        del words[:step]
+
+def iter_txt_segments(file_path, segment_size=64 * 1024):
+    """
+    Читает текстовый файл фрагментами из целых строк
+    
+    Кодировка определяется так же, как в load_txt_file, но файл не загружается
+    в память целиком.
+    
+    Args:
+        file_path: Путь к файлу
+        segment_size: Примерный размер фрагмента в символах
+    """
+    for encoding in ['utf-8', 'cp1251', 'latin1']:
+        try:
+            with open(file_path, 'r', encoding=encoding) as f:
+                while f.read(segment_size):
+                    pass
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise ValueError(f"Не удалось декодировать файл {file_path}")
+    
+    with open(file_path, 'r', encoding=encoding) as f:
+        lines = []
+        size = 0
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= segment_size:
+                yield ''.join(lines)
+                lines = []
+                size = 0
+        if lines:
+            yield ''.join(lines)
+
+def iter_pdf_segments(file_path, max_workers=1, pages_per_shard=50):
+    """
+    Извлекает PDF постранично, выдавая страницы по мере готовности диапазонов
+    
+    Args:
+        file_path: Путь к PDF файлу
+        max_workers: Количество процессов для извлечения (None - по числу ядер)
+        pages_per_shard: Количество страниц в одном диапазоне
+        
+    Yields:
+        Тексты страниц в порядке документа
+    """
+    page_count = _get_pdf_page_count(file_path)
+    if not page_count:
+        return
+    
+    shards = [
+        (str(file_path), start, min(start + pages_per_shard, page_count))
+        for start in range(0, page_count, pages_per_shard)
+    ]
+    
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(shards)))
+    
+    if max_workers == 1:
+        for shard in shards:
+            yield from extract_pdf_shard(*shard)
+        return
+    
+    logger.info(f"Извлекаем PDF {Path(file_path).name}: {page_count} страниц, "
+                f"{len(shards)} диапазонов, процессов {max_workers}")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        shard_iter = iter(shards)
+        
+        # В работе не больше 2 * max_workers диапазонов, чтобы извлеченные
+        # страницы не копились быстрее, чем их потребляет очистка
+        for shard in shard_iter:
+            pending.append(executor.submit(extract_pdf_shard, *shard))
+            if len(pending) >= 2 * max_workers:
+                break
+        
+        while pending:
+            yield from pending.popleft().result()
+            next_shard = next(shard_iter, None)
+            if next_shard is not None:
+                pending.append(executor.submit(extract_pdf_shard, *next_shard))
+
+def iter_file_segments(file_path, pdf_workers=1):
+    """
+    Загружает файл как поток фрагментов (страниц или абзацев)
+    
+    TXT и PDF читаются по частям; для остальных форматов загрузчик возвращает
+    текст целиком, и он выдается одним фрагментом.
+    
+    Args:
+        file_path: Путь к файлу
+        pdf_workers: Количество процессов для постраничного извлечения PDF
+        
+    Yields:
+        Фрагменты исходного текста в порядке документа
+    """
+    file_path = Path(file_path)
+    extension = file_path.suffix.lower()
+    
+    if extension == '.txt':
+        yield from iter_txt_segments(file_path)
+    elif extension == '.pdf':
+        yield from iter_pdf_segments(file_path, max_workers=pdf_workers)
+    else:
+        text = _load_file_uncached(file_path, extension, pdf_workers)
+        if text:
+            yield text
+
+def iter_file_chunks(file_path, chunk_size=512, overlap=50, pdf_workers=1):
+    """
+    Потоковый конвейер извлечение -> фильтрация и очистка -> чанки
+    
+    Args:
+        file_path: Путь к файлу
+        chunk_size: Размер чанка в словах
+        overlap: Перекрытие соседних чанков в словах
+        pdf_workers: Количество процессов для постраничного извлечения PDF
+        
+    Yields:
+        Чанки очищенного текста
+    """
+    segments = iter_file_segments(file_path, pdf_workers=pdf_workers)
+    yield from split_text_stream(clean_text_stream(segments), chunk_size, overlap)
+
+def process_single_file(file_path, stream=False):
+    """
+    Загружает и очищает один файл (единица работы для пула процессов)
+    
+    Args:
+        file_path: Путь к файлу
+        stream: Очищать текст потоково, по мере извлечения страниц (кеш текстов
+            не используется, исходный текст целиком в памяти не хранится)
+        
+    Returns:
+        Словарь с результатом: очищенный текст, длина исходного текста,
+        время обработки и текст ошибки (если была)
+    """
+    file_path = Path(file_path)
+    started = time.perf_counter()
+    result = {
+        "file_path": str(file_path),
+        "filename": file_path.name,
+        "original_length": 0,
+        "text": "",
+        "elapsed": 0.0,
+        "error": None
+    }
+    
+    try:
+        if stream:
+            def counted(segments):
+                for segment in segments:
+                    result["original_length"] += len(segment)
+                    yield segment
+            
+            result["text"] = ' '.join(clean_text_stream(counted(iter_file_segments(file_path))))
+        else:
+            text = load_file(file_path)
+            if text:
+                result["original_length"] = len(text)
+                result["text"] = clean_text(text)
+    except Exception as e:
+        result["error"] = str(e)
+    
+    result["elapsed"] = time.perf_counter() - started
+    return result
+
+def process_files(file_paths, max_workers=1, max_in_flight=None, stream=False):
+    """
+    Обрабатывает файлы (загрузка + очистка), при необходимости в пуле процессов
+    
+    Результаты выдаются строго в порядке file_paths, независимо от того,
+    в каком порядке завершились рабочие процессы.
+    
+    Args:
+        file_paths: Список путей к файлам
+        max_workers: Количество рабочих процессов (1 - последовательная обработка,
+            None - по числу ядер процессора)
+        max_in_flight: Максимальное число файлов, одновременно находящихся в обработке
+            (по умолчанию 2 * max_workers)
+        stream: Потоковая очистка текста (см. process_single_file)
+        
+    Yields:
+        Словари с результатами process_single_file
+    """
+    file_paths = list(file_paths)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(file_paths) or 1))
+    
+    if max_workers == 1:
+        for file_path in file_paths:
+            yield process_single_file(file_path, stream)
+        return
+    
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
+    max_in_flight = max(max_in_flight, max_workers)
+    
+    logger.info(f"Параллельная обработка {len(file_paths)} файлов: "
+                f"процессов {max_workers}, в обработке до {max_in_flight}")
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        paths = iter(file_paths)
+        
+        # Ограниченная очередь: новые файлы отправляются только по мере
+        # получения результатов, поэтому в памяти не копятся тексты всего корпуса
+        for file_path in paths:
+            pending.append(executor.submit(process_single_file, file_path, stream))
+            if len(pending) >= max_in_flight:
+                break
+        
+        while pending:
+            yield pending.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(executor.submit(process_single_file, next_path, stream))
+
+def process_data_directory(data_dir, output_file=None, max_workers=1, max_in_flight=None, stream=False):
     """Обрабатывает все файлы в директории"""
     data_dir = Path(data_dir)
     all_text = []
@@ -362,28 +784,44 @@ def process_data_directory(data_dir, output_file=None):
     # Поддерживаемые форматы
     supported_extensions = {'.txt', '.csv', '.json', '.pdf', '.doc', '.docx', '.djvu', '.fb2'}
     
-    for file_path in data_dir.iterdir():
-        if file_path.is_file() and file_path.suffix.lower() in supported_extensions:
-            try:
-                text = load_file(file_path)
-                if text:
-                    cleaned_text = clean_text(text)
-                    if cleaned_text:
-                        all_text.append(cleaned_text)
-                        
-                        # Создаем структурированные данные для JSON
-                        structured_item = {
-                            "text": cleaned_text,
-                            "source": file_path.suffix.lower()[1:],  # убираем точку
-                            "filename": file_path.name,
-                            "category": "общее",
-                            "period": "неизвестно"
-                        }
-                        structured_data.append(structured_item)
-                        
-                        logger.info(f"Обработан файл: {file_path.name} ({len(cleaned_text)} символов)")
-            except Exception as e:
-                logger.error(f"Ошибка обработки файла {file_path.name}: {e}")
+    # Сортируем файлы, чтобы порядок результатов не зависел от файловой системы
+    file_paths = sorted(
+        file_path for file_path in data_dir.iterdir()
+        if file_path.is_file() and file_path.suffix.lower() in supported_extensions
+    )
+    
+    failed_files = []
+    total_started = time.perf_counter()
+    
+    for result in process_files(file_paths, max_workers=max_workers, max_in_flight=max_in_flight,
+                                stream=stream):
+        if result["error"]:
+            failed_files.append(result["filename"])
+            logger.error(f"Ошибка обработки файла {result['filename']}: {result['error']}")
+            continue
+        
+        cleaned_text = result["text"]
+        if cleaned_text:
+            all_text.append(cleaned_text)
+            
+            # Создаем структурированные данные для JSON
+            file_path = Path(result["file_path"])
+            structured_item = {
+                "text": cleaned_text,
+                "source": file_path.suffix.lower()[1:],  # убираем точку
+                "filename": file_path.name,
+                "category": "общее",
+                "period": "неизвестно"
+            }
+            structured_data.append(structured_item)
+            
+            logger.info(f"Обработан файл: {file_path.name} ({len(cleaned_text)} символов, "
+                        f"{result['elapsed']:.1f} с)")
+    
+    logger.info(f"Обработано файлов: {len(structured_data)} из {len(file_paths)} "
+                f"за {time.perf_counter() - total_started:.1f} с")
+    if failed_files:
+        logger.warning(f"Не удалось обработать {len(failed_files)} файлов: {', '.join(failed_files)}")
     
     # Сохраняем в обычный текстовый файл
     if output_file:
@@ -392,13 +830,13 @@ def process_data_directory(data_dir, output_file=None):
                 f.write(text + '\n\n')
         logger.info(f"Обработанные данные сохранены в: {output_file}")
     
-    # Сохраняем в JSON файл для обучения модели
-    json_output = data_dir.parent / "processed" / "pdf_history_data.json"
-    json_output.parent.mkdir(exist_ok=True)
-    
-    with open(json_output, 'w', encoding='utf-8') as f:
-        json.dump(structured_data, f, ensure_ascii=False, indent=2)
-    logger.info(f"Структурированные данные сохранены в: {json_output}")
+    # Дописываем в корпус для обучения модели файлы, которых в нем еще нет
+    corpus_file = data_dir.parent / "processed" / "pdf_history_data.jsonl"
+    corpus = CorpusStore(corpus_file, legacy_json=corpus_file.with_suffix(".json"))
+    known_sources = corpus.get_sources()
+    new_records = [item for item in structured_data if item["filename"] not in known_sources]
+    corpus.append(new_records)
+    logger.info(f"Структурированные данные сохранены в: {corpus_file} (новых записей: {len(new_records)})")
     
     return all_text
 
@@ -416,14 +854,26 @@ def get_supported_formats():
 
 if __name__ == "__main__":
     # Тестирование
+    import argparse
     import sys
     
     if len(sys.argv) > 1:
-        data_dir = sys.argv[1]
-        output_file = sys.argv[2] if len(sys.argv) > 2 else None
-        process_data_directory(data_dir, output_file)
+        parser = argparse.ArgumentParser(description='Обработка данных для обучения')
+        parser.add_argument('data_dir', help='Директория с данными')
+        parser.add_argument('output_file', nargs='?', help='Выходной текстовый файл')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Количество процессов для параллельной обработки (0 - по числу ядер)')
+        parser.add_argument('--max-in-flight', type=int,
+                            help='Максимальное число файлов в обработке одновременно')
+        parser.add_argument('--stream', action='store_true',
+                            help='Потоковая очистка текста по мере извлечения страниц')
+        args = parser.parse_args()
+        process_data_directory(args.data_dir, args.output_file,
+                               max_workers=args.workers or None,
+                               max_in_flight=args.max_in_flight,
+                               stream=args.stream)
     else:
-        print("Использование: python data_processing.py <директория_с_данными> [выходной_файл]")
+        print("Использование: python data_processing.py <директория_с_данными> [выходной_файл] [--workers N]")
         print("\nПоддерживаемые форматы:")
         for ext, desc in get_supported_formats().items():
             print(f"  .{ext} - {desc}")
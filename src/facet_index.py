@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Индексы записей корпуса по категории, веку и упомянутым годам
+Метки category/period проставляются при извлечении (PDFHistoryReader); индексы хранятся
+рядом с корпусом и дополняются новыми записями
+"""
+
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Версия формата индекса; при изменении индекс строится заново
+FACET_INDEX_VERSION = "1"
+
+_ROMAN_VALUES = {'I': 1, 'V': 5, 'X': 10, 'L': 50}
+_century_re = re.compile(r'\b([IVXL]+|\d{1,2})\b(?:\s*(?:век|в\.))?', re.IGNORECASE)
+_year_re = re.compile(r'\b(\d{3,4})\s*(?:году?|г\.)')
+
+def _roman_to_int(roman: str) -> Optional[int]:
+    values = [_ROMAN_VALUES[ch] for ch in roman.upper()]
+    total = sum(-v if i + 1 < len(values) and v < values[i + 1] else v for i, v in enumerate(values))
+    return total if total > 0 else None
+
+def normalize_century(period: str) -> Optional[int]:
+    """
+    Номер века из метки периода ('XVIII век', '18 век', 'xviii')
+    
+    Args:
+        period: Метка периода
+    
+    Returns:
+        Номер века или None, если век не указан
+    """
+    match = _century_re.search(period or '')
+    if not match:
+        return None
+    value = match.group(1)
+    century = int(value) if value.isdigit() else _roman_to_int(value)
+    return century if century and 1 <= century <= 21 else None
+
+def extract_years(text: str) -> List[int]:
+    """Годы, упомянутые в тексте ('в 1812 году', '1703 г.')"""
+    return sorted({int(year) for year in _year_re.findall(text)})
+
+class FacetIndex:
+    """
+    Номера записей корпуса по значениям фасетов
+    
+    categories - категория (в нижнем регистре) -> номера записей
+    centuries - номер века из метки period -> номера записей
+    periods - исходная метка period (в нижнем регистре) -> номера записей
+    years - пары (год, номер записи), упорядоченные по году
+    corpus - идентификатор корпуса, по которому построен индекс
+    
+    Для корпуса .jsonl индекс хранится в <корпус>.facets.json.
+    """
+    
+    def __init__(self, corpus, index_file: Optional[str] = None):
+        """
+        Инициализация индекса
+        
+        Args:
+            corpus: CorpusStore или список записей (для списка индекс не сохраняется)
+            index_file: Файл индекса (по умолчанию <корпус>.facets.json)
+        """
+        self.corpus = corpus
+        corpus_file = getattr(corpus, 'corpus_file', None)
+        if index_file is None and corpus_file is not None:
+            index_file = corpus_file.with_name(corpus_file.name + ".facets.json")
+        self.index_file = Path(index_file) if index_file else None
+        self.index = self._load()
+        self._build_years()
+    
+    def _empty_index(self) -> Dict:
+        return {"version": FACET_INDEX_VERSION, "corpus": None, "records": 0, "categories": {}, "centuries": {},
+                "periods": {}, "years": []}
+    
+    def _load(self) -> Dict:
+        if self.index_file and self.index_file.exists():
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get("version") == FACET_INDEX_VERSION:
+                    return index
+            except Exception as e:
+                logger.warning(f"Ошибка загрузки индекса фасетов: {e}")
+        return self._empty_index()
+    
+    def _save(self):
+        """Атомарно сохраняет индекс"""
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.index_file.parent, prefix=self.index_file.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def _build_years(self):
+        """Массивы годов для поиска диапазона бинарным поиском"""
+        pairs = np.array(self.index["years"], dtype=np.int64).reshape(-1, 2)
+        pairs = pairs[np.argsort(pairs[:, 0], kind='stable')]
+        self._years, self._year_records = pairs[:, 0], pairs[:, 1]
+    
+    def __len__(self) -> int:
+        return self.index["records"]
+    
+    def update(self) -> int:
+        """
+        Добавляет в индекс записи, появившиеся в корпусе после последнего обновления
+        
+        Returns:
+            Количество проиндексированных записей
+        """
+        corpus_id = getattr(self.corpus, 'corpus_id', None)
+        indexed_id = self.index.get("corpus")
+        if corpus_id and indexed_id and corpus_id != indexed_id or self.index["records"] > len(self.corpus):
+            logger.warning("Индекс фасетов построен по другому корпусу и строится заново")
+            self.index = self._empty_index()
+            self._build_years()
+        self.index["corpus"] = corpus_id
+        start = self.index["records"]
+        if start == len(self.corpus):
+            return 0
+        
+        records = self.corpus.iter_records(start) if hasattr(self.corpus, 'iter_records') else self.corpus[start:]
+        for record_id, record in enumerate(records, start):
+            category = (record.get('category') or '').lower()
+            if category:
+                self.index["categories"].setdefault(category, []).append(record_id)
+            period = (record.get('period') or '').lower()
+            if period:
+                self.index["periods"].setdefault(period, []).append(record_id)
+                century = normalize_century(period)
+                if century:
+                    self.index["centuries"].setdefault(str(century), []).append(record_id)
+            self.index["years"].extend([year, record_id] for year in extract_years(record.get('text', '')))
+        
+        added = len(self.corpus) - start
+        self.index["records"] = len(self.corpus)
+        self._build_years()
+        if self.index_file:
+            self._save()
+        logger.info(f"Индекс фасетов обновлен: {added} записей")
+        return added
+    
+    def by_category(self, category: str) -> List[int]:
+        """Номера записей категории"""
+        return self.index["categories"].get(category.lower(), [])
+    
+    def by_period(self, period: str) -> List[int]:
+        """
+        Номера записей периода
+        
+        Век сравнивается по номеру ('XVIII век', '18 век' и 'xviii'
+        равнозначны); другие метки - по вхождению в исходную метку периода.
+        """
+        century = normalize_century(period)
+        if century:
+            return self.index["centuries"].get(str(century), [])
+        period = period.lower()
+        if period in self.index["periods"]:
+            return self.index["periods"][period]
+        return sorted({record_id for label, ids in self.index["periods"].items() if period in label
+                       for record_id in ids})
+    
+    def by_years(self, year_from: Optional[int] = None, year_to: Optional[int] = None) -> List[int]:
+        """Номера записей, упоминающих год из диапазона [year_from, year_to]"""
+        lo = 0 if year_from is None else int(np.searchsorted(self._years, year_from, side='left'))
+        hi = len(self._years) if year_to is None else int(np.searchsorted(self._years, year_to, side='right'))
+        return np.unique(self._year_records[lo:hi]).tolist()
+    
+    def select(self, category: Optional[str] = None, period: Optional[str] = None,
+               year_from: Optional[int] = None, year_to: Optional[int] = None) -> Optional[List[int]]:
+        """
+        Пересечение фасетов
+        
+        Returns:
+            Упорядоченные номера записей или None, если ни один фасет не задан
+        """
+        selected = None
+        facets = []
+        if category:
+            facets.append(self.by_category(category))
+        if period:
+            facets.append(self.by_period(period))
+        if year_from is not None or year_to is not None:
+            facets.append(self.by_years(year_from, year_to))
+        for ids in sorted(facets, key=len):
+            selected = set(ids) if selected is None else selected.intersection(ids)
+        return sorted(selected) if selected is not None else None
+    
+    def get_categories(self) -> Dict[str, int]:
+        """Категории и количество записей в них"""
+        return {category: len(ids) for category, ids in self.index["categories"].items()}
+    
+    def reset(self):
+        """Удаляет данные индекса"""
+        if self.index_file and self.index_file.exists():
+            self.index_file.unlink()
+        self.index = self._empty_index()
+        self._build_years()
@@ -4,86 +4,201 @@
 Система отслеживания изученных файлов для инкрементального обучения
 """
 
-import json
-import hashlib
-import os
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Tuple
 import logging
 
+from text_cache import hash_file
+from tracking_storage import JSONTrackingStorage, SQLiteTrackingStorage, migrate_json_to_sqlite
+
 logger = logging.getLogger(__name__)
 
+# Отметка в базе SQLite о том, что JSON-файл отслеживания уже перенесен
+MIGRATED_META_KEY = "migrated_from_json"
+
 class FileTracker:
     """
     Класс для отслеживания изученных файлов
     """
     
-    def __init__(self, tracking_file: str = "data/processed/learned_files.json"):
+    def __init__(self, tracking_file: str = "data/processed/learned_files.json",
+                 hash_algorithm: str = "md5", use_journal: bool = False, compact_every: int = 1000,
+                 backend: str = "json"):
         """
         Инициализация трекера файлов
         
         Args:
             tracking_file: Путь к файлу отслеживания
+            hash_algorithm: Алгоритм хеширования новых записей ('md5', 'blake2b', ...).
+                Записи, сохраненные с другим алгоритмом, проверяются своим алгоритмом
+            use_journal: Дописывать изменения в журнал вместо перезаписи всего файла (JSON)
+            compact_every: Количество записей журнала, после которого он сворачивается
+                в основной файл отслеживания (JSON)
+            backend: Хранилище данных: 'json' или 'sqlite'. База SQLite создается рядом
+                с JSON-файлом (расширение .sqlite) и при первом открытии заполняется из него
         """
-        self.tracking_file = Path(tracking_file)
-        self.tracking_file.parent.mkdir(parents=True, exist_ok=True)
-        self.learned_files = self._load_tracking_data()
+        self.hash_algorithm = hash_algorithm
+        # JSON-файл, из которого заполнена база SQLite (сбрасывается вместе с ней)
+        self.legacy_json_file = None
+        
+        if backend == "json":
+            self.storage = JSONTrackingStorage(tracking_file, use_journal=use_journal,
+                                               compact_every=compact_every)
+        elif backend == "sqlite":
+            json_file = Path(tracking_file)
+            db_file = json_file.with_suffix(".sqlite") if json_file.suffix == ".json" else json_file
+            self.storage = SQLiteTrackingStorage(db_file)
+            if json_file != db_file:
+                self.legacy_json_file = json_file
+                # Перенос выполняется один раз: после сброса пустая база не заполняется снова
+                if not self.storage.get_meta(MIGRATED_META_KEY):
+                    if self.storage.is_empty() and json_file.exists():
+                        self.storage.close()
+                        migrate_json_to_sqlite(json_file, db_file)
+                        self.storage = SQLiteTrackingStorage(db_file)
+                    self.storage.set_meta(MIGRATED_META_KEY, True)
+        else:
+            raise ValueError(f"Неподдерживаемое хранилище отслеживания: {backend}")
+        
+        self.tracking_file = self.storage.path
+        
+        # Хеши, вычисленные за текущий запуск: (путь, алгоритм) -> (снимок stat, хеш)
+        self._hash_cache = {}
+        
+        # Изменения, еще не записанные в хранилище: путь -> запись
+        self._pending = {}
+        self._last_update = None
+        self._batch_depth = 0
     
-    def _load_tracking_data(self) -> Dict:
+    def _get_file_info(self, file_key: str) -> Optional[Dict]:
         """
-        Загружает данные отслеживания из файла
+        Возвращает запись о файле с учетом еще не сохраненных изменений
         
+        Args:
+            file_key: Путь к файлу
+            
         Returns:
-            Словарь с информацией об изученных файлах
-        """
-        if self.tracking_file.exists():
-            try:
-                with open(self.tracking_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logger.info(f"Загружены данные о {len(data.get('files', {}))} изученных файлах")
-                    return data
-            except Exception as e:
-                logger.warning(f"Ошибка загрузки файла отслеживания: {e}")
-        
-        return {
-            "files": {},
-            "last_update": None,
-            "total_files_learned": 0
-        }
+            Запись о файле или None
+        """
+        if file_key in self._pending:
+            return self._pending[file_key]
+        return self.storage.get(file_key)
+    
+    def _record_change(self, file_key: str, file_info: Dict):
+        """
+        Регистрирует измененную запись и сохраняет ее, если нет открытого пакета
+        
+        Args:
+            file_key: Путь к файлу
+            file_info: Новая запись о файле
+        """
+        self._pending[file_key] = file_info
+        if self._batch_depth == 0:
+            self.flush()
+    
+    def flush(self):
+        """
+        Записывает накопленные изменения в хранилище
+        """
+        if not self._pending:
+            return
+        
+        changes, self._pending = self._pending, {}
+        self.storage.save(changes, self._last_update)
     
-    def _save_tracking_data(self):
+    def compact(self):
         """
-        Сохраняет данные отслеживания в файл
+        Сворачивает журнал изменений хранилища в основной файл
         """
+        self.flush()
+        self.storage.compact()
+    
+    @contextmanager
+    def batch(self):
+        """
+        Пакет изменений: все отметки внутри блока сохраняются одной записью
+        
+        При исключении внутри блока изменения пакета отменяются.
+        
+        Пример:
+            with tracker.batch():
+                for file_path in files:
+                    tracker.mark_file_as_learned(file_path, length, "method")
+        """
+        outermost = self._batch_depth == 0
+        
+        self._batch_depth += 1
         try:
-            with open(self.tracking_file, 'w', encoding='utf-8') as f:
-                json.dump(self.learned_files, f, ensure_ascii=False, indent=2)
-            logger.info(f"Данные отслеживания сохранены в {self.tracking_file}")
-        except Exception as e:
-            logger.error(f"Ошибка сохранения файла отслеживания: {e}")
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if outermost:
+                self._pending = {}
+                logger.warning("Пакет изменений отслеживания отменен")
+            raise
+        
+        self._batch_depth -= 1
+        if outermost:
+            self.flush()
     
-    def _get_file_hash(self, file_path: Path) -> str:
+    @staticmethod
+    def _get_stat_signature(file_path: Path) -> Optional[Tuple[int, int, int]]:
+        """
+        Возвращает снимок метаданных файла (размер, mtime в наносекундах, inode)
+        
+        Args:
+            file_path: Путь к файлу
+            
+        Returns:
+            Кортеж (size, mtime_ns, inode) или None, если файл недоступен
+        """
+        try:
+            stat = file_path.stat()
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    
+    def _get_file_hash(self, file_path: Path, algorithm: Optional[str] = None) -> str:
         """
         Вычисляет хеш файла для отслеживания изменений
         
+        Файл читается блоками, а результат запоминается до конца запуска,
+        пока не изменились размер, время модификации и inode файла.
+        
         Args:
             file_path: Путь к файлу
+            algorithm: Алгоритм хеширования (по умолчанию - алгоритм трекера)
             
         Returns:
-            MD5 хеш файла
+            Хеш файла
         """
+        algorithm = algorithm or self.hash_algorithm
+        cache_key = (str(file_path), algorithm)
+        signature = self._get_stat_signature(file_path)
+        
+        cached = self._hash_cache.get(cache_key)
+        if cached and signature is not None and cached[0] == signature:
+            return cached[1]
+        
         try:
-            with open(file_path, 'rb') as f:
-                file_hash = hashlib.md5(f.read()).hexdigest()
-            return file_hash
+            file_hash = hash_file(file_path, algorithm)
         except Exception as e:
             logger.error(f"Ошибка вычисления хеша файла {file_path}: {e}")
             return ""
+        
+        if signature is not None:
+            self._hash_cache[cache_key] = (signature, file_hash)
+        return file_hash
     
     def is_file_learned(self, file_path: Path) -> bool:
         """
         Проверяет, был ли файл уже изучен
         
+        Если размер, время модификации и inode совпадают с сохраненными,
+        файл считается неизменным без вычисления хеша.
+        
         Args:
             file_path: Путь к файлу
             
@@ -91,12 +206,25 @@ class FileTracker:
             True если файл уже изучен
         """
         file_key = str(file_path)
-        if file_key in self.learned_files["files"]:
+        file_info = self._get_file_info(file_key)
+        if file_info is not None:
+            # Быстрая проверка по метаданным файла
+            signature = self._get_stat_signature(file_path)
+            stored_signature = (file_info.get("size"), file_info.get("mtime_ns"), file_info.get("inode"))
+            if signature is not None and signature == stored_signature:
+                logger.info(f"Файл {file_path.name} уже изучен (метаданные не изменились)")
+                return True
+            
             # Проверяем, не изменился ли файл
-            current_hash = self._get_file_hash(file_path)
-            stored_hash = self.learned_files["files"][file_key]["hash"]
+            current_hash = self._get_file_hash(file_path, file_info.get("hash_algorithm", "md5"))
+            stored_hash = file_info["hash"]
             
             if current_hash == stored_hash:
+                # Запоминаем новые метаданные, чтобы в следующий раз не хешировать файл
+                if signature is not None:
+                    file_info = dict(file_info)
+                    file_info["size"], file_info["mtime_ns"], file_info["inode"] = signature
+                    self._record_change(file_key, file_info)
                 logger.info(f"Файл {file_path.name} уже изучен (хеш совпадает)")
                 return True
             else:
@@ -116,21 +244,23 @@ class FileTracker:
         """
         file_key = str(file_path)
         file_hash = self._get_file_hash(file_path)
+        stat = file_path.stat()
         
-        self.learned_files["files"][file_key] = {
+        file_info = {
             "filename": file_path.name,
             "hash": file_hash,
+            "hash_algorithm": self.hash_algorithm,
             "text_length": text_length,
             "processing_method": processing_method,
             "learned_at": str(Path.cwd()),
-            "size": file_path.stat().st_size
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "inode": stat.st_ino
         }
-        
-        self.learned_files["total_files_learned"] = len(self.learned_files["files"])
-        self.learned_files["last_update"] = str(Path.cwd())
+        self._last_update = str(Path.cwd())
         
         logger.info(f"Файл {file_path.name} отмечен как изученный ({text_length} символов)")
-        self._save_tracking_data()
+        self._record_change(file_key, file_info)
     
     def get_new_files(self, file_paths: List[Path]) -> List[Path]:
         """
@@ -143,37 +273,99 @@ class FileTracker:
             Список новых файлов
         """
         new_files = []
-        for file_path in file_paths:
-            if not self.is_file_learned(file_path):
-                new_files.append(file_path)
+        # Обновленные метаданные неизмененных файлов сохраняются одной записью
+        with self.batch():
+            for file_path in file_paths:
+                if not self.is_file_learned(file_path):
+                    new_files.append(file_path)
         
         logger.info(f"Найдено {len(new_files)} новых файлов из {len(file_paths)} общих")
         return new_files
     
-    def get_learned_files_info(self) -> Dict:
+    def find_files_by_hash(self, file_hash: str) -> List[Tuple[str, Dict]]:
+        """
+        Возвращает изученные файлы с указанным хешем (например, переименованные копии)
+        
+        Args:
+            file_hash: Хеш содержимого файла
+            
+        Returns:
+            Список пар (путь, запись о файле)
+        """
+        self.flush()
+        return self.storage.find_by_hash(file_hash)
+    
+    def get_learned_files_info(self, include_files: bool = True) -> Dict:
         """
         Возвращает информацию об изученных файлах
         
+        Args:
+            include_files: Включить в результат записи обо всех файлах
+            
         Returns:
             Словарь с информацией
         """
-        return {
-            "total_files": len(self.learned_files["files"]),
-            "total_text_length": sum(
-                file_info["text_length"] 
-                for file_info in self.learned_files["files"].values()
-            ),
-            "files": self.learned_files["files"]
+        self.flush()
+        info = self.storage.get_stats()
+        if include_files:
+            info["files"] = self.storage.get_all()
+        return info
+    
+    def get_checkpoint_state(self, checkpoint: str) -> Dict:
+        """
+        Возвращает состояние обучения контрольной точки модели
+        
+        Args:
+            checkpoint: Путь к контрольной точке (директории модели)
+            
+        Returns:
+            Словарь с consumed_records - количеством первых записей корпуса,
+            на которых уже обучена контрольная точка, и source_model - исходной
+            моделью, с которой начато ее обучение (пустой словарь, если
+            контрольная точка еще не обучалась)
+        """
+        checkpoints = self.storage.get_meta("checkpoints") or {}
+        return checkpoints.get(str(checkpoint), {})
+    
+    def record_checkpoint(self, checkpoint: str, consumed_records: int, trained_records: int,
+                          replay_records: int, base_model: str, source_model: Optional[str] = None):
+        """
+        Запоминает, какие записи корпуса использованы для обучения контрольной точки
+        
+        Корпус только дописывается, поэтому использованные записи - это первые
+        consumed_records записей; новыми для контрольной точки будут записи после них.
+        
+        Args:
+            checkpoint: Путь к контрольной точке
+            consumed_records: Количество использованных записей корпуса
+            trained_records: Количество новых записей в последнем обучении
+            replay_records: Количество повторенных старых записей в последнем обучении
+            base_model: Модель, с которой начато последнее обучение
+            source_model: Исходная модель, с которой начато обучение контрольной
+                точки (при дообучении base_model - сама контрольная точка)
+        """
+        checkpoints = self.storage.get_meta("checkpoints") or {}
+        state = checkpoints.get(str(checkpoint), {})
+        checkpoints[str(checkpoint)] = {
+            "consumed_records": consumed_records,
+            "last_trained_records": trained_records,
+            "last_replay_records": replay_records,
+            "base_model": base_model,
+            "source_model": source_model or base_model,
+            "runs": state.get("runs", 0) + 1,
+            "updated_at": datetime.now().isoformat(timespec="seconds")
         }
+        self.storage.set_meta("checkpoints", checkpoints)
+        logger.info(f"Контрольная точка {checkpoint}: использовано {consumed_records} записей корпуса")
     
     def reset_tracking(self):
         """
         Сбрасывает данные отслеживания
         """
-        self.learned_files = {
-            "files": {},
-            "last_update": None,
-            "total_files_learned": 0
-        }
-        self._save_tracking_data()
+        self._pending = {}
+        self.storage.reset()
+        if self.legacy_json_file is not None:
+            self.storage.set_meta(MIGRATED_META_KEY, True)
+            if self.legacy_json_file.exists():
+                JSONTrackingStorage(self.legacy_json_file).reset()
         logger.info("Данные отслеживания сброшены")
@@ -37,6 +37,12 @@ def main():
     parser.add_argument('--max_length', type=int, default=10000, help='Максимальная длина генерируемого текста')
     parser.add_argument('--temperature', type=float, default=0.1, help='Температура генерации')
     parser.add_argument('--num_return_sequences', type=int, default=1, help='Количество вариантов генерации')
+    parser.add_argument('--stream', action='store_true', help='Выводить текст по мере генерации')
+    parser.add_argument('--index', type=str, help='Векторный индекс корпуса: найденные фрагменты добавляются в промпт')
+    parser.add_argument('--corpus', type=str, default='data/processed/pdf_history_data.jsonl',
+                        help='Корпус, по которому построен векторный индекс')
+    parser.add_argument('--top_k', type=int, default=3, help='Количество фрагментов контекста')
+    parser.add_argument('--quantize', choices=['int8'], help='Квантование модели для инференса на CPU')
     
     args = parser.parse_args()
     
@@ -44,17 +50,37 @@ def main():
         # Загружаем модель
         logger.info(f"Загружаем модель из {args.model}")
         model = HistoryAIModel()
-        model.load_trained_model(args.model, task_type='generation')
+        model.load_trained_model(args.model, task_type='generation', quantize=args.quantize)
         logger.info("Модель успешно загружена")
         
+        prompt = args.prompt
+        if args.index:
+            from corpus_store import CorpusStore
+            from vector_index import VectorIndex, build_rag_prompt
+            
+            passages = VectorIndex(args.index, ai_model=model).search(args.prompt, CorpusStore(args.corpus),
+                                                                      top_k=args.top_k)
+            logger.info(f"Найдено фрагментов контекста: {len(passages)}")
+            prompt = build_rag_prompt(args.prompt, passages)
+        
         # Генерируем текст
         logger.info(f"Генерируем текст для промпта: {args.prompt}")
         logger.info(f"Параметры генерации: max_length={args.max_length}, temperature={args.temperature}")
-        result = model.generate_text(
-            prompt=args.prompt,
-            max_length=args.max_length,
-            temperature=args.temperature
-        )
+        if args.stream:
+            # Сырой текст печатается по мере генерации, итоговый ответ - ниже
+            chunks = []
+            for text in model.generate_text_stream(prompt, max_length=args.max_length,
+                                                   temperature=args.temperature):
+                chunks.append(text)
+                print(text, end='', flush=True)
+            print()
+            result = model.finalize_generated_text(''.join(chunks))
+        else:
+            result = model.generate_text(
+                prompt=prompt,
+                max_length=args.max_length,
+                temperature=args.temperature
+            )
         logger.info(f"Генерация завершена, длина результата: {len(result) if result else 0}")
         
         print(f"\n{'='*60}")
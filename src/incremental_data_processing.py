@@ -6,7 +6,6 @@
 
 import os
 import sys
-import json
 from pathlib import Path
 import logging
 from typing import List, Dict, Optional, Union
@@ -14,8 +13,11 @@ from typing import List, Dict, Optional, Union
 # Добавляем путь к модулям
 sys.path.append(str(Path(__file__).parent))
 
-from data_processing import load_file, process_data_directory
+from data_processing import process_data_directory, process_files
 from file_tracker import FileTracker
+from corpus_store import CorpusStore
+from bm25_index import BM25Index
+from facet_index import FacetIndex
 
 logger = logging.getLogger(__name__)
 
@@ -24,23 +26,41 @@ class IncrementalDataProcessor:
     Класс для инкрементальной обработки данных
     """
     
-    def __init__(self, tracking_file: str = "data/processed/learned_files.json"):
+    def __init__(self, tracking_file: str = "data/processed/learned_files.json",
+                 hash_algorithm: str = "md5", use_journal: bool = False, backend: str = "json",
+                 vector_index=None):
         """
         Инициализация процессора
         
         Args:
             tracking_file: Путь к файлу отслеживания
+            hash_algorithm: Алгоритм хеширования файлов ('md5', 'blake2b', ...)
+            use_journal: Вести журнал изменений трекера вместо перезаписи файла
+            backend: Хранилище трекера ('json' или 'sqlite')
+            vector_index: VectorIndex корпуса, в который добавляются фрагменты новых записей
         """
-        self.tracker = FileTracker(tracking_file)
-        self.processed_data_file = Path("data/processed/pdf_history_data.json")
+        self.tracker = FileTracker(tracking_file, hash_algorithm=hash_algorithm,
+                                   use_journal=use_journal, backend=backend)
+        self.processed_data_file = Path("data/processed/pdf_history_data.jsonl")
         self.processed_data_file.parent.mkdir(parents=True, exist_ok=True)
+        
+        # Корпус в старом формате (JSON-массив) переносится в .jsonl при первом запуске
+        self.corpus = CorpusStore(self.processed_data_file,
+                                  legacy_json=self.processed_data_file.with_suffix(".json"))
+        self.vector_index = vector_index
+        self.bm25_index = BM25Index(self.corpus)
+        self.facet_index = FacetIndex(self.corpus)
     
-    def process_new_files(self, data_path: Union[Path, str, List[Path]]) -> List[Dict]:
+    def process_new_files(self, data_path: Union[Path, str, List[Path]], max_workers: Optional[int] = 1,
+                          max_in_flight: Optional[int] = None) -> List[Dict]:
         """
         Обрабатывает только новые файлы
         
         Args:
             data_path: Путь к данным (файл, директория или список файлов)
+            max_workers: Количество процессов для параллельной обработки
+                (1 - последовательно, None - по числу ядер)
+            max_in_flight: Максимальное число файлов в обработке одновременно
             
         Returns:
             Список новых обработанных данных
@@ -54,7 +74,7 @@ class IncrementalDataProcessor:
         elif isinstance(data_path, (str, Path)):
             data_path = Path(data_path)
             if data_path.is_dir():
-                all_files = list(data_path.glob("*"))
+                all_files = sorted(data_path.glob("*"))
                 # Фильтруем только поддерживаемые форматы
                 supported_extensions = {'.pdf', '.txt', '.doc', '.docx', '.djvu', '.fb2'}
                 all_files = [f for f in all_files if f.suffix.lower() in supported_extensions]
@@ -73,83 +93,80 @@ class IncrementalDataProcessor:
         logger.info(f"Обрабатываем {len(new_files)} новых файлов")
         
         new_data = []
-        for file_path in new_files:
-            try:
-                logger.info(f"Обрабатываем новый файл: {file_path.name}")
-                
-                # Обрабатываем файл
-                text = load_file(file_path)
+        # Отметки о файлах сохраняются одной записью после обработки всех файлов
+        with self.tracker.batch():
+            for file_path, result in zip(new_files, process_files(new_files, max_workers=max_workers,
+                                                                  max_in_flight=max_in_flight)):
+                if result["error"]:
+                    logger.error(f"❌ Ошибка обработки файла {file_path.name}: {result['error']}")
+                    continue
                 
-                # Улучшенная валидация текста
-                if text:
-                    # Убираем лишние пробелы и проверяем длину
-                    cleaned_text = text.strip()
+                try:
+                    original_length = result["original_length"]
+                    final_text = result["text"]
                     
-                    if len(cleaned_text) > 200:  # Увеличиваем минимальную длину
-                        # Дополнительная очистка текста
-                        from data_processing import clean_text
-                        final_text = clean_text(cleaned_text)
+                    # Улучшенная валидация текста
+                    if not original_length:
+                        logger.warning(f"⚠️ Файл {file_path.name} не содержит текста или не удалось его извлечь")
+                    elif original_length <= 200:  # Увеличиваем минимальную длину
+                        logger.warning(f"⚠️ Файл {file_path.name} содержит мало текста: {original_length} символов")
+                    elif len(final_text.strip()) > 100:
+                        # Создаем запись данных
+                        data_entry = {
+                            'filename': file_path.name,
+                            'text': final_text,
+                            'original_length': original_length,
+                            'processed_length': len(final_text),
+                            'file_path': str(file_path)
+                        }
+                        new_data.append(data_entry)
                         
-                        if final_text and len(final_text.strip()) > 100:
-                            # Создаем запись данных
-                            data_entry = {
-                                'filename': file_path.name,
-                                'text': final_text,
-                                'original_length': len(text),
-                                'processed_length': len(final_text),
-                                'file_path': str(file_path)
-                            }
-                            new_data.append(data_entry)
-                            
-                            # Отмечаем файл как изученный
-                            self.tracker.mark_file_as_learned(
-                                file_path, 
-                                len(final_text), 
-                                "incremental_processing"
-                            )
-                            
-                            logger.info(f"✅ Файл {file_path.name} обработан: {len(final_text)} символов (исходно: {len(text)})")
-                        else:
-                            logger.warning(f"⚠️ Файл {file_path.name} содержит мало текста после очистки: {len(final_text) if final_text else 0} символов")
+                        # Отмечаем файл как изученный
+                        self.tracker.mark_file_as_learned(
+                            file_path, 
+                            len(final_text), 
+                            "incremental_processing"
+                        )
+                        
+                        logger.info(f"✅ Файл {file_path.name} обработан: {len(final_text)} символов "
+                                    f"(исходно: {original_length}, {result['elapsed']:.1f} с)")
                     else:
-                        logger.warning(f"⚠️ Файл {file_path.name} содержит мало текста: {len(cleaned_text)} символов")
-                else:
-                    logger.warning(f"⚠️ Файл {file_path.name} не содержит текста или не удалось его извлечь")
-                    
-            except Exception as e:
-                logger.error(f"❌ Ошибка обработки файла {file_path.name}: {e}")
-        
-        # Обновляем основной файл данных
-        if new_data:
-            self._update_processed_data_file(new_data)
+                        logger.warning(f"⚠️ Файл {file_path.name} содержит мало текста после очистки: {len(final_text)} символов")
+                        
+                except Exception as e:
+                    logger.error(f"❌ Ошибка обработки файла {file_path.name}: {e}")
+            
+            # Обновляем основной файл данных
+            if new_data:
+                self._update_processed_data_file(new_data)
         
         return new_data
     
     def _update_processed_data_file(self, new_data: List[Dict]):
         """
-        Обновляет основной файл обработанных данных
+        Дописывает новые записи в корпус обработанных данных
         
         Args:
             new_data: Новые данные для добавления
         """
         try:
-            # Загружаем существующие данные
-            existing_data = []
-            if self.processed_data_file.exists():
-                with open(self.processed_data_file, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            
-            # Добавляем новые данные
-            existing_data.extend(new_data)
-            
-            # Сохраняем обновленные данные
-            with open(self.processed_data_file, 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, ensure_ascii=False, indent=2)
-            
+            self.corpus.append(new_data)
             logger.info(f"Файл {self.processed_data_file} обновлен: добавлено {len(new_data)} записей")
-            
         except Exception as e:
             logger.error(f"Ошибка обновления файла данных: {e}")
+            return
+        
+        try:
+            self.bm25_index.update()
+            self.facet_index.update()
+        except Exception as e:
+            logger.error(f"Ошибка обновления индексов корпуса: {e}")
+        
+        if self.vector_index is not None:
+            try:
+                self.vector_index.update(self.corpus)
+            except Exception as e:
+                logger.error(f"Ошибка обновления векторного индекса: {e}")
     
     def get_processing_stats(self) -> Dict:
         """
@@ -158,22 +175,12 @@ class IncrementalDataProcessor:
         Returns:
             Словарь со статистикой
         """
-        learned_info = self.tracker.get_learned_files_info()
-        
-        # Загружаем данные из основного файла
-        total_records = 0
-        if self.processed_data_file.exists():
-            try:
-                with open(self.processed_data_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    total_records = len(data)
-            except:
-                pass
+        learned_info = self.tracker.get_learned_files_info(include_files=False)
         
         return {
             "learned_files": learned_info["total_files"],
             "total_text_length": learned_info["total_text_length"],
-            "total_records": total_records,
+            "total_records": len(self.corpus),
             "tracking_file": str(self.tracker.tracking_file)
         }
     
@@ -182,8 +189,18 @@ class IncrementalDataProcessor:
         Сбрасывает данные обучения
         """
         self.tracker.reset_tracking()
-        if self.processed_data_file.exists():
-            self.processed_data_file.unlink()
+        self.corpus.reset()
+        self.bm25_index.reset()
+        self.facet_index.reset()
+        if self.vector_index is not None:
+            self.vector_index.reset()
+        else:
+            # Индекс в директории по умолчанию иначе ссылался бы на записи удаленного корпуса
+            from vector_index import VectorIndex
+            VectorIndex(self.processed_data_file.parent / "vector_index").reset()
+        legacy_file = self.processed_data_file.with_suffix(".json")
+        if legacy_file.exists():
+            legacy_file.unlink()
         logger.info("Данные обучения сброшены")
 
 def main():
@@ -196,13 +213,35 @@ def main():
     parser.add_argument('--data', type=str, required=True, help='Путь к данным')
     parser.add_argument('--reset', action='store_true', help='Сбросить данные обучения')
     parser.add_argument('--stats', action='store_true', help='Показать статистику')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Количество процессов для параллельной обработки (0 - по числу ядер)')
+    parser.add_argument('--hash', type=str, default='md5', choices=['md5', 'blake2b', 'sha256'],
+                        help='Алгоритм хеширования файлов')
+    parser.add_argument('--journal', action='store_true',
+                        help='Дописывать изменения трекера в журнал вместо перезаписи файла')
+    parser.add_argument('--backend', type=str, default='json', choices=['json', 'sqlite'],
+                        help='Хранилище данных отслеживания (sqlite переносит данные из JSON при первом запуске)')
+    parser.add_argument('--index-model', type=str,
+                        help='Модель для эмбеддингов: новые записи добавляются в векторный индекс корпуса')
+    parser.add_argument('--index', type=str, default='data/processed/vector_index',
+                        help='Директория векторного индекса')
     
     args = parser.parse_args()
     
     # Настройка логирования
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     
-    processor = IncrementalDataProcessor()
+    vector_index = None
+    if args.index_model:
+        from models.history_ai import HistoryAIModel
+        from vector_index import VectorIndex
+        
+        model = HistoryAIModel()
+        model.load_trained_model(args.index_model, task_type='generation')
+        vector_index = VectorIndex(args.index, ai_model=model)
+    
+    processor = IncrementalDataProcessor(hash_algorithm=args.hash, use_journal=args.journal,
+                                         backend=args.backend, vector_index=vector_index)
     
     if args.reset:
         processor.reset_learning()
@@ -222,7 +261,7 @@ def main():
         return
     
     # Обрабатываем новые файлы
-    new_data = processor.process_new_files(data_path)
+    new_data = processor.process_new_files(data_path, max_workers=args.workers or None)
     
     if new_data:
         print(f"✅ Обработано {len(new_data)} новых файлов")
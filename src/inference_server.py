@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Постоянный процесс генерации текста для интерфейсов
+Модель загружается один раз; запросы и ответы передаются строками JSON через stdin/stdout
+
+Протокол (по одному JSON-объекту на строку):
+    запрос:  {"id": 1, "prompt": "...", "max_length": 100, "temperature": 0.7, "stream": true}
+    ответы:  {"id": 1, "type": "token", "text": "..."}  - фрагменты (если stream)
+             {"id": 1, "type": "done", "text": "...", "seconds": 1.2}  - итоговый ответ
+             {"id": 1, "type": "error", "error": "..."}
+    отмена:  {"type": "cancel", "id": 1} - генерация останавливается, ответ done
+             приходит с "cancelled": true
+    после загрузки модели процесс отправляет {"type": "ready", ...};
+    {"type": "shutdown"} завершает процесс
+"""
+
+import argparse
+import json
+import queue
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import logging
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent))
+
+logger = logging.getLogger(__name__)
+
+# Промпт прогревочной генерации при запуске
+WARMUP_PROMPT = "История"
+
+# Период проверки события отмены клиентом, в секундах
+CANCEL_POLL_INTERVAL = 0.1
+
+class InferenceClient:
+    """
+    Клиент постоянного процесса генерации
+    
+    Процесс запускается при первом запросе (или явно через start) и
+    переиспользуется для всех следующих запросов. Запросы выполняются по
+    одному. Если процесс завершился, следующий запрос запускает его заново.
+    Модуль клиента не импортирует torch, поэтому подходит для интерфейсов.
+    """
+    
+    def __init__(self, model_path: str, cwd: Optional[str] = None, python: Optional[str] = None,
+                 startup_timeout: float = 600, quantize: Optional[str] = None):
+        """
+        Инициализация клиента
+        
+        Args:
+            model_path: Путь к обученной модели
+            cwd: Рабочая директория процесса генерации
+            python: Интерпретатор для запуска (по умолчанию текущий)
+            startup_timeout: Время ожидания загрузки модели в секундах
+            quantize: Квантование модели для инференса на CPU ('int8')
+        """
+        self.model_path = model_path
+        self.quantize = quantize
+        self.cwd = cwd
+        self.python = python or sys.executable
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.info = {}
+        self._messages = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+    
+    def is_running(self) -> bool:
+        """Проверяет, что процесс генерации запущен"""
+        return self.process is not None and self.process.poll() is None
+    
+    def start(self) -> Dict:
+        """
+        Запускает процесс генерации и ждет загрузки и прогрева модели
+        
+        Returns:
+            Сообщение готовности процесса (модель, время загрузки и прогрева)
+        """
+        with self._lock:
+            return self._start()
+    
+    def _start(self) -> Dict:
+        if self.is_running():
+            return self.info
+        
+        command = [self.python, str(Path(__file__).resolve()), "--model", self.model_path]
+        if self.quantize:
+            command += ["--quantize", self.quantize]
+        logger.info(f"Запускаем процесс генерации: {' '.join(command)}")
+        creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+        self.process = subprocess.Popen(command, cwd=self.cwd, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, creationflags=creationflags)
+        self._messages = queue.Queue()
+        threading.Thread(target=self._read_messages, args=(self.process, self._messages),
+                         daemon=True).start()
+        
+        message = self._receive(self.startup_timeout)
+        if message.get("type") == "timeout":
+            message = {"type": "error", "error": "превышено время ожидания загрузки модели"}
+        if message.get("type") != "ready":
+            self._stop()
+            raise RuntimeError(f"Процесс генерации не запустился: {message.get('error', message)}")
+        
+        self.info = message
+        logger.info(f"Процесс генерации готов: загрузка {message.get('load_seconds', 0):.1f} с, "
+                    f"прогрев {message.get('warmup_seconds', 0):.1f} с")
+        return message
+    
+    @staticmethod
+    def _read_messages(process: subprocess.Popen, messages: queue.Queue):
+        """Читает ответы процесса в очередь (выполняется в отдельном потоке)"""
+        for line in process.stdout:
+            try:
+                messages.put(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Некорректный ответ процесса генерации: {line[:200]!r}")
+        messages.put({"type": "exit", "error": f"процесс генерации завершился с кодом {process.wait()}"})
+    
+    def _receive(self, timeout: Optional[float]) -> Dict:
+        try:
+            return self._messages.get(timeout=timeout)
+        except queue.Empty:
+            return {"type": "timeout"}
+    
+    def generate(self, prompt: str, max_length: int = 100, temperature: float = 0.7,
+                 on_token: Optional[Callable[[str], None]] = None,
+                 cancel_event: Optional[threading.Event] = None, timeout: float = 600) -> str:
+        """
+        Генерирует ответ в процессе генерации
+        
+        Args:
+            prompt: Промпт
+            max_length: Максимальная длина генерируемого текста
+            temperature: Температура генерации
+            on_token: Функция, получающая фрагменты текста по мере генерации
+            cancel_event: Событие отмены; после него возвращается ответ по уже
+                сгенерированному тексту
+            timeout: Максимальное время ожидания очередного сообщения в секундах
+        
+        Returns:
+            Итоговый ответ
+        """
+        with self._lock:
+            self._start()
+            self._next_id += 1
+            request_id = self._next_id
+            self._send({"id": request_id, "prompt": prompt, "max_length": max_length,
+                        "temperature": temperature, "stream": on_token is not None})
+            
+            cancel_sent = False
+            deadline = time.monotonic() + timeout
+            while True:
+                # С событием отмены очередь опрашивается короткими интервалами
+                wait = max(0.0, deadline - time.monotonic())
+                message = self._receive(min(wait, CANCEL_POLL_INTERVAL) if cancel_event else wait)
+                if cancel_event is not None and cancel_event.is_set() and not cancel_sent:
+                    self._send({"type": "cancel", "id": request_id})
+                    cancel_sent = True
+                if message.get("type") == "timeout":
+                    if time.monotonic() < deadline:
+                        continue
+                    message = {"type": "error", "error": "превышено время ожидания ответа"}
+                deadline = time.monotonic() + timeout
+                message_type = message.get("type")
+                # Процесс завершился или не отвечает: следующий запрос запустит его заново
+                if message_type == "exit" or (message_type == "error" and message.get("id") is None):
+                    self._stop()
+                    raise RuntimeError(message.get("error"))
+                if message.get("id") != request_id:
+                    continue
+                if message_type == "token":
+                    on_token(message["text"])
+                elif message_type == "done":
+                    return message["text"]
+                elif message_type == "error":
+                    raise RuntimeError(message.get("error"))
+    
+    def _send(self, message: Dict):
+        try:
+            self.process.stdin.write((json.dumps(message) + "\n").encode("ascii"))
+            self.process.stdin.flush()
+        except OSError as e:
+            self._stop()
+            raise RuntimeError(f"Процесс генерации недоступен: {e}")
+    
+    def close(self):
+        """Завершает процесс генерации (например, после переобучения модели)"""
+        with self._lock:
+            self._stop()
+    
+    def _stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write(b'{"type": "shutdown"}\n')
+                self.process.stdin.flush()
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        self.process = None
+        self.info = {}
+
+def serve(model_path: str, warmup: bool = True, quantize: Optional[str] = None):
+    """
+    Загружает модель и обрабатывает запросы из stdin до их окончания
+    
+    Args:
+        model_path: Путь к обученной модели
+        warmup: Выполнить прогревочную генерацию перед сообщением готовности
+        quantize: Квантование модели для инференса на CPU ('int8')
+    """
+    # stdout занят протоколом: случайный вывод библиотек уходит в stderr
+    protocol = sys.stdout.buffer
+    sys.stdout = sys.stderr
+    
+    def send(message: Dict):
+        protocol.write((json.dumps(message) + "\n").encode("ascii"))
+        protocol.flush()
+    
+    try:
+        from models.history_ai import HistoryAIModel
+        
+        start = time.perf_counter()
+        model = HistoryAIModel()
+        model.load_trained_model(model_path, task_type='generation', quantize=quantize)
+        model.model.eval()
+        load_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        if warmup:
+            model.generate_text(WARMUP_PROMPT, max_length=len(model.tokenizer(WARMUP_PROMPT).input_ids) + 8)
+        warmup_seconds = time.perf_counter() - start
+    except Exception as e:
+        logger.error(f"Ошибка загрузки модели: {e}")
+        send({"type": "error", "error": str(e)})
+        sys.exit(1)
+    
+    send({"type": "ready", "model": model_path, "quantize": quantize, "load_seconds": load_seconds,
+          "warmup_seconds": warmup_seconds})
+    
+    # stdin читается в отдельном потоке, чтобы отмена приходила во время генерации
+    requests = queue.Queue()
+    cancelled = set()
+    stop_events: Dict[int, threading.Event] = {}
+    
+    def read_requests():
+        for line in sys.stdin.buffer:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Некорректный запрос: {line[:200]!r}")
+                continue
+            if request.get("type") == "shutdown":
+                break
+            if request.get("type") == "cancel":
+                cancelled.add(request.get("id"))
+                stop_events.setdefault(request.get("id"), threading.Event()).set()
+                continue
+            requests.put(request)
+        requests.put(None)
+    
+    threading.Thread(target=read_requests, daemon=True).start()
+    
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        
+        request_id = request.get("id")
+        stop_event = stop_events.setdefault(request_id, threading.Event())
+        start = time.perf_counter()
+        try:
+            chunks: List[str] = []
+            if not stop_event.is_set():
+                for text in model.generate_text_stream(request["prompt"],
+                                                       max_length=request.get("max_length", 100),
+                                                       temperature=request.get("temperature", 0.7),
+                                                       stop_event=stop_event):
+                    chunks.append(text)
+                    if request.get("stream"):
+                        send({"id": request_id, "type": "token", "text": text})
+            send({"id": request_id, "type": "done", "text": model.finalize_generated_text(''.join(chunks)),
+                  "seconds": time.perf_counter() - start, "cancelled": request_id in cancelled})
+        except Exception as e:
+            logger.error(f"Ошибка генерации: {e}")
+            send({"id": request_id, "type": "error", "error": str(e)})
+        finally:
+            stop_events.pop(request_id, None)
+            cancelled.discard(request_id)
+
+def main():
+    parser = argparse.ArgumentParser(description='Постоянный процесс генерации текста')
+    parser.add_argument('--model', type=str, required=True, help='Путь к обученной модели')
+    parser.add_argument('--no-warmup', action='store_true', help='Не выполнять прогревочную генерацию')
+    parser.add_argument('--quantize', choices=['int8'], help='Квантование модели для инференса на CPU')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    serve(args.model, warmup=not args.no_warmup, quantize=args.quantize)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Группировка примеров по длине и динамическое дополнение пакетов
+Пакеты собираются из последовательностей близкой длины и дополняются только до максимума пакета
+"""
+
+from typing import Dict, Iterator, List, Optional, Sequence
+import logging
+
+import torch
+from torch.utils.data import Sampler
+from checkpointing import AsyncCheckpointTrainer
+from token_chunker import IGNORE_INDEX
+
+logger = logging.getLogger(__name__)
+
+def get_example_lengths(dataset) -> List[int]:
+    """
+    Возвращает длины примеров датасета без дополнения
+    
+    Датасеты кеша токенов отдают длины без чтения шардов; для остальных
+    длина считается по attention_mask (или input_ids) каждого примера.
+    
+    Args:
+        dataset: Датасет с примерами input_ids/attention_mask
+    
+    Returns:
+        Список длин
+    """
+    if hasattr(dataset, "example_lengths"):
+        return list(dataset.example_lengths())
+    
+    lengths = []
+    for example in dataset:
+        attention_mask = example.get("attention_mask")
+        if attention_mask is not None:
+            lengths.append(int(sum(attention_mask)))
+        else:
+            lengths.append(len(example["input_ids"]))
+    return lengths
+
+class LengthGroupedSampler(Sampler):
+    """
+    Сэмплер, выдающий индексы пакетами примеров близкой длины
+    
+    Индексы перемешиваются, делятся на мегапакеты по batch_size * megabatch_factor
+    примеров, внутри мегапакета сортируются по убыванию длины и режутся на пакеты;
+    порядок пакетов перемешивается. Так случайность сохраняется, а разброс длин
+    внутри пакета мал.
+    """
+    
+    def __init__(self, lengths: Sequence[int], batch_size: int, megabatch_factor: int = 50,
+                 shuffle: bool = True, seed: int = 42):
+        """
+        Инициализация сэмплера
+        
+        Args:
+            lengths: Длины примеров
+            batch_size: Размер пакета
+            megabatch_factor: Во сколько раз мегапакет больше пакета
+            shuffle: Перемешивать примеры и пакеты (новый порядок в каждой эпохе)
+            seed: Начальное значение генератора случайных чисел
+        """
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.megabatch_size = batch_size * megabatch_factor
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+    
+    def set_epoch(self, epoch: int):
+        """Задает номер эпохи (определяет порядок перемешивания)"""
+        self.epoch = epoch
+    
+    def __len__(self) -> int:
+        return len(self.lengths)
+    
+    def __iter__(self) -> Iterator[int]:
+        count = len(self.lengths)
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            indices = torch.randperm(count, generator=generator).tolist()
+        else:
+            generator = None
+            indices = list(range(count))
+        
+        batches = []
+        for start in range(0, count, self.megabatch_size):
+            megabatch = sorted(indices[start:start + self.megabatch_size],
+                               key=lambda index: self.lengths[index], reverse=True)
+            batches.extend(megabatch[i:i + self.batch_size] for i in range(0, len(megabatch), self.batch_size))
+        
+        # Неполный пакет оставляем последним, чтобы DataLoader не сдвигал границы пакетов
+        tail = batches.pop() if batches and len(batches[-1]) < self.batch_size else None
+        if generator is not None:
+            order = torch.randperm(len(batches), generator=generator).tolist()
+            batches = [batches[i] for i in order]
+        if tail:
+            batches.append(tail)
+        
+        self.epoch += 1
+        for batch in batches:
+            yield from batch
+
+class DynamicPaddingCollator:
+    """
+    Коллатор, дополняющий пакет только до самой длинной последовательности в нем
+    
+    Примеры могут быть уже дополнены (тогда лишнее отрезается по attention_mask)
+    или иметь разную длину. Если labels нет, они строятся из input_ids;
+    дополнение в labels помечается IGNORE_INDEX.
+    """
+    
+    def __init__(self, pad_token_id: int, pad_to_multiple_of: Optional[int] = 8):
+        """
+        Инициализация коллатора
+        
+        Args:
+            pad_token_id: id токена дополнения
+            pad_to_multiple_of: Округлять длину пакета вверх до кратной этому числу
+        """
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+    
+    def __call__(self, features: List[Dict]) -> Dict[str, torch.Tensor]:
+        sequences = []
+        for feature in features:
+            input_ids = torch.as_tensor(feature["input_ids"], dtype=torch.long)
+            attention_mask = feature.get("attention_mask")
+            length = int(torch.as_tensor(attention_mask).sum()) if attention_mask is not None else len(input_ids)
+            labels = feature.get("labels")
+            labels = torch.as_tensor(labels, dtype=torch.long)[:length] if labels is not None else input_ids[:length]
+            sequences.append((input_ids[:length], labels))
+        
+        max_length = max(len(input_ids) for input_ids, _ in sequences)
+        if self.pad_to_multiple_of:
+            max_length = -(-max_length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        
+        batch_input_ids = torch.full((len(sequences), max_length), self.pad_token_id, dtype=torch.long)
+        batch_attention_mask = torch.zeros((len(sequences), max_length), dtype=torch.long)
+        batch_labels = torch.full((len(sequences), max_length), IGNORE_INDEX, dtype=torch.long)
+        for row, (input_ids, labels) in enumerate(sequences):
+            batch_input_ids[row, :len(input_ids)] = input_ids
+            batch_attention_mask[row, :len(input_ids)] = 1
+            batch_labels[row, :len(labels)] = labels
+        
+        return {
+            "input_ids": batch_input_ids,
+            "attention_mask": batch_attention_mask,
+            "labels": batch_labels
+        }
+
+class LengthGroupedTrainer(AsyncCheckpointTrainer):
+    """Trainer, собирающий обучающие пакеты с помощью LengthGroupedSampler"""
+    
+    def __init__(self, *args, example_lengths: Sequence[int] = None, **kwargs):
+        """
+        Инициализация
+        
+        Args:
+            example_lengths: Длины примеров обучающего датасета
+            *args, **kwargs: Аргументы Trainer
+        """
+        super().__init__(*args, **kwargs)
+        self.example_lengths = example_lengths
+    
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.example_lengths is None:
+            return super()._get_train_sampler(*args, **kwargs)
+        return LengthGroupedSampler(self.example_lengths, batch_size=self.args.train_batch_size,
+                                    seed=self.args.seed)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Низкоранговые адаптеры (LoRA) для дообучения моделей
+Обучаются и сохраняются только небольшие матрицы адаптеров; веса базовой модели заморожены
+"""
+
+import json
+import os
+import math
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+import logging
+
+import torch
+import torch.nn as nn
+from safetensors.torch import load_file, save_file
+from transformers.pytorch_utils import Conv1D
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_CONFIG_NAME = "adapter_config.json"
+ADAPTER_WEIGHTS_NAME = "adapter_model.safetensors"
+
+# Проекции внимания GPT-2 (запрос, ключ и значение в одной матрице)
+DEFAULT_TARGET_MODULES = ("c_attn",)
+
+class LoRALinear(nn.Module):
+    """
+    Линейный слой с низкоранговой добавкой: y = base(x) + (x A^T B^T) * alpha / r
+    
+    Поддерживаются nn.Linear и Conv1D из transformers (слои GPT-2, вес хранится
+    транспонированным). B инициализируется нулями, поэтому до обучения слой
+    совпадает с исходным.
+    """
+    
+    def __init__(self, base: nn.Module, r: int = 8, alpha: int = 16, dropout: float = 0.05):
+        """
+        Инициализация слоя
+        
+        Args:
+            base: Исходный слой (nn.Linear или Conv1D)
+            r: Ранг адаптера
+            alpha: Масштаб добавки (итоговый множитель alpha / r)
+            dropout: Вероятность dropout на входе адаптера
+        """
+        super().__init__()
+        if isinstance(base, Conv1D):
+            in_features, out_features = base.weight.shape
+        else:
+            in_features, out_features = base.in_features, base.out_features
+        
+        self.base = base
+        self.scaling = alpha / r
+        self.dropout = nn.Dropout(dropout) if dropout else nn.Identity()
+        weight = base.weight
+        self.lora_A = nn.Parameter(torch.empty(r, in_features, dtype=weight.dtype, device=weight.device))
+        self.lora_B = nn.Parameter(torch.zeros(out_features, r, dtype=weight.dtype, device=weight.device))
+        nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+    
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.base(x) + (self.dropout(x) @ self.lora_A.t() @ self.lora_B.t()) * self.scaling
+    
+    @torch.no_grad()
+    def merged(self) -> nn.Module:
+        """Возвращает исходный слой с добавкой, внесенной в вес"""
+        delta = (self.lora_B @ self.lora_A) * self.scaling
+        if isinstance(self.base, Conv1D):
+            delta = delta.t()
+        self.base.weight.add_(delta.to(self.base.weight.dtype))
+        return self.base
+
+def _lora_layers(model: nn.Module) -> Dict[str, LoRALinear]:
+    """Слои LoRA модели по именам"""
+    return {name: module for name, module in model.named_modules() if isinstance(module, LoRALinear)}
+
+def _replace_module(model: nn.Module, name: str, module: nn.Module):
+    """Заменяет вложенный модуль по полному имени"""
+    parent_name, _, child_name = name.rpartition('.')
+    parent = model.get_submodule(parent_name) if parent_name else model
+    setattr(parent, child_name, module)
+
+def apply_lora(model: nn.Module, r: int = 8, alpha: int = 16, dropout: float = 0.05,
+               target_modules: Sequence[str] = DEFAULT_TARGET_MODULES) -> Dict:
+    """
+    Добавляет адаптеры в слои модели и замораживает остальные веса
+    
+    Args:
+        model: Модель transformers
+        r: Ранг адаптеров
+        alpha: Масштаб добавки
+        dropout: Вероятность dropout на входе адаптеров
+        target_modules: Имена слоев (последняя часть полного имени), получающих адаптер
+    
+    Returns:
+        Конфигурация адаптера
+    """
+    targets = [name for name, module in model.named_modules()
+               if name.rpartition('.')[2] in target_modules and isinstance(module, (nn.Linear, Conv1D))]
+    if not targets:
+        raise ValueError(f"В модели нет слоев {list(target_modules)} для адаптеров")
+    
+    for param in model.parameters():
+        param.requires_grad = False
+    for name in targets:
+        _replace_module(model, name, LoRALinear(model.get_submodule(name), r=r, alpha=alpha, dropout=dropout))
+    
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    total = sum(p.numel() for p in model.parameters())
+    logger.info(f"LoRA: {len(targets)} слоев, обучается {trainable:,} параметров из {total:,} "
+                f"({trainable / total:.2%})")
+    
+    return {"r": r, "alpha": alpha, "dropout": dropout, "target_modules": list(target_modules)}
+
+def merge_lora(model: nn.Module) -> int:
+    """
+    Вносит адаптеры в веса базовой модели и убирает слои LoRA
+    
+    Args:
+        model: Модель с адаптерами
+    
+    Returns:
+        Количество объединенных слоев
+    """
+    layers = _lora_layers(model)
+    for name, layer in layers.items():
+        _replace_module(model, name, layer.merged())
+    return len(layers)
+
+def is_adapter_dir(path: str) -> bool:
+    """Проверяет, что в директории сохранен адаптер, а не полная модель"""
+    return (Path(path) / ADAPTER_CONFIG_NAME).exists()
+
+def read_adapter_config(path: str) -> Dict:
+    """
+    Читает конфигурацию адаптера
+    
+    Локальная базовая модель хранится путем относительно директории адаптера
+    и возвращается путем, по которому ее можно открыть из текущей директории.
+    """
+    with open(Path(path) / ADAPTER_CONFIG_NAME, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if config.pop("base_model_relative", False):
+        config["base_model"] = os.path.normpath(Path(path) / config["base_model"])
+    return config
+
+def save_adapter(model: nn.Module, path: str, config: Dict, base_vocab_size: Optional[int] = None):
+    """
+    Сохраняет веса адаптеров и их конфигурацию
+    
+    Строки эмбеддингов для токенов, добавленных к словарю базовой модели,
+    сохраняются вместе с адаптером: иначе при загрузке они были бы
+    инициализированы заново.
+    
+    Args:
+        model: Модель с адаптерами
+        path: Директория сохранения
+        config: Конфигурация адаптера (из apply_lora, с base_model)
+        base_vocab_size: Размер словаря базовой модели
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    
+    tensors = {}
+    for name, layer in _lora_layers(model).items():
+        tensors[f"{name}.lora_A"] = layer.lora_A.detach().cpu().contiguous()
+        tensors[f"{name}.lora_B"] = layer.lora_B.detach().cpu().contiguous()
+    
+    embeddings = model.get_input_embeddings().weight
+    if base_vocab_size and embeddings.shape[0] > base_vocab_size:
+        tensors["extra_embeddings"] = embeddings[base_vocab_size:].detach().cpu().contiguous()
+    
+    config = dict(config, base_vocab_size=base_vocab_size)
+    # Путь к локальной базовой модели сохраняется относительно адаптера ("." - та же
+    # директория), чтобы адаптер загружался из любой рабочей директории
+    base_model = config.get("base_model")
+    if base_model and Path(base_model).is_dir():
+        config["base_model"] = os.path.relpath(Path(base_model).resolve(), path.resolve())
+        config["base_model_relative"] = True
+    
+    save_file(tensors, str(path / ADAPTER_WEIGHTS_NAME))
+    with open(path / ADAPTER_CONFIG_NAME, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    
+    logger.info(f"Адаптер сохранен в {path} ({(path / ADAPTER_WEIGHTS_NAME).stat().st_size / 1024 / 1024:.1f} МБ)")
+
+def load_adapter(model: nn.Module, path: str, merge: bool = True) -> Dict:
+    """
+    Загружает адаптер в базовую модель
+    
+    Args:
+        model: Базовая модель (со словарем того же размера, что при обучении)
+        path: Директория адаптера
+        merge: Внести адаптер в веса модели (для инференса без накладных
+            расходов); иначе слои LoRA остаются обучаемыми
+    
+    Returns:
+        Конфигурация адаптера
+    """
+    config = read_adapter_config(path)
+    tensors = load_file(str(Path(path) / ADAPTER_WEIGHTS_NAME))
+    
+    extra = tensors.pop("extra_embeddings", None)
+    if extra is not None:
+        with torch.no_grad():
+            embeddings = model.get_input_embeddings().weight
+            embeddings[config["base_vocab_size"]:] = extra.to(embeddings.device, embeddings.dtype)
+    
+    apply_lora(model, r=config["r"], alpha=config["alpha"], dropout=config["dropout"],
+               target_modules=config["target_modules"])
+    for name, layer in _lora_layers(model).items():
+        with torch.no_grad():
+            layer.lora_A.copy_(tensors[f"{name}.lora_A"])
+            layer.lora_B.copy_(tensors[f"{name}.lora_B"])
+    
+    if merge:
+        merged = merge_lora(model)
+        for param in model.parameters():
+            param.requires_grad = True
+        logger.info(f"Адаптер {path} объединен с базовой моделью ({merged} слоев)")
+    
+    return config
+
+def remove_adapter(path: str):
+    """Удаляет файлы адаптера из директории (после сохранения полной модели)"""
+    for name in (ADAPTER_CONFIG_NAME, ADAPTER_WEIGHTS_NAME):
+        file_path = Path(path) / name
+        if file_path.exists():
+            file_path.unlink()
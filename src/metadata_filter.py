@@ -7,7 +7,7 @@
 
 import re
 import logging
-from typing import List, Dict, Set
+from typing import List, Dict, Iterable, Iterator, Set, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -228,8 +228,242 @@ class BookMetadataFilter:
             'removal_percentage': round((len(original_text) - len(filtered_text)) / len(original_text) * 100, 2) if original_text else 0
         }
 
+class FusedMetadataFilter(BookMetadataFilter):
+    """
+    Быстрый фильтр метаданных с результатом, идентичным BookMetadataFilter
+    
+    Вместо ~30 последовательных проходов pattern.sub по всему тексту один проход
+    находит ключевые слова-триггеры, и применяются только паттерны, чей триггер
+    встречается в тексте. Строки издательств и служебные строки обрабатываются
+    за один проход по строкам, ключевые слова издательств ищутся одним regex.
+    """
+    
+    # Обязательная подстрока каждого паттерна: без нее паттерн не может совпасть.
+    # Паттерны без триггера применяются всегда. Ни один триггер не должен быть
+    # префиксом другого - иначе поиск триггеров может пропустить вхождение
+    PATTERN_TRIGGERS = {
+        r'тираж\s*:?\s*\d+[\s\w]*': 'тираж',
+        r'тираж\s*\d+[\s\w]*': 'тираж',
+        r'тираж\s*—?\s*\d+[\s\w]*': 'тираж',
+        r'экземпляров?': 'экземпляр',
+        r'год\s*издания\s*:?\s*\d{4}': 'издания',
+        r'издано\s*в\s*\d{4}': 'издано',
+        r'©\s*\d{4}': '©',
+        r'copyright\s*\d{4}': 'copyright',
+        r'\d+\s*стр\.': 'стр',
+        r'\d+\s*страниц': 'стр',
+        r'\d+\s*с\.': 'с.',
+        r'стр\.\s*\d+': 'стр',
+        r'формат\s*:?\s*[\d\w\s×х/]+': 'формат',
+        r'размер\s*:?\s*[\d\w\s×х/]+': 'размер',
+        r'\d+×\d+/\d+': '×',
+        r'переплет\s*:?\s*[\w\s]+': 'переплет',
+        r'обложка\s*:?\s*[\w\s]+': 'обложка',
+        r'ББК\s*:?\s*[\d\.]+': 'ббк',
+        r'УДК\s*:?\s*[\d\.]+': 'удк',
+        r'серия\s*:?\s*[\w\s«»""]+': 'серия',
+        r'избранное': 'избранное',
+        r'библиотека\s*[\w\s]+': 'библиотека',
+        r'все права защищены': 'все права',
+        r'all rights reserved': 'all rights',
+        r'защищено авторским правом': 'защищено',
+        r'ISBN\s*:?\s*[\d\-X]+': 'isbn',
+        r'ISBN\s*[\d\-X]+': 'isbn',
+        r'isbn\s*:?\s*[\d\-X]+': 'isbn',
+        r'isbn\s*[\d\-X]+': 'isbn',
+        r'©\s*[\d\w\s,\.]+': '©',
+        r'copyright\s*[\d\w\s,\.]+': 'copyright',
+        r'авторские права\s*[\d\w\s,\.]+': 'авторские',
+    }
+    
+    # Символы с особыми правилами сравнения без учета регистра в модуле re
+    IGNORECASE_SPECIAL_CHARS = (
+        '\u0069\u0073\u00b5\u0130\u0131\u017f\u0345\u0390\u03b0\u03b2\u03b5\u03b8\u03b9'
+        '\u03ba\u03bc\u03c0\u03c1\u03c2\u03c3\u03c6\u03d0\u03d1\u03d5\u03d6\u03f0\u03f1'
+        '\u03f5\u0432\u0434\u043e\u0441\u0442\u044a\u0463\u1c80\u1c81\u1c82\u1c83\u1c84'
+        '\u1c85\u1c86\u1c87\u1c88\u1e61\u1e9b\u1fbe\u1fd3\u1fe3\ua64b\ufb05\ufb06'
+    )
+    
+    def __init__(self):
+        """Инициализация фильтра и сборка объединенных regex"""
+        super().__init__()
+        
+        # Паттерны в том же порядке, в котором их применяет BookMetadataFilter
+        self.ordered_patterns = self.metadata_patterns + self.isbn_patterns + self.copyright_patterns
+        self.pattern_triggers = [self.PATTERN_TRIGGERS.get(pattern.pattern) for pattern in self.ordered_patterns]
+        
+        triggers = sorted({trigger for trigger in self.pattern_triggers if trigger})
+        for trigger in triggers:
+            for other in triggers:
+                if trigger != other and other.casefold().startswith(trigger.casefold()):
+                    raise ValueError(f"Триггер '{trigger}' является префиксом '{other}'")
+        
+        self.triggers = triggers
+        self.max_trigger_length = max(len(trigger) for trigger in triggers)
+        
+        # Символы, которые при re.IGNORECASE совпадают с буквой триггера, хотя
+        # str.lower() не превращает их в эту букву (ſ -> s, İ -> i, ᲃ -> с, ...).
+        # Перед поиском триггеров они заменяются, чтобы не пропустить совпадение
+        trigger_chars = set(''.join(triggers))
+        self.case_fixes = {}
+        for char in self.IGNORECASE_SPECIAL_CHARS:
+            for trigger_char in trigger_chars:
+                if char.lower() != trigger_char and re.fullmatch(re.escape(trigger_char), char, re.IGNORECASE):
+                    self.case_fixes[ord(char)] = trigger_char
+        self.case_fixes_regex = re.compile(
+            '[' + ''.join(re.escape(chr(code)) for code in self.case_fixes) + ']'
+        ) if self.case_fixes else None
+        
+        self.publisher_regex = re.compile('|'.join(
+            re.escape(keyword) for keyword in sorted(self.publisher_keywords, key=len, reverse=True)
+        ))
+        self.digits_only_regex = re.compile(r'^[\d\s\-\.:;]+$')
+        self.date_regex = re.compile(r'^\d{1,2}[\.\-/]\d{1,2}[\.\-/]\d{2,4}$')
+        self.whitespace_regex = re.compile(r'\s+')
+    
+    def _find_triggers(self, text: str, candidates: Set[str]) -> Set[str]:
+        """
+        Находит триггеры, встречающиеся в тексте
+        
+        Текст один раз приводится к нижнему регистру, после чего каждый триггер
+        ищется обычным поиском подстроки.
+        
+        Args:
+            text: Текст
+            candidates: Искомые триггеры
+            
+        Returns:
+            Множество найденных триггеров
+        """
+        if self.case_fixes_regex is not None and self.case_fixes_regex.search(text):
+            text = text.translate(self.case_fixes)
+        text_lower = text.lower()
+        return {trigger for trigger in candidates if trigger in text_lower}
+    
+    def _remove_matches(self, pattern: re.Pattern, text: str) -> Tuple[str, List[int]]:
+        """
+        Удаляет совпадения паттерна и запоминает места склейки текста
+        
+        Args:
+            pattern: Паттерн метаданных
+            text: Текст
+            
+        Returns:
+            Кортеж (текст без совпадений, позиции склеек в новом тексте)
+        """
+        parts = []
+        junctions = []
+        position = 0
+        length = 0
+        for match in pattern.finditer(text):
+            start, end = match.span()
+            if start == end:
+                continue
+            parts.append(text[position:start])
+            length += start - position
+            junctions.append(length)
+            position = end
+        
+        if not junctions:
+            return text, junctions
+        
+        parts.append(text[position:])
+        return ''.join(parts), junctions
+    
+    def _find_triggers_at_junctions(self, text: str, junctions: List[int], candidates: Set[str]) -> Set[str]:
+        """
+        Ищет триггеры, которые могли появиться после удаления фрагментов
+        
+        Новое вхождение триггера обязано пересекать место склейки, поэтому
+        достаточно проверить короткие окна вокруг склеек.
+        
+        Args:
+            text: Текст после удаления
+            junctions: Позиции склеек
+            candidates: Искомые триггеры
+            
+        Returns:
+            Множество найденных триггеров
+        """
+        width = self.max_trigger_length - 1
+        windows = '\n'.join(
+            text[max(0, junction - width):junction + width] for junction in junctions
+        )
+        return self._find_triggers(windows, candidates)
+    
+    def filter_metadata(self, text: str) -> str:
+        """
+        Фильтрует метаданные из текста
+        
+        Args:
+            text: Исходный текст
+            
+        Returns:
+            Очищенный от метаданных текст
+        """
+        if not text:
+            return text
+        
+        filtered_text = text
+        present = self._find_triggers(filtered_text, set(self.triggers))
+        
+        for i, pattern in enumerate(self.ordered_patterns):
+            trigger = self.pattern_triggers[i]
+            if trigger is not None and trigger not in present:
+                continue
+            
+            absent = {
+                later for later in self.pattern_triggers[i + 1:]
+                if later is not None and later not in present
+            }
+            if not absent:
+                filtered_text = pattern.sub('', filtered_text)
+                continue
+            
+            # Удаление могло склеить текст в новое вхождение триггера,
+            # поэтому проверяем отсутствовавшие триггеры вокруг мест склейки
+            filtered_text, junctions = self._remove_matches(pattern, filtered_text)
+            if junctions:
+                present |= self._find_triggers_at_junctions(filtered_text, junctions, absent)
+        
+        # Строки с ключевыми словами издательств ищем по всему тексту сразу.
+        # lower() не добавляет и не удаляет переводы строк, поэтому номера
+        # строк в тексте и в его нижнем регистре совпадают
+        text_lower = filtered_text.lower()
+        publisher_lines = set()
+        line_number = 0
+        position = 0
+        for match in self.publisher_regex.finditer(text_lower):
+            line_number += text_lower.count('\n', position, match.start())
+            position = match.start()
+            publisher_lines.add(line_number)
+        
+        # Строки издательств и служебные строки - один проход
+        filtered_lines = []
+        for line_number, line in enumerate(filtered_text.split('\n')):
+            if line_number in publisher_lines and not self._is_content_line(line):
+                continue
+            
+            line = line.strip()
+            if not line:
+                continue
+            if self.digits_only_regex.match(line):
+                continue
+            if line.isupper() and len(line) < 50:
+                continue
+            if self.date_regex.match(line):
+                continue
+            
+            filtered_lines.append(line)
+        
+        # После схлопывания пробельных символов все строки сливаются в одну
+        return self.whitespace_regex.sub(' ', ' '.join(filtered_lines)).strip()
+
 # Глобальный экземпляр фильтра
-metadata_filter = BookMetadataFilter()
+metadata_filter = FusedMetadataFilter()
+
+# Размер блока (в символах) при потоковой фильтрации
+STREAM_BLOCK_SIZE = 256 * 1024
 
 def filter_book_metadata(text: str) -> str:
     """
@@ -243,6 +477,66 @@ def filter_book_metadata(text: str) -> str:
     """
     return metadata_filter.filter_metadata(text)
 
+def iter_line_blocks(segments: Iterable[str], block_size: int = STREAM_BLOCK_SIZE) -> Iterator[str]:
+    """
+    Собирает поток фрагментов текста (страниц, абзацев) в блоки по целым строкам
+    
+    Блок заканчивается на границе строки, как только накоплено не меньше
+    block_size символов. Строка длиннее 4 * block_size режется без учета границ.
+    
+    Args:
+        segments: Итератор фрагментов текста
+        block_size: Минимальный размер блока в символах
+        
+    Yields:
+        Блоки текста без завершающего перевода строки
+    """
+    buffer = []
+    buffered = 0
+    for segment in segments:
+        if not segment:
+            continue
+        buffer.append(segment)
+        buffered += len(segment)
+        if buffered < block_size:
+            continue
+        
+        text = ''.join(buffer)
+        cut = text.rfind('\n')
+        if cut < 0 and len(text) < 4 * block_size:
+            buffer = [text]
+            continue
+        if cut < 0:
+            cut = len(text)
+        
+        yield text[:cut]
+        rest = text[cut + 1:]
+        buffer = [rest] if rest else []
+        buffered = len(rest)
+    
+    if buffer:
+        yield ''.join(buffer)
+
+def filter_book_metadata_stream(segments: Iterable[str], block_size: int = STREAM_BLOCK_SIZE) -> Iterator[str]:
+    """
+    Потоковая фильтрация метаданных книг
+    
+    Фильтр применяется к блокам из целых строк, поэтому в памяти находится
+    только текущий блок. Результат совпадает с filter_book_metadata для всего
+    текста, кроме метаданных, разрезанных границей блока.
+    
+    Args:
+        segments: Итератор фрагментов текста (страниц, абзацев)
+        block_size: Минимальный размер блока в символах
+        
+    Yields:
+        Очищенные от метаданных блоки (пустые блоки пропускаются)
+    """
+    for block in iter_line_blocks(segments, block_size):
+        filtered = metadata_filter.filter_metadata(block)
+        if filtered:
+            yield filtered
+
 def get_filtering_stats(original_text: str, filtered_text: str) -> Dict[str, int]:
     """
     Возвращает статистику фильтрации
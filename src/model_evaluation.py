@@ -17,6 +17,35 @@ import random
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Базовые вопросы для истории России (с ключевыми словами правильного ответа)
+BASIC_QUESTIONS = [
+    {
+        "question": "Когда произошла Куликовская битва?",
+        "keywords": ["1380", "куликовская", "битва", "дмитрий"],
+        "expected": "Куликовская битва произошла в 1380 году"
+    },
+    {
+        "question": "Кто был первым русским царем?",
+        "keywords": ["иван", "грозный", "царь", "1547"],
+        "expected": "Иван IV Грозный был первым русским царем"
+    },
+    {
+        "question": "Когда произошло крещение Руси?",
+        "keywords": ["988", "владимир", "крещение", "христианство"],
+        "expected": "Крещение Руси произошло в 988 году"
+    },
+    {
+        "question": "Когда началась Отечественная война 1812 года?",
+        "keywords": ["1812", "наполеон", "отечественная", "война"],
+        "expected": "Отечественная война 1812 года началась в 1812 году"
+    },
+    {
+        "question": "Кто отменил крепостное право в России?",
+        "keywords": ["александр", "второй", "крепостное", "право", "1861"],
+        "expected": "Александр II отменил крепостное право в 1861 году"
+    }
+]
+
 class ModelEvaluator:
     """Класс для оценки качества обученной модели"""
     
@@ -226,37 +255,8 @@ class ModelEvaluator:
         # Создаем тестовые вопросы на основе содержимого
         test_questions = []
         
-        # Базовые вопросы для истории России
-        basic_questions = [
-            {
-                "question": "Когда произошла Куликовская битва?",
-                "keywords": ["1380", "куликовская", "битва", "дмитрий"],
-                "expected": "Куликовская битва произошла в 1380 году"
-            },
-            {
-                "question": "Кто был первым русским царем?",
-                "keywords": ["иван", "грозный", "царь", "1547"],
-                "expected": "Иван IV Грозный был первым русским царем"
-            },
-            {
-                "question": "Когда произошло крещение Руси?",
-                "keywords": ["988", "владимир", "крещение", "христианство"],
-                "expected": "Крещение Руси произошло в 988 году"
-            },
-            {
-                "question": "Когда началась Отечественная война 1812 года?",
-                "keywords": ["1812", "наполеон", "отечественная", "война"],
-                "expected": "Отечественная война 1812 года началась в 1812 году"
-            },
-            {
-                "question": "Кто отменил крепостное право в России?",
-                "keywords": ["александр", "второй", "крепостное", "право", "1861"],
-                "expected": "Александр II отменил крепостное право в 1861 году"
-            }
-        ]
-        
         # Добавляем базовые вопросы
-        test_questions.extend(basic_questions)
+        test_questions.extend(BASIC_QUESTIONS)
         
         # Создаем дополнительные вопросы на основе загруженных данных
         for text in texts[:3]:  # Берем первые 3 текста
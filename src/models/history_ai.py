@@ -11,11 +11,11 @@ from transformers import (
     AutoModel, 
     AutoModelForSequenceClassification,
     AutoModelForCausalLM,
-    TrainingArguments,
-    Trainer
+    TrainingArguments
 )
 import numpy as np
-from typing import Dict, List, Optional, Union
+import threading
+from typing import Dict, Iterator, List, Optional, Union
 import logging
 
 # Настройка логирования
@@ -38,6 +38,9 @@ class HistoryAIModel:
         self.tokenizer = None
         self.model = None
         self.is_loaded = False
+        self.lora_config = None
+        # Директория, из которой загружены обученные веса (для адаптера - его директория)
+        self.model_path = None
         
     def _setup_device(self, device: str) -> str:
         """Настройка устройства для вычислений"""
@@ -50,12 +53,14 @@ class HistoryAIModel:
                 return "cpu"
         return device
     
-    def load_model(self, task_type: str = "generation"):
+    def load_model(self, task_type: str = "generation", quantize: Optional[str] = None):
         """
         Загружает модель в зависимости от типа задачи
         
         Args:
             task_type: Тип задачи ('generation', 'classification', 'embedding')
+            quantize: Квантование модели генерации для инференса на CPU ('int8');
+                квантованная модель кешируется на диске
         """
         try:
             logger.info(f"Загружаем модель {self.model_name} для задачи: {task_type}")
@@ -85,14 +90,23 @@ class HistoryAIModel:
             
             # Загружаем модель в зависимости от задачи
             if task_type == "generation":
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_name,
-                    pad_token_id=self.tokenizer.pad_token_id
-                )
+                def load_fp32():
+                    model = AutoModelForCausalLM.from_pretrained(
+                        self.model_name,
+                        pad_token_id=self.tokenizer.pad_token_id
+                    )
+                    
+                    # Изменяем размер эмбеддингов если добавили новые токены
+                    if len(self.tokenizer) != self.tokenizer.vocab_size:
+                        model.resize_token_embeddings(len(self.tokenizer))
+                    return model
                 
-                # Изменяем размер эмбеддингов если добавили новые токены
-                if len(self.tokenizer) != self.tokenizer.vocab_size:
-                    self.model.resize_token_embeddings(len(self.tokenizer))
+                if quantize:
+                    from quantization import load_quantized_model
+                    self.model = load_quantized_model(self.model_name, load_fp32, quantize=quantize,
+                                                      device=self.device)
+                else:
+                    self.model = load_fp32()
             elif task_type == "classification":
                 self.model = AutoModelForSequenceClassification.from_pretrained(
                     self.model_name,
@@ -106,6 +120,7 @@ class HistoryAIModel:
             
             # Перемещаем модель на устройство
             self.model.to(self.device)
+            self.lora_config = None
             self.is_loaded = True
             
             logger.info(f"Модель успешно загружена на устройство: {self.device}")
@@ -141,19 +156,7 @@ class HistoryAIModel:
             
             # Генерируем текст с улучшенными параметрами
             with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs.input_ids,
-                    attention_mask=inputs.attention_mask,
-                    max_length=max_length,
-                    temperature=temperature,
-                    do_sample=True,
-                    top_p=0.9,
-                    top_k=50,
-                    repetition_penalty=1.1,
-                    pad_token_id=self.tokenizer.pad_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    no_repeat_ngram_size=2
-                )
+                outputs = self.model.generate(**self._generation_kwargs(inputs, max_length, temperature))
             
             # Проверяем, что модель сгенерировала текст
             if outputs is None or len(outputs) == 0:
@@ -176,21 +179,81 @@ class HistoryAIModel:
             if generated_text.startswith(prompt):
                 generated_text = generated_text[len(prompt):].strip()
             
-            # Проверяем, что после обработки остался текст
-            if not generated_text or len(generated_text.strip()) < 10:
-                logger.warning("Сгенерированный текст слишком короткий или пустой")
-                return "Извините, не удалось сгенерировать содержательный ответ. Попробуйте изменить промпт или параметры генерации."
-            
-            # Очищаем текст от артефактов
-            generated_text = self._clean_generated_text(generated_text)
-            
-            return generated_text
+            return self.finalize_generated_text(generated_text)
             
         except Exception as e:
             logger.error(f"Ошибка при генерации текста: {e}")
             # Возвращаем понятное сообщение об ошибке вместо исключения
             return f"Произошла ошибка при генерации текста: {str(e)}. Попробуйте изменить промпт или параметры."
     
+    def generate_text_stream(self, prompt: str, max_length: int = 100, temperature: float = 0.7,
+                             stop_event: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        Генерирует текст, выдавая его по частям по мере генерации токенов
+        
+        Части содержат сырой текст модели без промпта; итоговый ответ
+        получается из их объединения через finalize_generated_text.
+        
+        Args:
+            prompt: Начальный текст
+            max_length: Максимальная длина генерируемого текста
+            temperature: Температура для генерации
+            stop_event: Событие отмены; генерация также останавливается
+                при закрытии итератора
+        
+        Yields:
+            Фрагменты сгенерированного текста
+        """
+        if not self.is_loaded:
+            raise RuntimeError("Модель не загружена. Вызовите load_model() сначала.")
+        
+        from text_streaming import stream_generate
+        
+        inputs = self.tokenizer(
+            prompt,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=512
+        ).to(self.device)
+        yield from stream_generate(self.model, self.tokenizer,
+                                   self._generation_kwargs(inputs, max_length, temperature), stop_event)
+    
+    def _generation_kwargs(self, inputs, max_length: int, temperature: float) -> Dict:
+        """Параметры model.generate для generate_text и generate_text_stream"""
+        return dict(
+            input_ids=inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            max_length=max_length,
+            temperature=temperature,
+            do_sample=True,
+            top_p=0.9,
+            top_k=50,
+            repetition_penalty=1.1,
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+            no_repeat_ngram_size=2
+        )
+    
+    def finalize_generated_text(self, generated_text: str) -> str:
+        """
+        Проверяет и очищает сгенерированный текст (без промпта)
+        
+        Args:
+            generated_text: Сырой текст модели
+        
+        Returns:
+            Итоговый ответ или NO_ANSWER_MESSAGE, если содержательного текста нет
+        """
+        # Проверяем, что после обработки остался текст
+        if not generated_text or len(generated_text.strip()) < 10:
+            logger.warning("Сгенерированный текст слишком короткий или пустой")
+            from answer_cache import NO_ANSWER_MESSAGE
+            return NO_ANSWER_MESSAGE
+        
+        # Очищаем текст от артефактов
+        return self._clean_generated_text(generated_text.strip())
+    
     def _clean_generated_text(self, text: str) -> str:
         """Очищает сгенерированный текст от артефактов"""
         # Убираем повторяющиеся символы
@@ -214,46 +277,77 @@ class HistoryAIModel:
         
         return ' '.join(cleaned_words).strip()
     
-    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+    def get_embeddings(self, texts: List[str], batch_size: int = 32, max_length: int = 512,
+                       dtype=np.float32, output_path: Optional[str] = None) -> np.ndarray:
         """
         Получает эмбеддинги для списка текстов
         
+        Тексты обрабатываются пакетами, отсортированными по длине (в пакете
+        почти нет дополнения). Эмбеддинг - среднее последнего скрытого слоя
+        по токенам текста без учета дополнения.
+        
         Args:
             texts: Список текстов для обработки
+            batch_size: Количество текстов в одном прямом проходе
+            max_length: Максимальная длина текста в токенах
+            dtype: Тип элементов результата (np.float32 или np.float16)
+            output_path: Файл .npy, в который эмбеддинги пишутся по мере
+                вычисления (результат - np.memmap этого файла)
         
         Returns:
-            Массив эмбеддингов
+            Массив эмбеддингов (len(texts), hidden_size) в порядке texts
         """
         if not self.is_loaded:
             raise RuntimeError("Модель не загружена. Вызовите load_model() сначала.")
         
         try:
-            embeddings = []
+            hidden_size = self.model.config.hidden_size
+            if output_path:
+                embeddings = np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype,
+                                                       shape=(len(texts), hidden_size))
+            else:
+                embeddings = np.empty((len(texts), hidden_size), dtype=dtype)
+            
+            # Длины в токенах для сортировки (сами токены не храним: корпус может быть большим)
+            lengths = np.empty(len(texts), dtype=np.int64)
+            for start in range(0, len(texts), 1000):
+                input_ids = self.tokenizer(texts[start:start + 1000], truncation=True,
+                                           max_length=max_length)["input_ids"]
+                lengths[start:start + len(input_ids)] = [len(ids) for ids in input_ids]
+            order = np.argsort(-lengths, kind='stable')
             
-            for text in texts:
-                # Токенизируем текст
+            self.model.eval()
+            for start in range(0, len(texts), batch_size):
+                indices = order[start:start + batch_size]
                 inputs = self.tokenizer(
-                    text, 
-                    return_tensors="pt", 
-                    padding=True, 
-                    truncation=True, 
-                    max_length=512
+                    [texts[i] for i in indices],
+                    return_tensors="pt",
+                    padding=True,
+                    truncation=True,
+                    max_length=max_length
                 ).to(self.device)
                 
-                # Получаем эмбеддинги
                 with torch.no_grad():
-                    outputs = self.model(**inputs)
-                    # Используем среднее значение последнего скрытого слоя
-                    embedding = outputs.last_hidden_state.mean(dim=1).cpu().numpy()
-                    embeddings.append(embedding[0])
+                    # Модель генерации возвращает скрытые слои только по запросу
+                    outputs = self.model(**inputs, output_hidden_states=True)
+                    hidden = outputs.hidden_states[-1]
+                    mask = inputs.attention_mask.unsqueeze(-1).to(hidden.dtype)
+                    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                
+                embeddings[indices] = pooled.float().cpu().numpy()
             
-            return np.array(embeddings)
+            if output_path:
+                embeddings.flush()
+            return embeddings
             
         except Exception as e:
             logger.error(f"Ошибка при получении эмбеддингов: {e}")
             raise
     
-    def train(self, train_dataset, eval_dataset=None, num_epochs: int = 3):
+    def train(self, train_dataset, eval_dataset=None, num_epochs: int = 3,
+              data_collator=None, callbacks=None, example_lengths=None,
+              output_dir: str = "./models/history_ai_trained", save_steps: int = 500,
+              resume: bool = False):
         """
         Обучает модель на предоставленных данных
         
@@ -261,6 +355,15 @@ class HistoryAIModel:
             train_dataset: Обучающий датасет
             eval_dataset: Валидационный датасет (опционально)
             num_epochs: Количество эпох обучения
+            data_collator: Коллатор пакетов (по умолчанию - коллатор Trainer)
+            callbacks: Дополнительные обратные вызовы Trainer
+            example_lengths: Длины обучающих примеров; если заданы, пакеты
+                собираются из примеров близкой длины (LengthGroupedSampler)
+            output_dir: Директория модели и контрольных точек обучения
+            save_steps: Период сохранения контрольных точек в шагах
+            resume: Продолжить обучение с последней полной контрольной точки
+                в output_dir (оптимизатор, планировщик, генераторы случайных
+                чисел и позиция в данных восстанавливаются)
         """
         if not self.is_loaded:
             raise RuntimeError("Модель не загружена. Вызовите load_model() сначала.")
@@ -268,7 +371,7 @@ class HistoryAIModel:
         try:
             # Настройки обучения
             training_args = TrainingArguments(
-                output_dir="./models/history_ai_trained",
+                output_dir=output_dir,
                 num_train_epochs=num_epochs,
                 per_device_train_batch_size=4,
                 per_device_eval_batch_size=4,
@@ -278,26 +381,51 @@ class HistoryAIModel:
                 logging_steps=10,
                 eval_strategy="steps" if eval_dataset else "no",
                 eval_steps=500 if eval_dataset else None,
-                save_steps=1000,
+                save_steps=save_steps,
                 save_total_limit=2,
             )
             
-            # Создаем тренер
-            trainer = Trainer(
+            # Создаем тренер; контрольные точки пишутся в фоновом потоке
+            from checkpointing import AsyncCheckpointTrainer, find_last_checkpoint, remove_checkpoints
+            trainer_class = AsyncCheckpointTrainer
+            trainer_kwargs = {}
+            if example_lengths is not None:
+                from length_grouping import LengthGroupedTrainer
+                trainer_class = LengthGroupedTrainer
+                trainer_kwargs["example_lengths"] = example_lengths
+            
+            trainer = trainer_class(
                 model=self.model,
                 args=training_args,
                 train_dataset=train_dataset,
                 eval_dataset=eval_dataset,
                 tokenizer=self.tokenizer,
+                data_collator=data_collator,
+                callbacks=callbacks,
+                **trainer_kwargs
             )
             
+            checkpoint = None
+            if resume:
+                checkpoint = find_last_checkpoint(output_dir)
+                if checkpoint:
+                    logger.info(f"Продолжаем обучение с контрольной точки {checkpoint}")
+                else:
+                    logger.info(f"Контрольных точек в {output_dir} нет, обучение начинается с начала")
+            
             # Начинаем обучение
             logger.info("Начинаем обучение модели...")
-            trainer.train()
+            trainer.train(resume_from_checkpoint=checkpoint)
+            
+            # Сохраняем модель (в режиме LoRA - только адаптер)
+            if self.lora_config:
+                self.save_model(output_dir)
+            else:
+                trainer.save_model()
+                self.tokenizer.save_pretrained(output_dir)
             
-            # Сохраняем модель
-            trainer.save_model()
-            self.tokenizer.save_pretrained("./models/history_ai_trained")
+            # Контрольные точки законченного обучения больше не нужны
+            remove_checkpoints(output_dir)
             
             logger.info("Обучение завершено. Модель сохранена.")
             
@@ -305,21 +433,59 @@ class HistoryAIModel:
             logger.error(f"Ошибка при обучении модели: {e}")
             raise
     
+    def enable_lora(self, r: int = 8, alpha: int = 16, dropout: float = 0.05,
+                    target_modules=None):
+        """
+        Включает режим низкоранговых адаптеров (LoRA)
+        
+        Веса модели замораживаются, обучаются только адаптеры; save_model
+        сохраняет только адаптер, а load_trained_model объединяет его с
+        базовой моделью.
+        
+        Args:
+            r: Ранг адаптеров
+            alpha: Масштаб добавки адаптеров
+            dropout: Вероятность dropout на входе адаптеров
+            target_modules: Имена слоев для адаптеров (по умолчанию проекции внимания)
+        """
+        if not self.is_loaded:
+            raise RuntimeError("Модель не загружена. Вызовите load_model() сначала.")
+        
+        from lora import DEFAULT_TARGET_MODULES, apply_lora
+        self.lora_config = apply_lora(self.model, r=r, alpha=alpha, dropout=dropout,
+                                      target_modules=target_modules or DEFAULT_TARGET_MODULES)
+        self.lora_config["base_model"] = self.model_name
+    
     def save_model(self, path: str):
-        """Сохраняет модель по указанному пути"""
+        """Сохраняет модель (или только адаптер в режиме LoRA) по указанному пути"""
         if not self.is_loaded:
             raise RuntimeError("Модель не загружена.")
         
         try:
-            self.model.save_pretrained(path)
+            from lora import remove_adapter, save_adapter
+            if self.lora_config:
+                save_adapter(self.model, path, self.lora_config, base_vocab_size=self.tokenizer.vocab_size)
+            else:
+                self.model.save_pretrained(path)
+                # Полная модель заменяет ранее сохраненный в этой директории адаптер
+                remove_adapter(path)
             self.tokenizer.save_pretrained(path)
             logger.info(f"Модель сохранена в {path}")
         except Exception as e:
             logger.error(f"Ошибка при сохранении модели: {e}")
             raise
     
-    def load_trained_model(self, path: str, task_type: str = "generation"):
-        """Загружает предобученную модель"""
+    def load_trained_model(self, path: str, task_type: str = "generation", merge_adapter: bool = True,
+                           quantize: Optional[str] = None):
+        """
+        Загружает предобученную модель
+        
+        Если в директории сохранен адаптер LoRA, загружается его базовая модель
+        и адаптер объединяется с ней (merge_adapter=True, для инференса) или
+        остается отдельным обучаемым слоем (для продолжения обучения адаптера).
+        С quantize='int8' модель квантуется для инференса на CPU (после
+        объединения с адаптером).
+        """
         try:
             # Проверяем, существует ли путь
             from pathlib import Path
@@ -328,8 +494,23 @@ class HistoryAIModel:
                 logger.error(f"Путь к модели не существует: {path}")
                 raise FileNotFoundError(f"Модель не найдена по пути: {path}")
             
-            self.model_name = path
-            self.load_model(task_type)
+            from lora import is_adapter_dir, load_adapter, read_adapter_config
+            self.model_path = path
+            if is_adapter_dir(path):
+                if quantize and not merge_adapter:
+                    raise ValueError("Квантованную модель нельзя дообучать: загрузите адаптер без quantize")
+                self.model_name = read_adapter_config(path)["base_model"]
+                self.load_model(task_type)
+                config = load_adapter(self.model, path, merge=merge_adapter)
+                self.lora_config = None if merge_adapter else config
+                if quantize:
+                    # Ключ кеша - директория адаптера: квантуется базовая модель вместе с адаптером
+                    from quantization import load_quantized_model
+                    merged = self.model
+                    self.model = load_quantized_model(path, lambda: merged, quantize=quantize, device=self.device)
+            else:
+                self.model_name = path
+                self.load_model(task_type, quantize=quantize)
             
             # Проверяем, что модель действительно загружена
             if not self.is_loaded or self.model is None or self.tokenizer is None:
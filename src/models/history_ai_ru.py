@@ -16,7 +16,8 @@ from transformers import (
 )
 import numpy as np
 import os
-from typing import Dict, List, Optional, Union
+import threading
+from typing import Dict, Iterator, List, Optional, Union
 import logging
 
 # Настройка логирования
@@ -39,6 +40,7 @@ class HistoryAIModelRU:
         self.tokenizer = None
         self.model = None
         self.is_loaded = False
+        self.lora_config = None
         
     def _setup_device(self, device: str) -> str:
         """Настройка устройства для вычислений"""
@@ -51,12 +53,14 @@ class HistoryAIModelRU:
                 return "cpu"
         return device
     
-    def load_model(self, task: str = "generation"):
+    def load_model(self, task: str = "generation", quantize: Optional[str] = None):
         """
         Загрузка предобученной модели
         
         Args:
             task: Тип задачи ('generation', 'classification', 'embedding')
+            quantize: Квантование модели генерации для инференса на CPU ('int8');
+                квантованная модель кешируется на диске
         """
         try:
             logger.info(f"Загружаем русскую модель {self.model_name} для задачи: {task}")
@@ -78,12 +82,21 @@ class HistoryAIModelRU:
             
             # Загружаем модель в зависимости от задачи
             if task == "generation":
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_name,
-                    pad_token_id=self.tokenizer.pad_token_id
-                )
-                # Изменяем размер эмбеддингов для новых токенов
-                self.model.resize_token_embeddings(len(self.tokenizer))
+                def load_fp32():
+                    model = AutoModelForCausalLM.from_pretrained(
+                        self.model_name,
+                        pad_token_id=self.tokenizer.pad_token_id
+                    )
+                    # Изменяем размер эмбеддингов для новых токенов
+                    model.resize_token_embeddings(len(self.tokenizer))
+                    return model
+                
+                if quantize:
+                    from quantization import load_quantized_model
+                    self.model = load_quantized_model(self.model_name, load_fp32, quantize=quantize,
+                                                      device=self.device)
+                else:
+                    self.model = load_fp32()
             elif task == "classification":
                 self.model = AutoModelForSequenceClassification.from_pretrained(
                     self.model_name,
@@ -94,6 +107,7 @@ class HistoryAIModelRU:
             
             # Перемещаем модель на устройство
             self.model.to(self.device)
+            self.lora_config = None
             self.is_loaded = True
             
             logger.info(f"Русская модель успешно загружена на устройство: {self.device}")
@@ -129,19 +143,7 @@ class HistoryAIModelRU:
             
             # Генерируем текст
             with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs.input_ids,
-                    attention_mask=inputs.attention_mask,
-                    max_length=max_length,
-                    temperature=temperature,
-                    do_sample=True,
-                    top_p=0.9,
-                    top_k=50,
-                    repetition_penalty=1.1,
-                    pad_token_id=self.tokenizer.pad_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    no_repeat_ngram_size=2
-                )
+                outputs = self.model.generate(**self._generation_kwargs(inputs, max_length, temperature))
             
             # Декодируем результат
             generated_text = self.tokenizer.decode(
@@ -154,15 +156,63 @@ class HistoryAIModelRU:
             if generated_text.startswith(prompt):
                 generated_text = generated_text[len(prompt):].strip()
             
-            # Очищаем результат
-            generated_text = self._clean_generated_text(generated_text)
-            
-            return generated_text
+            return self.finalize_generated_text(generated_text)
             
         except Exception as e:
             logger.error(f"Ошибка при генерации текста: {e}")
             return f"Ошибка генерации: {e}"
     
+    def generate_text_stream(self, prompt: str, max_length: int = 100, temperature: float = 0.7,
+                             stop_event: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        Потоковая генерация текста на русском языке
+        
+        Args:
+            prompt: Начальный текст для генерации
+            max_length: Максимальная длина генерируемого текста
+            temperature: Температура для генерации
+            stop_event: Событие отмены; генерация также останавливается
+                при закрытии итератора
+            
+        Yields:
+            Фрагменты сгенерированного текста без промпта (итоговый ответ -
+            finalize_generated_text от их объединения)
+        """
+        if not self.is_loaded:
+            raise ValueError("Модель не загружена. Сначала вызовите load_model()")
+        
+        from text_streaming import stream_generate
+        
+        inputs = self.tokenizer(
+            prompt,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=512
+        ).to(self.device)
+        yield from stream_generate(self.model, self.tokenizer,
+                                   self._generation_kwargs(inputs, max_length, temperature), stop_event)
+    
+    def _generation_kwargs(self, inputs, max_length: int, temperature: float) -> Dict:
+        """Параметры model.generate для generate_text и generate_text_stream"""
+        return dict(
+            input_ids=inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            max_length=max_length,
+            temperature=temperature,
+            do_sample=True,
+            top_p=0.9,
+            top_k=50,
+            repetition_penalty=1.1,
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+            no_repeat_ngram_size=2
+        )
+    
+    def finalize_generated_text(self, generated_text: str) -> str:
+        """Очищает сгенерированный текст (без промпта)"""
+        return self._clean_generated_text(generated_text)
+    
     def _clean_generated_text(self, text: str) -> str:
         """Очистка сгенерированного текста"""
         # Убираем лишние пробелы и переносы строк
@@ -186,7 +236,8 @@ class HistoryAIModelRU:
         return cleaned_text
     
     def train(self, data_path: str, task: str = "generation", epochs: int = 3, 
-              learning_rate: float = 5e-5, batch_size: int = 4):
+              learning_rate: float = 5e-5, batch_size: int = 4, use_lora: bool = False,
+              lora_rank: int = 8):
         """
         Обучение русской модели
         
@@ -196,9 +247,14 @@ class HistoryAIModelRU:
             epochs: Количество эпох
             learning_rate: Скорость обучения
             batch_size: Размер батча
+            use_lora: Обучать только низкоранговые адаптеры (LoRA) и сохранить
+                только их; базовая модель не изменяется
+            lora_rank: Ранг адаптеров
         """
         if not self.is_loaded:
             self.load_model(task)
+        if use_lora and not self.lora_config:
+            self.enable_lora(r=lora_rank)
         
         try:
             logger.info("Начинаем обучение русской модели...")
@@ -235,8 +291,15 @@ class HistoryAIModelRU:
             # Обучаем модель
             trainer.train()
             
-            # Сохраняем модель
-            trainer.save_model()
+            # Сохраняем модель (в режиме LoRA - только адаптер)
+            if self.lora_config:
+                from lora import save_adapter
+                save_adapter(self.model, './models/history_ai_ru_trained', self.lora_config,
+                             base_vocab_size=self.tokenizer.vocab_size)
+            else:
+                from lora import remove_adapter
+                trainer.save_model()
+                remove_adapter('./models/history_ai_ru_trained')
             self.tokenizer.save_pretrained('./models/history_ai_ru_trained')
             
             logger.info("Обучение русской модели завершено. Модель сохранена.")
@@ -245,19 +308,62 @@ class HistoryAIModelRU:
             logger.error(f"Ошибка при обучении русской модели: {e}")
             raise
     
-    def load_trained_model(self, model_path: str):
-        """Загрузка обученной русской модели"""
+    def enable_lora(self, r: int = 8, alpha: int = 16, dropout: float = 0.05,
+                    target_modules=None):
+        """
+        Включает режим низкоранговых адаптеров (LoRA): веса модели
+        замораживаются, обучаются и сохраняются только адаптеры
+        
+        Args:
+            r: Ранг адаптеров
+            alpha: Масштаб добавки адаптеров
+            dropout: Вероятность dropout на входе адаптеров
+            target_modules: Имена слоев для адаптеров (по умолчанию проекции внимания)
+        """
+        if not self.is_loaded:
+            raise ValueError("Модель не загружена. Сначала вызовите load_model()")
+        
+        from lora import DEFAULT_TARGET_MODULES, apply_lora
+        self.lora_config = apply_lora(self.model, r=r, alpha=alpha, dropout=dropout,
+                                      target_modules=target_modules or DEFAULT_TARGET_MODULES)
+        self.lora_config["base_model"] = self.model_name
+    
+    def load_trained_model(self, model_path: str, quantize: Optional[str] = None):
+        """
+        Загрузка обученной русской модели (адаптер LoRA объединяется с базовой моделью)
+        
+        Args:
+            model_path: Директория обученной модели или адаптера
+            quantize: Квантование для инференса на CPU ('int8')
+        """
         try:
             logger.info(f"Загружаем обученную русскую модель из {model_path}")
             
             # Если локальная модель не найдена, используем предобученную
             if not os.path.exists(model_path):
                 logger.info("Локальная модель не найдена, используем предобученную")
+                self.load_model('generation', quantize=quantize)
+                return
+            
+            from lora import is_adapter_dir, load_adapter, read_adapter_config
+            from quantization import load_quantized_model
+            if is_adapter_dir(model_path):
+                self.model_name = read_adapter_config(model_path)["base_model"]
                 self.load_model('generation')
+                load_adapter(self.model, model_path, merge=True)
+                if quantize:
+                    merged = self.model
+                    self.model = load_quantized_model(model_path, lambda: merged, quantize=quantize,
+                                                      device=self.device)
+                logger.info("Обученная русская модель успешно загружена")
                 return
             
             self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-            self.model = AutoModelForCausalLM.from_pretrained(model_path)
+            if quantize:
+                self.model = load_quantized_model(model_path, lambda: AutoModelForCausalLM.from_pretrained(model_path),
+                                                  quantize=quantize, device=self.device)
+            else:
+                self.model = AutoModelForCausalLM.from_pretrained(model_path)
             self.model.to(self.device)
             self.is_loaded = True
             
@@ -10,6 +10,8 @@ from pathlib import Path
 from typing import List, Dict, Any
 import logging
 
+from corpus_store import CorpusStore
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -72,6 +74,7 @@ class PDFHistoryReader:
                                 historical_data.append({
                                     'text': paragraph.strip(),
                                     'source': 'pdf',
+                                    'filename': pdf_path.name,
                                     'page': page_num,
                                     'category': self._classify_content(paragraph),
                                     'period': self._extract_period(paragraph)
@@ -106,6 +109,7 @@ class PDFHistoryReader:
                                 historical_data.append({
                                     'text': paragraph.strip(),
                                     'source': 'pdf',
+                                    'filename': pdf_path.name,
                                     'page': page_num,
                                     'category': self._classify_content(paragraph),
                                     'period': self._extract_period(paragraph)
@@ -240,6 +244,28 @@ class PDFHistoryReader:
             json.dump(data, f, ensure_ascii=False, indent=2)
         
         logger.info(f"Данные сохранены в {output_path}")
+    
+    def save_to_corpus(self, data: List[Dict[str, Any]],
+                       corpus_file: str = "data/processed/pdf_history_data.jsonl") -> int:
+        """
+        Дописывает извлеченные данные в корпус обработанных данных (.jsonl)
+        
+        Записи файлов, которые уже есть в корпусе, не добавляются повторно.
+        
+        Args:
+            data: Извлеченные записи
+            corpus_file: Путь к корпусу
+        
+        Returns:
+            Количество добавленных записей
+        """
+        corpus_file = Path(corpus_file)
+        corpus = CorpusStore(corpus_file, legacy_json=corpus_file.with_suffix(".json"))
+        known_sources = corpus.get_sources()
+        new_records = [item for item in data if item.get('filename') not in known_sources]
+        corpus.append(new_records)
+        logger.info(f"Данные сохранены в {corpus_file} (новых записей: {len(new_records)})")
+        return len(new_records)
 
 def main():
     """Основная функция для тестирования"""
@@ -264,10 +290,10 @@ def main():
             print(f"\n{i}. Страница {item['page']} - {item['category']} - {item['period']}")
             print(f"   {item['text'][:150]}...")
         
-        # Сохраняем в JSON
-        output_path = "data/processed/pdf_history_data.json"
-        reader.save_to_json(historical_data, output_path)
-        print(f"\n💾 Данные сохранены в {output_path}")
+        # Дописываем в корпус обработанных данных
+        output_path = "data/processed/pdf_history_data.jsonl"
+        added = reader.save_to_corpus(historical_data, output_path)
+        print(f"\n💾 Данные сохранены в {output_path} (новых записей: {added})")
         
         # Статистика
         categories = {}
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Динамическое квантование моделей в int8 для инференса на CPU
+Веса линейных слоев хранятся в int8, активации квантуются на лету; квантованная модель
+кешируется на диске, чтобы не квантовать ее при каждом запуске
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable
+import logging
+
+import torch
+import torch.nn as nn
+from transformers.pytorch_utils import Conv1D
+
+from answer_cache import model_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Версия способа квантования; при изменении кеш перестраивается
+QUANTIZATION_VERSION = "1"
+
+QUANTIZED_CACHE_DIR = "data/cache/quantized"
+
+SUPPORTED_QUANTIZATION = ("int8",)
+
+def conv1d_to_linear(model: nn.Module) -> int:
+    """
+    Заменяет слои Conv1D (GPT-2) эквивалентными nn.Linear
+    
+    Динамическое квантование PyTorch работает только с nn.Linear.
+    
+    Args:
+        model: Модель transformers
+    
+    Returns:
+        Количество замененных слоев
+    """
+    targets = [name for name, module in model.named_modules() if isinstance(module, Conv1D)]
+    for name in targets:
+        conv = model.get_submodule(name)
+        in_features, out_features = conv.weight.shape
+        linear = nn.Linear(in_features, out_features, dtype=conv.weight.dtype, device=conv.weight.device)
+        with torch.no_grad():
+            linear.weight.copy_(conv.weight.t())
+            linear.bias.copy_(conv.bias)
+        parent_name, _, child_name = name.rpartition('.')
+        setattr(model.get_submodule(parent_name) if parent_name else model, child_name, linear)
+    return len(targets)
+
+def quantize_dynamic_int8(model: nn.Module) -> nn.Module:
+    """
+    Квантует линейные слои модели в int8 (на месте)
+    
+    Args:
+        model: Модель на CPU в режиме инференса
+    
+    Returns:
+        Квантованная модель
+    """
+    model.eval()
+    converted = conv1d_to_linear(model)
+    torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    logger.info(f"Модель квантована в int8 (Conv1D заменено на Linear: {converted})")
+    return model
+
+def _source_key(source: str) -> str:
+    """Хеш пути исходной модели: общий префикс всех файлов кеша этой модели"""
+    source = str(Path(source).resolve()) if Path(source).is_dir() else str(source)
+    return hashlib.blake2b(source.encode('utf-8'), digest_size=8).hexdigest()
+
+def _cache_file(source: str, cache_dir: str) -> Path:
+    """
+    Файл кеша: путь исходной модели, ее отпечаток и версия PyTorch (формат
+    квантованных слоев)
+    """
+    key = (f"{_source_key(source)}-{model_fingerprint(source)}"
+           f"-torch{torch.__version__.split('+')[0]}-v{QUANTIZATION_VERSION}")
+    return Path(cache_dir) / f"{key}.int8.pt"
+
+def _remove_stale_cache_files(source: str, cache_file: Path):
+    """Удаляет файлы кеша модели, сохраненные для прежних весов или версий PyTorch"""
+    for path in cache_file.parent.glob(f"{_source_key(source)}-*.int8.pt"):
+        if path != cache_file:
+            path.unlink(missing_ok=True)
+            logger.info(f"Удален устаревший файл кеша квантованной модели {path.name}")
+
+def load_quantized_model(source: str, load_fp32: Callable[[], nn.Module], quantize: str = "int8",
+                         device: str = "cpu", cache_dir: str = QUANTIZED_CACHE_DIR) -> nn.Module:
+    """
+    Возвращает квантованную модель из кеша или квантует загруженную модель
+    
+    Args:
+        source: Путь или название исходной модели (ключ кеша)
+        load_fp32: Функция, загружающая исходную модель в fp32
+        quantize: Способ квантования ('int8')
+        device: Устройство инференса; квантование поддерживается только на CPU
+        cache_dir: Директория кеша квантованных моделей
+    
+    Returns:
+        Модель (квантованная или, не на CPU, исходная)
+    """
+    if quantize not in SUPPORTED_QUANTIZATION:
+        raise ValueError(f"Неподдерживаемое квантование: {quantize} (доступно: {', '.join(SUPPORTED_QUANTIZATION)})")
+    if device != "cpu":
+        logger.warning(f"Квантование {quantize} работает только на CPU, на {device} загружается fp32")
+        return load_fp32()
+    
+    cache_file = _cache_file(source, cache_dir)
+    if cache_file.exists():
+        try:
+            model = torch.load(cache_file, map_location="cpu", weights_only=False)
+            logger.info(f"Квантованная модель загружена из кеша {cache_file}")
+            return model
+        except Exception as e:
+            logger.warning(f"Ошибка загрузки квантованной модели из кеша, квантуем заново: {e}")
+    
+    model = quantize_dynamic_int8(load_fp32().to("cpu"))
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_file.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                torch.save(model, f)
+            os.replace(tmp_path, cache_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        logger.info(f"Квантованная модель сохранена в кеш {cache_file}")
+        _remove_stale_cache_files(source, cache_file)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить квантованную модель в кеш: {e}")
+    return model
+
+def model_size_bytes(model: nn.Module) -> int:
+    """Размер сериализованного state_dict модели в байтах (учитывает упакованные int8 веса)"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
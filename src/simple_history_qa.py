@@ -8,6 +8,9 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional
 import logging
 
+from bm25_index import BM25Index
+from facet_index import FacetIndex
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,50 +18,95 @@ logger = logging.getLogger(__name__)
 class SimpleHistoryQA:
     """Простая система вопросов и ответов по истории"""
     
-    def __init__(self, data_path: str = "data/processed/pdf_history_data.json"):
+    def __init__(self, data_path: str = "data/processed/pdf_history_data.jsonl", vector_index=None):
         """
         Инициализация системы
         
         Args:
-            data_path: Путь к файлу с историческими данными
+            data_path: Путь к файлу с историческими данными (корпус .jsonl или JSON-массив).
+                Если корпуса .jsonl нет, используется одноименный файл .json
+            vector_index: VectorIndex корпуса для поиска ближайших фрагментов
+                (без него используется поиск по ключевым словам)
         """
         self.data_path = Path(data_path)
+        self.vector_index = vector_index
         self.historical_data = []
+        self.bm25_index = None
+        self.facet_index = None
         self.load_data()
     
     def load_data(self):
         """Загружает исторические данные"""
         try:
-            if self.data_path.exists():
-                with open(self.data_path, 'r', encoding='utf-8') as f:
+            data_path = self.data_path
+            if data_path.suffix == '.jsonl' and not data_path.exists():
+                data_path = data_path.with_suffix('.json')
+            
+            if data_path.suffix == '.jsonl':
+                # Корпус читается построчно, без промежуточного разбора всего файла
+                from corpus_store import CorpusStore
+                corpus = CorpusStore(data_path)
+                self.historical_data = list(corpus.iter_records())
+                logger.info(f"Загружено {len(self.historical_data)} исторических записей")
+                # Индекс хранится рядом с корпусом и дополняется новыми записями
+                self.bm25_index = BM25Index(corpus)
+                self.facet_index = FacetIndex(corpus)
+            elif data_path.exists():
+                with open(data_path, 'r', encoding='utf-8') as f:
                     self.historical_data = json.load(f)
                 logger.info(f"Загружено {len(self.historical_data)} исторических записей")
+                self.bm25_index = BM25Index(self.historical_data)
+                self.facet_index = FacetIndex(self.historical_data)
             else:
                 logger.warning(f"Файл {self.data_path} не найден")
+            
+            if self.bm25_index is not None:
+                self.bm25_index.update()
+                self.facet_index.update()
         except Exception as e:
             logger.error(f"Ошибка при загрузке данных: {e}")
     
-    def search_by_keywords(self, query: str) -> List[Dict[str, Any]]:
+    def search_by_keywords(self, query: str, top_k: int = 10,
+                           record_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
         """
         Ищет исторические данные по ключевым словам
         
         Args:
             query: Поисковый запрос
+            top_k: Максимальное количество записей
+            record_ids: Искать только среди этих записей
         
         Returns:
-            Список найденных записей
+            Список найденных записей по убыванию релевантности (BM25)
         """
-        query_lower = query.lower()
-        results = []
+        if self.bm25_index is None:
+            return []
+        results = self.bm25_index.search(query, top_k=top_k, doc_ids=record_ids)
+        return [self.historical_data[doc_id] for doc_id, _ in results]
+    
+    def search(self, query: Optional[str] = None, category: Optional[str] = None,
+               period: Optional[str] = None, year_from: Optional[int] = None,
+               year_to: Optional[int] = None, top_k: int = 10) -> List[Dict[str, Any]]:
+        """
+        Ищет записи по ключевым словам среди записей, выбранных фасетами
         
-        for item in self.historical_data:
-            text_lower = item['text'].lower()
-            
-            # Проверяем совпадение ключевых слов
-            if any(word in text_lower for word in query_lower.split()):
-                results.append(item)
+        Args:
+            query: Поисковый запрос (без него возвращаются первые записи фасетов)
+            category: Категория (война, реформы, политика, etc.)
+            period: Период (X век, XVIII век, 18 век, etc.)
+            year_from: Начало диапазона упомянутых годов
+            year_to: Конец диапазона упомянутых годов
+            top_k: Максимальное количество записей
         
-        return results
+        Returns:
+            Список найденных записей
+        """
+        record_ids = self.facet_index.select(category, period, year_from, year_to) if self.facet_index else None
+        if query:
+            return self.search_by_keywords(query, top_k=top_k, record_ids=record_ids)
+        if record_ids is None:
+            return self.historical_data[:top_k]
+        return [self.historical_data[record_id] for record_id in record_ids[:top_k]]
     
     def answer_question(self, question: str) -> str:
         """
@@ -105,7 +153,13 @@ class SimpleHistoryQA:
                     if answer_key in question_lower:
                         return answer
         
-        # Если специального ответа нет, ищем в данных
+        # Если специального ответа нет, ищем ближайший фрагмент корпуса
+        if self.vector_index is not None and len(self.vector_index):
+            passages = self.vector_index.search(question, self.historical_data, top_k=1)
+            if passages:
+                return f"Согласно историческим данным: {passages[0]['text'].strip()}"
+        
+        # Без векторного индекса ищем по ключевым словам
         search_results = self.search_by_keywords(question)
         
         if search_results:
@@ -116,10 +170,21 @@ class SimpleHistoryQA:
         # Если ничего не найдено
         return "К сожалению, я не нашел информацию по вашему вопросу в доступных исторических данных. Попробуйте переформулировать вопрос или задать более конкретный вопрос."
     
-    def get_random_fact(self) -> str:
-        """Возвращает случайный исторический факт"""
-        if self.historical_data:
-            import random
+    def get_random_fact(self, category: Optional[str] = None, period: Optional[str] = None) -> str:
+        """
+        Возвращает случайный исторический факт
+        
+        Args:
+            category: Выбирать только из категории
+            period: Выбирать только из периода
+        """
+        import random
+        
+        record_ids = self.facet_index.select(category, period) if self.facet_index else None
+        if record_ids is not None:
+            if record_ids:
+                return f"Интересный исторический факт: {self.historical_data[random.choice(record_ids)]['text']}"
+        elif self.historical_data:
             fact = random.choice(self.historical_data)
             return f"Интересный исторический факт: {fact['text']}"
         return "Нет доступных исторических данных."
@@ -134,27 +199,23 @@ class SimpleHistoryQA:
         Returns:
             Список фактов
         """
-        facts = []
-        for item in self.historical_data:
-            if item.get('category', '').lower() == category.lower():
-                facts.append(item['text'])
-        return facts
+        if self.facet_index is None:
+            return []
+        return [self.historical_data[record_id]['text'] for record_id in self.facet_index.by_category(category)]
     
     def get_facts_by_period(self, period: str) -> List[str]:
         """
         Возвращает факты по определенному периоду
         
         Args:
-            period: Период (X век, XVIII век, etc.)
+            period: Период (X век, XVIII век, 18 век, etc.)
         
         Returns:
             Список фактов
         """
-        facts = []
-        for item in self.historical_data:
-            if period.lower() in item.get('period', '').lower():
-                facts.append(item['text'])
-        return facts
+        if self.facet_index is None:
+            return []
+        return [self.historical_data[record_id]['text'] for record_id in self.facet_index.by_period(period)]
 
 def main():
     """Основная функция для тестирования"""
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш извлеченного текста с адресацией по содержимому
+Хранит сырой и очищенный текст в виде сжатых блобов с вытеснением по LRU
+"""
+
+import hashlib
+import os
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Размер буфера для потокового хеширования файлов
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(file_path: Path, algorithm: str = "blake2b", chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """
+    Вычисляет хеш файла, читая его блоками фиксированного размера
+    
+    Args:
+        file_path: Путь к файлу
+        algorithm: Алгоритм хеширования из hashlib ('blake2b', 'md5', 'sha256', ...)
+        chunk_size: Размер блока чтения в байтах
+    
+    Returns:
+        Хеш файла в шестнадцатеричном виде
+    """
+    file_hash = hashlib.new(algorithm)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+class TextCache:
+    """
+    Дисковый кеш текстов
+    
+    Ключ записи - хеш содержимого (файла или исходного текста) вместе с версией
+    обработчика, поэтому изменение файла или алгоритма извлечения автоматически
+    дает промах. Порядок использования отслеживается по времени модификации блобов.
+    """
+    
+    def __init__(self, cache_dir: str = "data/cache/text", max_size_mb: int = 2048):
+        """
+        Инициализация кеша
+        
+        Args:
+            cache_dir: Директория для хранения блобов
+            max_size_mb: Максимальный суммарный размер кеша в мегабайтах
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size_mb * 1024 * 1024
+        self._total_size = None
+        self.hits = 0
+        self.misses = 0
+    
+    def file_key(self, file_path: Path, version: str) -> str:
+        """
+        Возвращает ключ кеша для содержимого файла
+        
+        Args:
+            file_path: Путь к файлу
+            version: Версия обработчика, извлекающего текст
+        """
+        return f"{hash_file(file_path)}-{version}"
+    
+    def text_key(self, text: str, version: str) -> str:
+        """
+        Возвращает ключ кеша для текста
+        
+        Args:
+            text: Исходный текст
+            version: Версия обработчика текста
+        """
+        return f"{hashlib.blake2b(text.encode('utf-8', errors='surrogatepass')).hexdigest()}-{version}"
+    
+    def _blob_path(self, key: str, kind: str) -> Path:
+        """Путь к блобу: подкаталог по первым символам ключа"""
+        return self.cache_dir / key[:2] / f"{key}.{kind}.zz"
+    
+    def get(self, key: str, kind: str) -> Optional[str]:
+        """
+        Возвращает текст из кеша
+        
+        Args:
+            key: Ключ записи
+            kind: Тип текста ('raw' или 'clean')
+        
+        Returns:
+            Текст или None, если записи нет
+        """
+        blob_path = self._blob_path(key, kind)
+        try:
+            with open(blob_path, 'rb') as f:
+                text = zlib.decompress(f.read()).decode('utf-8', errors='surrogatepass')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning(f"Поврежденная запись кеша {blob_path.name}: {e}")
+            self.misses += 1
+            return None
+        
+        # Отмечаем использование записи для LRU
+        try:
+            os.utime(blob_path)
+        except OSError:
+            pass
+        
+        self.hits += 1
+        return text
+    
+    def put(self, key: str, kind: str, text: str):
+        """
+        Сохраняет текст в кеш
+        
+        Запись выполняется через временный файл и атомарное переименование,
+        поэтому кешем могут одновременно пользоваться несколько процессов.
+        
+        Args:
+            key: Ключ записи
+            kind: Тип текста ('raw' или 'clean')
+            text: Текст для сохранения
+        """
+        blob_path = self._blob_path(key, kind)
+        try:
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            data = zlib.compress(text.encode('utf-8', errors='surrogatepass'), 6)
+            
+            fd, tmp_path = tempfile.mkstemp(dir=blob_path.parent, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, blob_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить запись кеша {blob_path.name}: {e}")
+            return
+        
+        if self._total_size is not None:
+            self._total_size += len(data)
+        self._evict_if_needed()
+    
+    def _iter_blobs(self):
+        """Перебирает все блобы кеша"""
+        if not self.cache_dir.exists():
+            return
+        yield from self.cache_dir.glob("*/*.zz")
+    
+    def _evict_if_needed(self):
+        """Удаляет давно не использованные записи, пока кеш превышает лимит"""
+        if self._total_size is not None and self._total_size <= self.max_size:
+            return
+        
+        blobs = []
+        for blob_path in self._iter_blobs():
+            try:
+                stat = blob_path.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, blob_path))
+        
+        self._total_size = sum(size for _, size, _ in blobs)
+        if self._total_size <= self.max_size:
+            return
+        
+        blobs.sort()
+        removed = 0
+        for _, size, blob_path in blobs:
+            if self._total_size <= self.max_size:
+                break
+            try:
+                blob_path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+            self._total_size -= size
+        
+        logger.info(f"Из кеша текстов вытеснено {removed} записей")
+    
+    def get_stats(self) -> dict:
+        """
+        Возвращает статистику кеша
+        
+        Returns:
+            Словарь с количеством записей, размером и счетчиками попаданий
+        """
+        sizes = [blob_path.stat().st_size for blob_path in self._iter_blobs()]
+        return {
+            "entries": len(sizes),
+            "size": sum(sizes),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "cache_dir": str(self.cache_dir)
+        }
+    
+    def clear(self):
+        """Полностью очищает кеш"""
+        for blob_path in list(self._iter_blobs()):
+            try:
+                blob_path.unlink()
+            except FileNotFoundError:
+                pass
+        self._total_size = 0
+        logger.info("Кеш текстов очищен")
+
+# Глобальный экземпляр кеша (None - кеширование отключено)
+text_cache = TextCache()
+
+def get_text_cache() -> Optional[TextCache]:
+    """Возвращает глобальный кеш текстов"""
+    return text_cache
+
+def set_text_cache(cache: Optional[TextCache]):
+    """
+    Заменяет глобальный кеш текстов
+    
+    Args:
+        cache: Новый кеш или None, чтобы отключить кеширование
+    """
+    global text_cache
+    text_cache = cache
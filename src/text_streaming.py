@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковая генерация текста
+Текст выдается по мере генерации токенов; генерацию можно остановить событием
+или закрытием итератора
+"""
+
+import threading
+from typing import Dict, Iterator, Optional
+import logging
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+logger = logging.getLogger(__name__)
+
+class StopOnEvent(StoppingCriteria):
+    """Останавливает generate, когда установлено событие"""
+    
+    def __init__(self, stop_event: threading.Event):
+        self.stop_event = stop_event
+    
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.stop_event.is_set()
+
+def stream_generate(model, tokenizer, generate_kwargs: Dict,
+                    stop_event: Optional[threading.Event] = None) -> Iterator[str]:
+    """
+    Запускает model.generate в отдельном потоке и выдает декодированный текст
+    
+    Генерация прекращается после очередного токена, если установлен stop_event
+    или итератор закрыт (например, клиент отключился).
+    
+    Args:
+        model: Модель transformers
+        tokenizer: Токенизатор модели
+        generate_kwargs: Аргументы model.generate (с input_ids промпта)
+        stop_event: Событие отмены генерации
+    
+    Yields:
+        Фрагменты текста без промпта
+    """
+    stop_event = stop_event or threading.Event()
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True,
+                                    clean_up_tokenization_spaces=True)
+    kwargs = dict(generate_kwargs, streamer=streamer,
+                  stopping_criteria=StoppingCriteriaList([StopOnEvent(stop_event)]))
+    
+    errors = []
+    def run_generate():
+        try:
+            with torch.no_grad():
+                model.generate(**kwargs)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+    
+    thread = threading.Thread(target=run_generate, daemon=True)
+    thread.start()
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    finally:
+        # При досрочном закрытии итератора останавливаем генерацию
+        stop_event.set()
+        thread.join()
+    
+    if errors:
+        raise errors[0]
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш токенизированного корпуса в виде отображаемых в память массивов
+Окна токенов хранятся в шардах .npy; при новом запуске токенизируются только новые записи
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from token_chunker import IGNORE_INDEX, TOKENIZE_BATCH_SIZE, chunk_token_ids, tokenize_texts
+
+logger = logging.getLogger(__name__)
+
+# Версия формата шардов и алгоритма нарезки окон: изменение дает новый отпечаток
+TOKEN_CACHE_VERSION = "2"
+
+# Максимальное количество окон в одном шарде
+SHARD_ROWS = 8192
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Вычисляет отпечаток токенизатора
+    
+    Учитывается полное описание быстрого токенизатора (или словарь медленного)
+    и специальные токены, поэтому дообученный или замененный токенизатор
+    получает другой отпечаток.
+    
+    Args:
+        tokenizer: Токенизатор HuggingFace
+    
+    Returns:
+        Отпечаток в шестнадцатеричном виде
+    """
+    fingerprint = hashlib.blake2b(digest_size=16)
+    fingerprint.update(type(tokenizer).__name__.encode('utf-8'))
+    
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        fingerprint.update(backend.to_str().encode('utf-8'))
+    else:
+        fingerprint.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode('utf-8'))
+    
+    special = {
+        "bos": tokenizer.bos_token_id,
+        "eos": tokenizer.eos_token_id,
+        "pad": tokenizer.pad_token_id,
+        "added": sorted(tokenizer.get_added_vocab().items()) if hasattr(tokenizer, "get_added_vocab") else []
+    }
+    fingerprint.update(json.dumps(special, ensure_ascii=False).encode('utf-8'))
+    return fingerprint.hexdigest()
+
+def record_hash(text: str) -> str:
+    """Возвращает хеш текста записи корпуса"""
+    return hashlib.blake2b(text.encode('utf-8', errors='surrogatepass'), digest_size=16).hexdigest()
+
+class TokenCache:
+    """
+    Кеш окон токенов для набора параметров (токенизатор, max_length, stride)
+    
+    Структура каталога <cache_dir>/<отпечаток>/:
+        manifest.json - хеш записи -> список диапазонов строк [шард, начало, конец]
+        shard-XXXXXX.ids.npy - окна id токенов (int32, max_length столбцов,
+            короткие окна дополнены pad)
+        shard-XXXXXX.len.npy - длины окон без дополнения (int32)
+    """
+    
+    def __init__(self, tokenizer, max_length: int = 512, stride: int = 64,
+                 cache_dir: str = "data/cache/tokens"):
+        """
+        Инициализация кеша
+        
+        Args:
+            tokenizer: Токенизатор HuggingFace
+            max_length: Длина окна в токенах
+            stride: Перекрытие соседних окон в токенах
+            cache_dir: Корневая директория кеша
+        """
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.stride = stride
+        
+        key = hashlib.blake2b(
+            f"{tokenizer_fingerprint(tokenizer)}-{max_length}-{stride}-v{TOKEN_CACHE_VERSION}".encode('utf-8'),
+            digest_size=16
+        ).hexdigest()
+        self.cache_dir = Path(cache_dir) / key
+        self.manifest_file = self.cache_dir / "manifest.json"
+        
+        self.pad_id = tokenizer.pad_token_id
+        if self.pad_id is None:
+            self.pad_id = tokenizer.eos_token_id if tokenizer.eos_token_id is not None else 0
+        
+        self.manifest = self._load_manifest()
+    
+    def _load_manifest(self) -> Dict:
+        """Загружает манифест кеша"""
+        if self.manifest_file.exists():
+            try:
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.warning(f"Ошибка загрузки манифеста кеша токенов: {e}")
+        return {"records": {}, "shards": {}, "next_shard": 0}
+    
+    def _save_manifest(self):
+        """Атомарно сохраняет манифест"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix="manifest", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def _shard_paths(self, shard: str) -> Tuple[Path, Path]:
+        """Пути к файлам окон и длин шарда"""
+        return self.cache_dir / f"{shard}.ids.npy", self.cache_dir / f"{shard}.len.npy"
+    
+    def _write_shard(self, windows: List[List[int]]) -> str:
+        """
+        Записывает окна в новый шард
+        
+        Args:
+            windows: Окна id токенов
+        
+        Returns:
+            Имя шарда
+        """
+        shard = f"shard-{self.manifest['next_shard']:06d}"
+        self.manifest["next_shard"] += 1
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        ids_path, len_path = self._shard_paths(shard)
+        
+        ids = np.lib.format.open_memmap(ids_path, mode='w+', dtype=np.int32,
+                                        shape=(len(windows), self.max_length))
+        ids[:] = self.pad_id
+        lengths = np.empty(len(windows), dtype=np.int32)
+        for row, window in enumerate(windows):
+            ids[row, :len(window)] = window
+            lengths[row] = len(window)
+        ids.flush()
+        del ids
+        np.save(len_path, lengths)
+        
+        self.manifest["shards"][shard] = len(windows)
+        return shard
+    
+    def update(self, texts: Iterable[str], batch_size: int = TOKENIZE_BATCH_SIZE) -> List[str]:
+        """
+        Токенизирует записи, которых еще нет в кеше
+        
+        Args:
+            texts: Тексты записей корпуса (в порядке корпуса)
+            batch_size: Количество текстов в одном вызове токенизатора
+        
+        Returns:
+            Хеши всех непустых записей в порядке texts
+        """
+        hashes = []
+        new_texts = {}
+        for text in texts:
+            if not text:
+                continue
+            text_hash = record_hash(text)
+            hashes.append(text_hash)
+            if text_hash not in self.manifest["records"] and text_hash not in new_texts:
+                new_texts[text_hash] = text
+        
+        if not new_texts:
+            logger.info(f"Кеш токенов: все {len(hashes)} записей уже токенизированы")
+            return hashes
+        
+        logger.info(f"Кеш токенов: токенизируем {len(new_texts)} новых записей из {len(hashes)}")
+        
+        windows = []
+        pending = {}
+        token_ids_iter = tokenize_texts(new_texts.values(), self.tokenizer, batch_size=batch_size)
+        for text_hash, token_ids in zip(new_texts, token_ids_iter):
+            # Без перекрытия окна сохраняются целиком, включая остаток из одного
+            # токена: склеенные окна записи точно воспроизводят ее токены (для упаковки)
+            record_windows = list(chunk_token_ids(token_ids, max_length=self.max_length, stride=self.stride,
+                                                  min_length=1 if self.stride == 0 else 2))
+            
+            # Окна одной записи не разрываются между шардами
+            if windows and len(windows) + len(record_windows) > SHARD_ROWS:
+                self._commit_shard(windows, pending)
+                windows, pending = [], {}
+            
+            pending[text_hash] = (len(windows), len(windows) + len(record_windows))
+            windows.extend(record_windows)
+        
+        if pending:
+            self._commit_shard(windows, pending)
+        
+        return hashes
+    
+    def _commit_shard(self, windows: List[List[int]], pending: Dict[str, Tuple[int, int]]):
+        """Записывает шард и регистрирует его записи в манифесте"""
+        shard = self._write_shard(windows) if windows else None
+        for text_hash, (start, end) in pending.items():
+            self.manifest["records"][text_hash] = [[shard, start, end]] if shard and end > start else []
+        self._save_manifest()
+    
+    def prune(self, keep_hashes: Iterable[str]) -> int:
+        """
+        Удаляет записи, отсутствующие в корпусе, и шарды без записей
+        
+        Args:
+            keep_hashes: Хеши записей, которые нужно сохранить
+        
+        Returns:
+            Количество удаленных шардов
+        """
+        keep = set(keep_hashes)
+        records = {h: ranges for h, ranges in self.manifest["records"].items() if h in keep}
+        used_shards = {shard for ranges in records.values() for shard, _, _ in ranges}
+        
+        removed = 0
+        for shard in list(self.manifest["shards"]):
+            if shard in used_shards:
+                continue
+            for path in self._shard_paths(shard):
+                if path.exists():
+                    path.unlink()
+            del self.manifest["shards"][shard]
+            removed += 1
+        
+        if removed or len(records) != len(self.manifest["records"]):
+            self.manifest["records"] = records
+            self._save_manifest()
+        if removed:
+            logger.info(f"Кеш токенов: удалено {removed} неиспользуемых шардов")
+        return removed
+    
+    def get_dataset(self, hashes: List[str], pad_to_max_length: bool = True) -> "MemmapTokenDataset":
+        """
+        Возвращает датасет окон для указанных записей
+        
+        Args:
+            hashes: Хеши записей в нужном порядке (как вернул update)
+            pad_to_max_length: Выдавать окна длиной max_length с маской дополнения
+        
+        Returns:
+            Датасет, читающий окна прямо из отображенных в память шардов
+        """
+        rows = []
+        for text_hash in hashes:
+            for shard, start, end in self.manifest["records"].get(text_hash, []):
+                rows.append((shard, start, end))
+        return MemmapTokenDataset(self.cache_dir, rows, pad_id=self.pad_id, pad_to_max_length=pad_to_max_length)
+    
+    def get_packed_dataset(self, hashes: List[str], block_size: Optional[int] = None) -> "PackedTokenDataset":
+        """
+        Возвращает датасет упакованных блоков для указанных записей
+        
+        Args:
+            hashes: Хеши записей в нужном порядке (как вернул update)
+            block_size: Длина блока в токенах (по умолчанию max_length)
+        
+        Returns:
+            Датасет блоков, склеенных из токенов записей подряд
+        """
+        if self.stride != 0:
+            raise ValueError("Упаковка требует кеша без перекрытия окон (stride=0)")
+        
+        rows = []
+        for text_hash in hashes:
+            for shard, start, end in self.manifest["records"].get(text_hash, []):
+                rows.append((shard, start, end))
+        return PackedTokenDataset(self.cache_dir, rows, block_size=block_size or self.max_length,
+                                  pad_id=self.pad_id)
+    
+    def build_dataset(self, texts: Iterable[str], pad_to_max_length: bool = True,
+                      prune: bool = True, pack: bool = False) -> Dataset:
+        """
+        Обновляет кеш по текстам корпуса и возвращает датасет
+        
+        Args:
+            texts: Тексты записей корпуса
+            pad_to_max_length: Выдавать окна длиной max_length с маской дополнения
+            prune: Удалить шарды записей, которых больше нет в корпусе
+            pack: Вернуть упакованные блоки по max_length токенов (см. PackedTokenDataset)
+        
+        Returns:
+            Датасет для Trainer
+        """
+        hashes = self.update(texts)
+        if prune:
+            self.prune(hashes)
+        
+        if pack:
+            dataset = self.get_packed_dataset(hashes)
+            logger.info(f"Кеш токенов: {len(dataset)} упакованных блоков по {self.max_length} токенов "
+                        f"({self.cache_dir})")
+            return dataset
+        
+        dataset = self.get_dataset(hashes, pad_to_max_length=pad_to_max_length)
+        logger.info(f"Кеш токенов: датасет из {len(dataset)} окон ({self.cache_dir})")
+        return dataset
+
+class MemmapTokenDataset(Dataset):
+    """
+    Датасет окон токенов поверх шардов .npy, отображенных в память
+    
+    Шарды не загружаются в память целиком: каждое окно читается из отображения
+    при обращении к примеру.
+    """
+    
+    def __init__(self, cache_dir: Path, ranges: List[Tuple[str, int, int]], pad_id: int,
+                 pad_to_max_length: bool = True, min_window_length: int = 2):
+        """
+        Инициализация датасета
+        
+        Args:
+            cache_dir: Директория шардов
+            ranges: Диапазоны строк [шард, начало, конец) в порядке датасета
+            pad_id: id токена дополнения
+            pad_to_max_length: Выдавать окна длиной max_length с маской дополнения
+            min_window_length: Более короткие окна пропускаются (окно из одного
+                токена не дает ни одного предсказания следующего токена)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.pad_id = pad_id
+        self.pad_to_max_length = pad_to_max_length
+        self._ids = {}
+        self._lengths = {}
+        
+        shards = []
+        rows = []
+        for shard, start, end in ranges:
+            shards.extend([shard] * (end - start))
+            rows.extend(range(start, end))
+        self.shard_names = sorted(set(shards))
+        shard_numbers = {shard: number for number, shard in enumerate(self.shard_names)}
+        self.shard_index = np.array([shard_numbers[shard] for shard in shards], dtype=np.int32)
+        self.row_index = np.array(rows, dtype=np.int64)
+        
+        if min_window_length > 1:
+            window_lengths = self._window_lengths()
+            if len(window_lengths) and window_lengths.min() < min_window_length:
+                keep = window_lengths >= min_window_length
+                self.shard_index = self.shard_index[keep]
+                self.row_index = self.row_index[keep]
+    
+    def example_lengths(self) -> np.ndarray:
+        """Длины примеров без дополнения (для группировки пакетов по длине)"""
+        return self._window_lengths()
+    
+    def _window_lengths(self) -> np.ndarray:
+        """Длины всех окон датасета в порядке датасета"""
+        window_lengths = np.zeros(len(self.row_index), dtype=np.int64)
+        for number, shard in enumerate(self.shard_names):
+            lengths = np.load(self.cache_dir / f"{shard}.len.npy")
+            selected = self.shard_index == number
+            window_lengths[selected] = lengths[self.row_index[selected]]
+        return window_lengths
+    
+    def _open_shard(self, number: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Отображает шард в память при первом обращении"""
+        if number not in self._ids:
+            shard = self.shard_names[number]
+            # mmap_mode='c': копирование при записи, массив доступен torch.from_numpy без копии
+            self._ids[number] = np.load(self.cache_dir / f"{shard}.ids.npy", mmap_mode='c')
+            self._lengths[number] = np.load(self.cache_dir / f"{shard}.len.npy")
+        return self._ids[number], self._lengths[number]
+    
+    def __len__(self) -> int:
+        return len(self.row_index)
+    
+    def __getitem__(self, index: int) -> Dict[str, torch.Tensor]:
+        ids, lengths = self._open_shard(int(self.shard_index[index]))
+        row = int(self.row_index[index])
+        length = int(lengths[row])
+        
+        if not self.pad_to_max_length:
+            input_ids = torch.from_numpy(ids[row, :length]).long()
+            return {
+                "input_ids": input_ids,
+                "attention_mask": torch.ones(length, dtype=torch.long)
+            }
+        
+        input_ids = torch.from_numpy(ids[row]).long()
+        attention_mask = torch.zeros(input_ids.shape[0], dtype=torch.long)
+        attention_mask[:length] = 1
+        labels = input_ids.clone()
+        labels[length:] = IGNORE_INDEX
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "labels": labels
+        }
+    
+    def __getstate__(self) -> Dict:
+        # Отображения не передаются в процессы DataLoader, а открываются заново
+        state = self.__dict__.copy()
+        state["_ids"] = {}
+        state["_lengths"] = {}
+        return state
+
+class PackedTokenDataset(MemmapTokenDataset):
+    """
+    Упакованные блоки для обучения causal LM
+    
+    Токены записей (каждая обрамлена BOS/EOS) склеиваются в один поток и режутся
+    на блоки ровно по block_size токенов, поэтому в пакетах нет дополнения.
+    Только последний блок может быть короче: он дополняется, дополнение
+    исключено из attention_mask и labels. Внутри блока модель видит предыдущие
+    документы, отделенные EOS, как при стандартном предобучении GPT.
+    """
+    
+    def __init__(self, cache_dir: Path, ranges: List[Tuple[str, int, int]], block_size: int, pad_id: int):
+        """
+        Инициализация датасета
+        
+        Args:
+            cache_dir: Директория шардов (кеш без перекрытия окон)
+            ranges: Диапазоны строк [шард, начало, конец) в порядке датасета
+            block_size: Длина блока в токенах
+            pad_id: id токена дополнения
+        """
+        super().__init__(cache_dir, ranges, pad_id, pad_to_max_length=True, min_window_length=1)
+        self.block_size = block_size
+        
+        # Смещение начала каждого окна в общем потоке токенов
+        self.window_offsets = np.zeros(len(self.row_index) + 1, dtype=np.int64)
+        np.cumsum(self._window_lengths(), out=self.window_offsets[1:])
+        self.total_tokens = int(self.window_offsets[-1])
+    
+    def __len__(self) -> int:
+        return -(-self.total_tokens // self.block_size)
+    
+    def example_lengths(self) -> np.ndarray:
+        """Длины блоков без дополнения"""
+        lengths = np.full(len(self), self.block_size, dtype=np.int64)
+        if len(lengths):
+            lengths[-1] = self.total_tokens - (len(lengths) - 1) * self.block_size
+        return lengths
+    
+    def __getitem__(self, index: int) -> Dict[str, torch.Tensor]:
+        if index < 0:
+            index += len(self)
+        start = index * self.block_size
+        end = min(start + self.block_size, self.total_tokens)
+        if not 0 <= start < end:
+            raise IndexError(f"Нет блока с номером {index}")
+        
+        input_ids = torch.full((self.block_size,), self.pad_id, dtype=torch.long)
+        window = int(np.searchsorted(self.window_offsets, start, side='right')) - 1
+        position = start
+        while position < end:
+            ids, lengths = self._open_shard(int(self.shard_index[window]))
+            row = int(self.row_index[window])
+            window_start = int(self.window_offsets[window])
+            take_from = position - window_start
+            take_to = min(int(lengths[row]), end - window_start)
+            piece = torch.from_numpy(ids[row, take_from:take_to])
+            input_ids[position - start:position - start + len(piece)] = piece
+            position += len(piece)
+            window += 1
+        
+        length = end - start
+        attention_mask = torch.zeros(self.block_size, dtype=torch.long)
+        attention_mask[:length] = 1
+        labels = input_ids.clone()
+        labels[length:] = IGNORE_INDEX
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "labels": labels
+        }
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Разбиение корпуса на окна точной длины в токенах
+Тексты токенизируются один раз пакетами, окна возвращаются сразу в виде id токенов
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Количество текстов в одном вызове токенизатора
+TOKENIZE_BATCH_SIZE = 64
+
+# Значение labels для позиций, не участвующих в вычислении loss
+IGNORE_INDEX = -100
+
+def tokenize_texts(texts: Iterable[str], tokenizer, batch_size: int = TOKENIZE_BATCH_SIZE,
+                   add_bos_eos: bool = True) -> Iterator[List[int]]:
+    """
+    Токенизирует тексты пакетами
+    
+    Args:
+        texts: Итератор текстов
+        tokenizer: Токенизатор HuggingFace (желательно быстрый)
+        batch_size: Количество текстов в одном вызове токенизатора
+        add_bos_eos: Обрамлять каждый текст токенами начала и конца текста
+    
+    Yields:
+        Списки id токенов, по одному на текст, в порядке texts
+    """
+    bos = [tokenizer.bos_token_id] if add_bos_eos and tokenizer.bos_token_id is not None else []
+    eos = [tokenizer.eos_token_id] if add_bos_eos and tokenizer.eos_token_id is not None else []
+    
+    batch = []
+    for text in texts:
+        if not text:
+            continue
+        batch.append(text)
+        if len(batch) >= batch_size:
+            yield from _tokenize_batch(batch, tokenizer, bos, eos)
+            batch = []
+    
+    if batch:
+        yield from _tokenize_batch(batch, tokenizer, bos, eos)
+
+def _tokenize_batch(batch: List[str], tokenizer, bos: List[int], eos: List[int]) -> Iterator[List[int]]:
+    """Токенизирует один пакет текстов без усечения"""
+    # verbose=False: длинные тексты здесь ожидаемы, окна нарезаются ниже
+    encoded = tokenizer(batch, add_special_tokens=False, return_attention_mask=False, verbose=False)
+    for ids in encoded["input_ids"]:
+        yield bos + list(ids) + eos
+
+def chunk_token_ids(token_ids: List[int], max_length: int = 512, stride: int = 0,
+                    min_length: int = 2) -> Iterator[List[int]]:
+    """
+    Нарезает последовательность токенов на окна
+    
+    Все окна, кроме последнего, имеют длину ровно max_length. Последнее окно
+    короче и содержит остаток текста, поэтому ни один токен не теряется.
+    
+    Args:
+        token_ids: id токенов текста
+        max_length: Длина окна в токенах
+        stride: Перекрытие соседних окон в токенах (как stride в токенизаторах HuggingFace)
+        min_length: Минимальная длина окна; более короткие остатки отбрасываются
+    
+    Yields:
+        Окна id токенов
+    """
+    step = max_length - stride
+    if step <= 0:
+        raise ValueError("stride должен быть меньше max_length")
+    
+    for start in range(0, len(token_ids), step):
+        window = token_ids[start:start + max_length]
+        if len(window) >= min_length:
+            yield window
+        if start + max_length >= len(token_ids):
+            break
+
+def iter_token_chunks(texts: Iterable[str], tokenizer, max_length: int = 512, stride: int = 0,
+                      batch_size: int = TOKENIZE_BATCH_SIZE, min_length: int = 2) -> Iterator[List[int]]:
+    """
+    Токенизирует тексты и выдает окна точной длины
+    
+    Args:
+        texts: Итератор текстов
+        tokenizer: Токенизатор HuggingFace
+        max_length: Длина окна в токенах
+        stride: Перекрытие соседних окон в токенах
+        batch_size: Количество текстов в одном вызове токенизатора
+        min_length: Минимальная длина окна
+    
+    Yields:
+        Окна id токенов
+    """
+    for token_ids in tokenize_texts(texts, tokenizer, batch_size=batch_size):
+        yield from chunk_token_ids(token_ids, max_length=max_length, stride=stride, min_length=min_length)
+
+def build_chunk_dataset(texts: Iterable[str], tokenizer, max_length: int = 512, stride: int = 0,
+                        pad_to_max_length: bool = False,
+                        batch_size: int = TOKENIZE_BATCH_SIZE) -> List[Dict[str, List[int]]]:
+    """
+    Создает примеры для обучения языковой модели из окон токенов
+    
+    Args:
+        texts: Итератор текстов
+        tokenizer: Токенизатор HuggingFace
+        max_length: Длина окна в токенах
+        stride: Перекрытие соседних окон в токенах
+        pad_to_max_length: Дополнять короткие окна до max_length. Тогда в примеры
+            добавляются labels, где дополнение помечено IGNORE_INDEX; иначе примеры
+            имеют разную длину, а labels строит коллатор
+        batch_size: Количество текстов в одном вызове токенизатора
+    
+    Returns:
+        Список словарей с input_ids, attention_mask (и labels)
+    """
+    pad_id: Optional[int] = tokenizer.pad_token_id
+    if pad_to_max_length and pad_id is None:
+        pad_id = tokenizer.eos_token_id
+    
+    examples = []
+    total_tokens = 0
+    for window in iter_token_chunks(texts, tokenizer, max_length=max_length, stride=stride,
+                                    batch_size=batch_size):
+        total_tokens += len(window)
+        if not pad_to_max_length:
+            examples.append({
+                "input_ids": window,
+                "attention_mask": [1] * len(window)
+            })
+            continue
+        
+        padding = max_length - len(window)
+        examples.append({
+            "input_ids": window + [pad_id] * padding,
+            "attention_mask": [1] * len(window) + [0] * padding,
+            "labels": window + [IGNORE_INDEX] * padding
+        })
+    
+    logger.info(f"Создано {len(examples)} окон по {max_length} токенов ({total_tokens:,} токенов)")
+    return examples
+
+def pack_token_ids(token_id_seqs: Iterable[List[int]], block_size: int = 512) -> Iterator[List[int]]:
+    """
+    Склеивает документы в один поток токенов и режет его на блоки
+    
+    Документы уже обрамлены BOS/EOS (см. tokenize_texts), поэтому границы
+    между ними сохраняются. Все блоки, кроме последнего, имеют длину ровно block_size.
+    
+    Args:
+        token_id_seqs: Итератор списков id токенов документов
+        block_size: Длина блока в токенах
+        
+    Yields:
+        Блоки id токенов
+    """
+    buffer = []
+    for token_ids in token_id_seqs:
+        buffer.extend(token_ids)
+        while len(buffer) >= block_size:
+            yield buffer[:block_size]
+            del buffer[:block_size]
+    
+    if buffer:
+        yield buffer
+
+def build_packed_dataset(texts: Iterable[str], tokenizer, block_size: int = 512,
+                         batch_size: int = TOKENIZE_BATCH_SIZE) -> List[Dict[str, List[int]]]:
+    """
+    Создает упакованные примеры для обучения causal LM
+    
+    Каждый пример - полный блок из block_size токенов подряд идущих документов.
+    Последний неполный блок дополняется; дополнение исключено из attention_mask
+    и labels (IGNORE_INDEX).
+    
+    Args:
+        texts: Итератор текстов
+        tokenizer: Токенизатор HuggingFace
+        block_size: Длина блока в токенах
+        batch_size: Количество текстов в одном вызове токенизатора
+        
+    Returns:
+        Список словарей с input_ids, attention_mask и labels
+    """
+    pad_id = tokenizer.pad_token_id
+    if pad_id is None:
+        pad_id = tokenizer.eos_token_id
+    
+    examples = []
+    total_tokens = 0
+    for block in pack_token_ids(tokenize_texts(texts, tokenizer, batch_size=batch_size), block_size):
+        total_tokens += len(block)
+        padding = block_size - len(block)
+        examples.append({
+            "input_ids": block + [pad_id] * padding,
+            "attention_mask": [1] * len(block) + [0] * padding,
+            "labels": block + [IGNORE_INDEX] * padding
+        })
+    
+    logger.info(f"Упаковано {total_tokens:,} токенов в {len(examples)} блоков по {block_size}")
+    return examples
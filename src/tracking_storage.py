@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Хранилища данных отслеживания изученных файлов
+JSON-файл (с необязательным журналом изменений) и индексированная база SQLite
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Поля записи о файле, которые хранятся в отдельных колонках SQLite
+SQLITE_COLUMNS = (
+    "filename", "hash", "hash_algorithm", "text_length", "processing_method",
+    "learned_at", "size", "mtime_ns", "inode"
+)
+
+class JSONTrackingStorage:
+    """
+    Хранилище данных отслеживания в JSON-файле
+    
+    Файл загружается в память целиком. Запись выполняется атомарно через
+    временный файл; в режиме журнала изменения дописываются построчно
+    и периодически сворачиваются в основной файл.
+    """
+    
+    def __init__(self, tracking_file: str, use_journal: bool = False, compact_every: int = 1000):
+        """
+        Инициализация хранилища
+        
+        Args:
+            tracking_file: Путь к JSON-файлу отслеживания
+            use_journal: Дописывать изменения в журнал вместо перезаписи всего файла
+            compact_every: Количество записей журнала, после которого он сворачивается
+                в основной файл
+        """
+        self.path = Path(tracking_file)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.use_journal = use_journal
+        self.compact_every = compact_every
+        self.journal_file = self.path.with_name(self.path.name + ".journal")
+        self._journal_records = 0
+        self.data = self._load()
+    
+    def _load(self) -> Dict:
+        """
+        Загружает данные отслеживания из файла и журнала
+        
+        Returns:
+            Словарь с информацией об изученных файлах
+        """
+        data = None
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.warning(f"Ошибка загрузки файла отслеживания: {e}")
+        
+        if data is None:
+            data = {
+                "files": {},
+                "last_update": None,
+                "total_files_learned": 0
+            }
+        
+        # Применяем изменения из журнала поверх основного файла
+        if self.journal_file.exists():
+            self._journal_records = self._replay_journal(data)
+        
+        if data["files"]:
+            logger.info(f"Загружены данные о {len(data['files'])} изученных файлах")
+        return data
+    
+    def _replay_journal(self, data: Dict) -> int:
+        """
+        Применяет записи журнала к данным отслеживания
+        
+        Args:
+            data: Данные отслеживания из основного файла
+        
+        Returns:
+            Количество примененных записей
+        """
+        records = 0
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная последняя строка после сбоя
+                        logger.warning("Пропущена поврежденная запись журнала отслеживания")
+                        continue
+                    if "meta" in record:
+                        data.setdefault("meta", {})[record["meta"]] = record["value"]
+                        records += 1
+                        continue
+                    data["files"][record["file"]] = record["info"]
+                    data["last_update"] = record.get("last_update", data.get("last_update"))
+                    records += 1
+        except Exception as e:
+            logger.warning(f"Ошибка чтения журнала отслеживания: {e}")
+        
+        data["total_files_learned"] = len(data["files"])
+        return records
+    
+    def _write_snapshot(self):
+        """
+        Сохраняет данные отслеживания в файл
+        
+        Данные пишутся во временный файл, который затем атомарно заменяет
+        основной, поэтому сбой во время записи не портит файл отслеживания.
+        """
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self.data, f, ensure_ascii=False, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            
+            # Все изменения журнала теперь содержатся в основном файле
+            if self.journal_file.exists():
+                self.journal_file.unlink()
+            self._journal_records = 0
+            
+            logger.info(f"Данные отслеживания сохранены в {self.path}")
+        except Exception as e:
+            logger.error(f"Ошибка сохранения файла отслеживания: {e}")
+    
+    def _append_journal(self, changes: Dict):
+        """
+        Дописывает изменения в журнал отслеживания
+        
+        Args:
+            changes: Измененные записи (путь -> запись)
+        """
+        try:
+            lines = ''.join(
+                json.dumps({"file": file_key, "info": file_info,
+                            "last_update": self.data["last_update"]}, ensure_ascii=False) + '\n'
+                for file_key, file_info in changes.items()
+            )
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_records += len(changes)
+            logger.info(f"В журнал отслеживания добавлено {len(changes)} записей")
+        except Exception as e:
+            logger.error(f"Ошибка записи журнала отслеживания: {e}")
+    
+    def get(self, file_key: str) -> Optional[Dict]:
+        """Возвращает запись о файле или None"""
+        return self.data["files"].get(file_key)
+    
+    def find_by_hash(self, file_hash: str) -> List[Tuple[str, Dict]]:
+        """Возвращает записи о файлах с указанным хешем"""
+        return [
+            (file_key, file_info) for file_key, file_info in self.data["files"].items()
+            if file_info.get("hash") == file_hash
+        ]
+    
+    def save(self, changes: Dict, last_update: Optional[str]):
+        """
+        Сохраняет измененные записи
+        
+        Args:
+            changes: Измененные записи (путь -> запись)
+            last_update: Отметка последнего обновления (None - не менять)
+        """
+        self.data["files"].update(changes)
+        self.data["total_files_learned"] = len(self.data["files"])
+        if last_update is not None:
+            self.data["last_update"] = last_update
+        
+        if self.use_journal:
+            self._append_journal(changes)
+            if self._journal_records >= self.compact_every:
+                self.compact()
+        else:
+            self._write_snapshot()
+    
+    def compact(self):
+        """Сворачивает журнал в основной файл отслеживания"""
+        logger.info(f"Сворачиваем журнал отслеживания ({self._journal_records} записей)")
+        self._write_snapshot()
+    
+    def get_meta(self, key: str) -> Optional[Any]:
+        """Возвращает служебное значение хранилища или None"""
+        return self.data.get("meta", {}).get(key)
+    
+    def set_meta(self, key: str, value: Any):
+        """
+        Сохраняет служебное значение хранилища
+        
+        Args:
+            key: Ключ
+            value: Значение, сериализуемое в JSON
+        """
+        self.data.setdefault("meta", {})[key] = value
+        if not self.use_journal:
+            self._write_snapshot()
+            return
+        
+        try:
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"meta": key, "value": value}, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_records += 1
+        except Exception as e:
+            logger.error(f"Ошибка записи журнала отслеживания: {e}")
+    
+    def get_stats(self) -> Dict:
+        """Возвращает количество файлов и суммарную длину текста"""
+        return {
+            "total_files": len(self.data["files"]),
+            "total_text_length": sum(
+                file_info["text_length"]
+                for file_info in self.data["files"].values()
+            )
+        }
+    
+    def get_all(self) -> Dict:
+        """Возвращает все записи (путь -> запись)"""
+        return self.data["files"]
+    
+    def reset(self):
+        """Удаляет все записи"""
+        self.data = {
+            "files": {},
+            "last_update": None,
+            "total_files_learned": 0
+        }
+        self._write_snapshot()
+    
+    def close(self):
+        """Освобождает ресурсы хранилища"""
+        pass
+
+class SQLiteTrackingStorage:
+    """
+    Хранилище данных отслеживания в базе SQLite
+    
+    Записи читаются по индексам (путь, хеш) без загрузки всей базы,
+    агрегаты для статистики считаются запросами SQL.
+    """
+    
+    def __init__(self, db_file: str):
+        """
+        Инициализация хранилища
+        
+        Args:
+            db_file: Путь к файлу базы данных
+        """
+        self.path = Path(db_file)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+    
+    def _create_schema(self):
+        """Создает таблицы и индексы, если их нет"""
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    filename TEXT,
+                    hash TEXT,
+                    hash_algorithm TEXT,
+                    text_length INTEGER,
+                    processing_method TEXT,
+                    learned_at TEXT,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    inode INTEGER,
+                    extra TEXT
+                )
+            """)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(hash)")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+    
+    @staticmethod
+    def _row_to_info(row) -> Dict:
+        """Преобразует строку таблицы files в запись о файле"""
+        file_info = dict(zip(SQLITE_COLUMNS, row[1:-1]))
+        if row[-1]:
+            file_info.update(json.loads(row[-1]))
+        if file_info.get("hash_algorithm") is None:
+            # Записи из старого JSON-формата не содержат алгоритма
+            file_info["hash_algorithm"] = "md5"
+        return file_info
+    
+    @staticmethod
+    def _info_to_row(file_key: str, file_info: Dict) -> Tuple:
+        """Преобразует запись о файле в строку таблицы files"""
+        extra = {key: value for key, value in file_info.items() if key not in SQLITE_COLUMNS}
+        return (file_key, *(file_info.get(column) for column in SQLITE_COLUMNS),
+                json.dumps(extra, ensure_ascii=False) if extra else None)
+    
+    def is_empty(self) -> bool:
+        """Проверяет, есть ли в базе записи"""
+        return self.connection.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+    
+    def get(self, file_key: str) -> Optional[Dict]:
+        """Возвращает запись о файле или None"""
+        row = self.connection.execute("SELECT * FROM files WHERE path = ?", (file_key,)).fetchone()
+        return self._row_to_info(row) if row else None
+    
+    def find_by_hash(self, file_hash: str) -> List[Tuple[str, Dict]]:
+        """Возвращает записи о файлах с указанным хешем"""
+        rows = self.connection.execute("SELECT * FROM files WHERE hash = ?", (file_hash,)).fetchall()
+        return [(row[0], self._row_to_info(row)) for row in rows]
+    
+    def save(self, changes: Dict, last_update: Optional[str]):
+        """
+        Сохраняет измененные записи одной транзакцией
+        
+        Args:
+            changes: Измененные записи (путь -> запись)
+            last_update: Отметка последнего обновления (None - не менять)
+        """
+        placeholders = ', '.join('?' * (len(SQLITE_COLUMNS) + 2))
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO files VALUES ({placeholders})",
+                    [self._info_to_row(file_key, file_info) for file_key, file_info in changes.items()]
+                )
+                if last_update is not None:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO meta VALUES ('last_update', ?)", (last_update,)
+                    )
+            logger.info(f"В базу отслеживания {self.path} записано {len(changes)} записей")
+        except Exception as e:
+            logger.error(f"Ошибка сохранения базы отслеживания: {e}")
+    
+    def compact(self):
+        """Переносит журнал WAL в основной файл базы"""
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
+    def get_meta(self, key: str) -> Optional[Any]:
+        """Возвращает служебное значение хранилища или None"""
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except (TypeError, json.JSONDecodeError):
+            # last_update хранится строкой без JSON-кодирования
+            return row[0]
+    
+    def set_meta(self, key: str, value: Any):
+        """
+        Сохраняет служебное значение хранилища
+        
+        Args:
+            key: Ключ
+            value: Значение, сериализуемое в JSON
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False))
+            )
+    
+    def get_stats(self) -> Dict:
+        """Возвращает количество файлов и суммарную длину текста"""
+        total_files, total_text_length = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(text_length), 0) FROM files"
+        ).fetchone()
+        return {
+            "total_files": total_files,
+            "total_text_length": total_text_length
+        }
+    
+    def get_all(self) -> Dict:
+        """Возвращает все записи (путь -> запись)"""
+        return {
+            row[0]: self._row_to_info(row)
+            for row in self.connection.execute("SELECT * FROM files ORDER BY path")
+        }
+    
+    def reset(self):
+        """Удаляет все записи"""
+        with self.connection:
+            self.connection.execute("DELETE FROM files")
+            self.connection.execute("DELETE FROM meta")
+    
+    def close(self):
+        """Закрывает соединение с базой"""
+        self.connection.close()
+
+def migrate_json_to_sqlite(json_file: str, db_file: str) -> int:
+    """
+    Переносит данные отслеживания из JSON-файла в базу SQLite
+    
+    Args:
+        json_file: Путь к JSON-файлу отслеживания (журнал учитывается)
+        db_file: Путь к файлу базы данных
+    
+    Returns:
+        Количество перенесенных записей
+    """
+    source = JSONTrackingStorage(json_file)
+    target = SQLiteTrackingStorage(db_file)
+    try:
+        files = source.get_all()
+        target.save(files, source.data.get("last_update"))
+        for key, value in source.data.get("meta", {}).items():
+            target.set_meta(key, value)
+        logger.info(f"Перенесено {len(files)} записей из {json_file} в {db_file}")
+        return len(files)
+    finally:
+        target.close()
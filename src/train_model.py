@@ -105,13 +105,11 @@ def train_model_incremental(data_path: str, task: str = "generation", epochs: in
         print(f"  - {item['filename']}: {item['length']:,} символов")
     print()
     
-    # Загружаем все данные для обучения
-    processed_data_file = Path("data/processed/pdf_history_data.json")
-    if not processed_data_file.exists():
-        raise ValueError("Файл обработанных данных не найден")
+    # Загружаем все данные для обучения из корпуса, в который дописаны новые файлы
+    if not len(processor.corpus):
+        raise ValueError(f"Корпус обработанных данных пуст: {processor.processed_data_file}")
     
-    data = load_historical_data(str(processed_data_file))
-    texts = extract_texts_from_data(data)
+    texts = extract_texts_from_data(processor.corpus.iter_records())
     
     if not texts:
         raise ValueError("Не удалось извлечь тексты из данных")
@@ -5,6 +5,8 @@
 """
 
 import argparse
+import math
+import random
 import sys
 import json
 from pathlib import Path
@@ -18,20 +20,33 @@ sys.path.append(str(Path(__file__).parent))
 
 from models.history_ai import HistoryAIModel
 from incremental_data_processing import IncrementalDataProcessor
+from corpus_store import CorpusStore
+from token_chunker import build_chunk_dataset, build_packed_dataset
+from training_stats import ThroughputCallback, TokenCountingCollator
+from length_grouping import DynamicPaddingCollator, get_example_lengths
+from token_cache import TokenCache
+from lora import ADAPTER_CONFIG_NAME
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def load_historical_data(data_path: str) -> list:
+# Контрольная точка, которую дообучает инкрементальный режим
+TRAINED_MODEL_DIR = "models/history_ai_trained"
+
+def load_historical_data(data_path: str, stream: bool = False):
     """
     Загружает исторические данные из файла
     
+    Поддерживаются корпус JSON Lines (.jsonl, читается построчно) и JSON-массив.
+    
     Args:
         data_path: Путь к данным
+        stream: Вернуть итератор по записям вместо списка
+            (только для .jsonl; корпус не загружается в память целиком)
         
     Returns:
-        Список данных для обучения
+        Список (или итератор) данных для обучения
     """
     data_file = Path(data_path)
     
@@ -40,6 +55,12 @@ def load_historical_data(data_path: str) -> list:
     
     logger.info(f"Загружаем данные из {data_path}")
     
+    if data_file.suffix == '.jsonl':
+        corpus = CorpusStore(data_file)
+        logger.info(f"Корпус содержит {len(corpus)} записей")
+        records = corpus.iter_records()
+        return records if stream else list(records)
+    
     with open(data_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
     
@@ -66,42 +87,45 @@ def extract_texts_from_data(data: list) -> list:
     logger.info(f"Подготовлено {len(texts)} текстов для обучения")
     return texts
 
-def create_dataset_for_training(texts: List[str], tokenizer, max_length: int = 512):
+def create_dataset_for_training(texts: List[str], tokenizer, max_length: int = 512, stride: int = 64,
+                                use_cache: bool = True, pack: bool = False, prune_cache: bool = True):
     """
     Создает датасет для обучения модели
     
+    Тексты токенизируются пакетами один раз и режутся на окна по max_length
+    токенов с перекрытием stride, так что усечение не теряет текст.
+    
     Args:
         texts: Список текстов
         tokenizer: Токенизатор
         max_length: Максимальная длина последовательности
+        stride: Перекрытие соседних окон в токенах
+        use_cache: Хранить окна в кеше токенов на диске; при повторном запуске
+            токенизируются только новые записи, а шарды читаются через mmap
+        pack: Склеивать документы через EOS в полные блоки по max_length токенов
+            (stride не используется)
+        prune_cache: Удалить из кеша токенов записи, не вошедшие в texts
+            (в инкрементальном режиме texts - лишь часть корпуса, шарды остальных
+            записей сохраняются)
         
     Returns:
         Датасет для обучения
     """
     logger.info("Создаем датасет для обучения...")
     
-    # Подготавливаем данные
-    formatted_texts = []
-    for text in texts:
-        # Добавляем специальные токены
-        formatted_text = f"<|startoftext|>{text}<|endoftext|>"
-        formatted_texts.append(formatted_text)
-    
-    # Токенизируем
-    tokenized_data = []
-    for text in formatted_texts:
-        tokens = tokenizer(
-            text,
-            truncation=True,
-            padding='max_length',
-            max_length=max_length,
-            return_tensors="pt"
-        )
-        tokenized_data.append({
-            "input_ids": tokens["input_ids"].squeeze().tolist(),
-            "attention_mask": tokens["attention_mask"].squeeze().tolist(),
-            "labels": tokens["input_ids"].squeeze().tolist()  # Для языкового моделирования
-        })
+    if use_cache:
+        cache = TokenCache(tokenizer, max_length=max_length, stride=0 if pack else stride)
+        # Без упаковки окна выдаются без дополнения: его добавляет DynamicPaddingCollator
+        dataset = cache.build_dataset(texts, pack=pack, pad_to_max_length=False, prune=prune_cache)
+        logger.info(f"Создан датасет с {len(dataset)} примерами")
+        return dataset
+    
+    if pack:
+        tokenized_data = build_packed_dataset(texts, tokenizer, block_size=max_length)
+    else:
+        # Окна выдаются без дополнения: его добавляет DynamicPaddingCollator
+        tokenized_data = build_chunk_dataset(texts, tokenizer, max_length=max_length, stride=stride,
+                                             pad_to_max_length=False)
     
     # Создаем HuggingFace датасет
     hf_dataset = HFDataset.from_list(tokenized_data)
@@ -113,15 +137,35 @@ def create_dataset_for_training(texts: List[str], tokenizer, max_length: int = 5
     return hf_dataset
 
 def train_model_incremental(data_path: str, task: str = "generation", epochs: int = 1, 
-                          model_name: str = "ai-forever/rugpt3small_based_on_gpt2"):
+                          model_name: str = "ai-forever/rugpt3small_based_on_gpt2",
+                          tracker_backend: str = "json", use_token_cache: bool = True,
+                          pack: bool = False, full: bool = False, replay_ratio: float = 0.25,
+                          replay_seed: int = 42, resume: bool = False, lora: bool = False,
+                          lora_rank: int = 8):
     """
     Инкрементальное обучение модели
     
+    Если контрольная точка models/history_ai_trained уже обучена, модель
+    дообучается с нее только на записях корпуса, добавленных после прошлого
+    обучения, и на случайной выборке старых записей (буфер повторения против
+    забывания). Количество использованных записей хранится в трекере.
+    
     Args:
         data_path: Путь к данным
         task: Тип задачи
         epochs: Количество эпох
         model_name: Название модели
+        tracker_backend: Хранилище данных отслеживания ('json' или 'sqlite')
+        use_token_cache: Использовать кеш токенизированного корпуса
+        pack: Упаковывать документы в полные блоки токенов без дополнения
+        full: Обучить заново с model_name на всем корпусе
+        replay_ratio: Доля старых записей относительно количества новых
+        replay_seed: Начальное значение генератора для выборки старых записей
+        resume: Продолжить прерванное обучение с последней контрольной точки
+            (записи для обучения выбираются так же, как в прерванном запуске)
+        lora: Обучать только низкоранговые адаптеры (LoRA); в контрольную точку
+            сохраняется только адаптер, ранее обученный адаптер дообучается
+        lora_rank: Ранг адаптеров
     """
     print("🚀 Начинаем инкрементальное обучение ИИ модели для изучения истории")
     print(f"📊 Данные: {data_path}")
@@ -131,7 +175,7 @@ def train_model_incremental(data_path: str, task: str = "generation", epochs: in
     print("=" * 60)
     
     # Инициализируем процессор данных
-    processor = IncrementalDataProcessor()
+    processor = IncrementalDataProcessor(backend=tracker_backend)
     
     # Проверяем статистику
     stats = processor.get_processing_stats()
@@ -147,39 +191,93 @@ def train_model_incremental(data_path: str, task: str = "generation", epochs: in
     
     if not new_data:
         print("ℹ️ Нет новых файлов для обучения")
-        print("🔄 Продолжаем обучение на всех существующих данных...")
+        print("🔄 Продолжаем обучение на записях корпуса, еще не использованных моделью...")
     else:
         print(f"🆕 Обработано {len(new_data)} новых файлов:")
         for item in new_data:
             print(f"  - {item['filename']}: {item['processed_length']:,} символов")
         print()
     
-    # Загружаем все данные для обучения
-    processed_data_file = Path("data/processed/pdf_history_data.json")
-    if not processed_data_file.exists():
-        raise ValueError("Файл обработанных данных не найден")
+    corpus = processor.corpus
+    if not len(corpus):
+        raise ValueError("Корпус обработанных данных пуст")
+    
+    # Определяем, с какой записи корпуса продолжать обучение контрольной точки
+    checkpoint_state = processor.tracker.get_checkpoint_state(TRAINED_MODEL_DIR)
+    consumed = checkpoint_state.get("consumed_records", 0)
+    has_checkpoint = any((Path(TRAINED_MODEL_DIR) / name).exists() for name in ("config.json", ADAPTER_CONFIG_NAME))
+    # Контрольную точку другой исходной модели (например, distilgpt2 вместо rugpt3small)
+    # не дообучаем; состояния старого формата без source_model считаются неизвестными
+    source_model = checkpoint_state.get("source_model")
+    if source_model is None and checkpoint_state.get("base_model") != TRAINED_MODEL_DIR:
+        source_model = checkpoint_state.get("base_model")
+    if full or not has_checkpoint or consumed > len(corpus) or source_model != model_name:
+        if consumed > len(corpus):
+            logger.warning("Корпус короче, чем при прошлом обучении; обучаем заново на всем корпусе")
+        elif consumed and not full and has_checkpoint and source_model != model_name:
+            logger.warning(f"Контрольная точка {TRAINED_MODEL_DIR} обучена с {source_model or 'неизвестной модели'}, "
+                           f"а не с {model_name}; обучаем заново с {model_name} на всем корпусе")
+        consumed = 0
+    
+    new_count = len(corpus) - consumed
+    if consumed and not new_count:
+        print("ℹ️ Нет новых записей для обучения: контрольная точка обучена на всем корпусе")
+        return
+    
+    # Старые записи для повторения выбираются случайно и читаются в порядке корпуса
+    replay_count = min(consumed, math.ceil(max(replay_ratio, 0) * new_count))
+    replay_ids = sorted(random.Random(replay_seed).sample(range(consumed), replay_count))
     
-    data = load_historical_data(str(processed_data_file))
-    texts = extract_texts_from_data(data)
+    records = [corpus.get(record_id) for record_id in replay_ids]
+    texts = extract_texts_from_data(records) + extract_texts_from_data(corpus.iter_records(consumed))
     
     if not texts:
         raise ValueError("Не удалось извлечь тексты из данных")
     
-    # Инициализируем модель
-    logger.info(f"Загружаем модель {model_name} для задачи: {task}")
+    # Инициализируем модель: дообучаем контрольную точку или начинаем с базовой модели
+    base_model = TRAINED_MODEL_DIR if consumed else model_name
     model = HistoryAIModel(model_name=model_name)
-    model.load_model(task_type=task)
+    if consumed:
+        print(f"🔁 Дообучение {TRAINED_MODEL_DIR}: {new_count} новых записей, "
+              f"{replay_count} старых для повторения")
+        # Адаптер продолжает обучаться отдельно; для полного обучения он объединяется с моделью
+        model.load_trained_model(TRAINED_MODEL_DIR, task_type=task, merge_adapter=not lora)
+    else:
+        print(f"🆕 Обучение с {model_name} на всем корпусе: {new_count} записей")
+        logger.info(f"Загружаем модель {model_name} для задачи: {task}")
+        model.load_model(task_type=task)
+    
+    if lora and not model.lora_config:
+        model.enable_lora(r=lora_rank)
     
     # Создаем датасет для обучения
     logger.info("Создаем датасет для обучения...")
-    train_dataset = create_dataset_for_training(texts, model.tokenizer)
+    train_dataset = create_dataset_for_training(texts, model.tokenizer, use_cache=use_token_cache, pack=pack,
+                                                prune_cache=not consumed)
+    
+    # Упакованные блоки одной длины собираются как есть. Без упаковки пакеты
+    # собираются из окон близкой длины и дополняются только до максимума пакета.
+    # Коллатор-обертка считает реальные токены для логов скорости и дополнения
+    if pack:
+        data_collator = TokenCountingCollator()
+        example_lengths = None
+    else:
+        pad_id = model.tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = model.tokenizer.eos_token_id
+        data_collator = TokenCountingCollator(DynamicPaddingCollator(pad_id))
+        example_lengths = get_example_lengths(train_dataset)
     
     # Обучаем модель
     logger.info("Начинаем обучение модели...")
-    model.train(train_dataset, num_epochs=epochs)
+    model.train(train_dataset, num_epochs=epochs, data_collator=data_collator,
+                callbacks=[ThroughputCallback(data_collator)], example_lengths=example_lengths,
+                output_dir=TRAINED_MODEL_DIR, resume=resume)
     
     # Сохраняем модель
-    model.save_model("models/history_ai_trained")
+    model.save_model(TRAINED_MODEL_DIR)
+    processor.tracker.record_checkpoint(TRAINED_MODEL_DIR, len(corpus), new_count, replay_count, base_model,
+                                        source_model=model_name)
     logger.info("Обучение завершено. Модель сохранена.")
     
     print("✅ Инкрементальное обучение завершено успешно!")
@@ -207,17 +305,34 @@ def main():
                        help='Название модели для обучения')
     parser.add_argument('--reset', action='store_true', help='Сбросить данные обучения')
     parser.add_argument('--stats', action='store_true', help='Показать статистику')
+    parser.add_argument('--backend', type=str, default='json', choices=['json', 'sqlite'],
+                       help='Хранилище данных отслеживания файлов')
+    parser.add_argument('--no-token-cache', action='store_true',
+                       help='Не использовать кеш токенизированного корпуса')
+    parser.add_argument('--pack', action='store_true',
+                       help='Упаковывать документы в полные блоки токенов без дополнения')
+    parser.add_argument('--full', action='store_true',
+                       help='Обучить заново с базовой модели на всем корпусе')
+    parser.add_argument('--replay-ratio', type=float, default=0.25,
+                       help='Доля старых записей для повторения относительно новых')
+    parser.add_argument('--seed', type=int, default=42,
+                       help='Начальное значение для выборки старых записей')
+    parser.add_argument('--resume', action='store_true',
+                       help='Продолжить прерванное обучение с последней контрольной точки')
+    parser.add_argument('--lora', action='store_true',
+                       help='Обучать только низкоранговые адаптеры (LoRA) вместо всей модели')
+    parser.add_argument('--lora-rank', type=int, default=8, help='Ранг адаптеров LoRA')
     
     args = parser.parse_args()
     
     if args.reset:
-        processor = IncrementalDataProcessor()
+        processor = IncrementalDataProcessor(backend=args.backend)
         processor.reset_learning()
         print("✅ Данные обучения сброшены")
         return
     
     if args.stats:
-        processor = IncrementalDataProcessor()
+        processor = IncrementalDataProcessor(backend=args.backend)
         stats = processor.get_processing_stats()
         print(f"📊 Статистика обучения:")
         print(f"  Изучено файлов: {stats['learned_files']}")
@@ -235,7 +350,16 @@ def main():
             data_path=args.data,
             task=args.task,
             epochs=args.epochs,
-            model_name=args.model
+            model_name=args.model,
+            tracker_backend=args.backend,
+            use_token_cache=not args.no_token_cache,
+            pack=args.pack,
+            full=args.full,
+            replay_ratio=args.replay_ratio,
+            replay_seed=args.seed,
+            resume=args.resume,
+            lora=args.lora,
+            lora_rank=args.lora_rank
         )
     except Exception as e:
         logger.error(f"Ошибка при обучении: {e}")
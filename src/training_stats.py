@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Статистика пропускной способности обучения
+Считает реальные (не дополняющие) токены в пакетах и долю дополнения
+"""
+
+import time
+from typing import Callable, Dict, List, Optional
+import logging
+
+from transformers import TrainerCallback, default_data_collator
+
+logger = logging.getLogger(__name__)
+
+class TokenCountingCollator:
+    """
+    Обертка коллатора, подсчитывающая реальные токены и дополнение в пакетах
+    
+    Реальными считаются позиции с attention_mask = 1. Счетчики хранятся в объекте,
+    поэтому пакеты должны собираться в основном процессе (dataloader_num_workers=0).
+    """
+    
+    def __init__(self, collator: Optional[Callable] = None):
+        """
+        Инициализация обертки
+        
+        Args:
+            collator: Исходный коллатор (по умолчанию default_data_collator)
+        """
+        self.collator = collator or default_data_collator
+        self.real_tokens = 0
+        self.total_tokens = 0
+    
+    def __call__(self, features: List[Dict]) -> Dict:
+        batch = self.collator(features)
+        attention_mask = batch.get("attention_mask")
+        if attention_mask is not None:
+            self.real_tokens += int(attention_mask.sum())
+            self.total_tokens += attention_mask.numel()
+        else:
+            self.real_tokens += batch["input_ids"].numel()
+            self.total_tokens += batch["input_ids"].numel()
+        return batch
+
+class ThroughputCallback(TrainerCallback):
+    """
+    Добавляет в логи Trainer скорость обучения в токенах и долю дополнения
+    
+    В логи добавляются tokens_per_second (реальные токены в секунду с прошлого
+    лога) и padding_ratio (доля дополняющих позиций среди всех позиций пакетов).
+    В конце каждой эпохи в журнал пишется доля дополнения за эпоху.
+    """
+    
+    def __init__(self, counting_collator: TokenCountingCollator):
+        """
+        Инициализация
+        
+        Args:
+            counting_collator: Коллатор, передаваемый в Trainer
+        """
+        self.collator = counting_collator
+        self._last_time = None
+        self._last_real = 0
+        self._last_total = 0
+        self._epoch_real = 0
+        self._epoch_total = 0
+    
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self._epoch_real = self.collator.real_tokens
+        self._epoch_total = self.collator.total_tokens
+    
+    def on_epoch_end(self, args, state, control, **kwargs):
+        real = self.collator.real_tokens - self._epoch_real
+        total = self.collator.total_tokens - self._epoch_total
+        if total:
+            logger.info(f"Эпоха {state.epoch:.0f}: {real:,} реальных токенов из {total:,} позиций, "
+                        f"потери на дополнение {1 - real / total:.1%}")
+    
+    def on_train_begin(self, args, state, control, **kwargs):
+        self._last_time = time.perf_counter()
+        self._last_real = self.collator.real_tokens
+        self._last_total = self.collator.total_tokens
+    
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is None or self._last_time is None:
+            return
+        
+        now = time.perf_counter()
+        real = self.collator.real_tokens - self._last_real
+        total = self.collator.total_tokens - self._last_total
+        elapsed = now - self._last_time
+        if total:
+            logs["tokens_per_second"] = round(real / elapsed, 1) if elapsed > 0 else 0.0
+            logs["padding_ratio"] = round(1 - real / total, 4)
+            logger.info(f"Шаг {state.global_step}: {logs['tokens_per_second']:,} токенов/с, "
+                        f"дополнение {logs['padding_ratio']:.1%}")
+        
+        self._last_time = now
+        self._last_real = self.collator.real_tokens
+        self._last_total = self.collator.total_tokens
+    
+    def on_train_end(self, args, state, control, **kwargs):
+        if self.collator.total_tokens:
+            padding_ratio = 1 - self.collator.real_tokens / self.collator.total_tokens
+            logger.info(f"Всего обработано {self.collator.real_tokens:,} реальных токенов, "
+                        f"доля дополнения {padding_ratio:.1%}")
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Векторный индекс фрагментов корпуса для поиска контекста к вопросам
+Эмбеддинги фрагментов хранятся в файлах, отображаемых в память; поиск - по инвертированным
+спискам ближайших центроидов (IVF), новые записи корпуса дописываются в индекс
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+from answer_cache import model_fingerprint
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent))
+
+logger = logging.getLogger(__name__)
+
+# Версия формата индекса; при изменении индекс строится заново
+VECTOR_INDEX_VERSION = "1"
+
+# Максимальная длина фрагмента в символах
+PASSAGE_CHARS = 500
+
+# До этого количества векторов поиск выполняется полным перебором
+FLAT_SEARCH_LIMIT = 10000
+
+# Центроиды переобучаются, когда индекс вырос во столько раз с прошлого обучения
+RETRAIN_GROWTH = 4
+
+# Максимальное количество векторов для обучения центроидов
+TRAIN_SAMPLE_SIZE = 100000
+
+# Количество векторов в одном матричном умножении при назначении списков
+ASSIGN_BATCH_SIZE = 10000
+
+# Количество новых фрагментов, после которого обновление индекса сохраняется
+UPDATE_SAVE_INTERVAL = 10000
+
+def split_passages(text: str, max_chars: int = PASSAGE_CHARS) -> Iterator[Tuple[int, int]]:
+    """
+    Делит текст записи на фрагменты по границам строк
+    
+    Строки объединяются, пока фрагмент не превышает max_chars; слишком
+    длинная строка делится по последнему пробелу перед границей.
+    
+    Args:
+        text: Текст записи
+        max_chars: Максимальная длина фрагмента
+    
+    Yields:
+        Границы фрагментов в тексте (начало, конец)
+    """
+    start = end = 0
+    length = len(text)
+    while end < length:
+        line_end = text.find('\n', end)
+        line_end = length if line_end == -1 else line_end + 1
+        if line_end - start <= max_chars:
+            end = line_end
+            continue
+        if end > start:
+            if text[start:end].strip():
+                yield start, end
+            start = end
+            continue
+        # Строка длиннее фрагмента
+        cut = text.rfind(' ', start + 1, start + max_chars)
+        end = cut + 1 if cut != -1 else start + max_chars
+        yield start, end
+        start = end
+    if text[start:end].strip():
+        yield start, end
+
+def build_rag_prompt(question: str, passages: List[Dict], max_context_chars: int = 1000) -> str:
+    """
+    Составляет промпт генерации с найденными фрагментами перед вопросом
+    
+    Args:
+        question: Вопрос пользователя
+        passages: Фрагменты из VectorIndex.search
+        max_context_chars: Максимальная суммарная длина фрагментов
+    
+    Returns:
+        Промпт для generate_text
+    """
+    context = []
+    remaining = max_context_chars
+    for passage in passages:
+        text = ' '.join(passage['text'].split())[:remaining]
+        if not text:
+            break
+        context.append(text)
+        remaining -= len(text)
+    if not context:
+        return question
+    return "Контекст:\n" + "\n".join(context) + f"\n\nВопрос: {question}\nОтвет:"
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Нормирует строки на единичную длину (скалярное произведение = косинус)"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class VectorIndex:
+    """
+    Приближенный поиск ближайших фрагментов корпуса по эмбеддингам
+    
+    Файлы в директории индекса:
+        vectors.bin - нормированные эмбеддинги фрагментов (count x dim, dtype)
+        passages.bin - номер записи корпуса и границы фрагмента (count x 3, int64)
+        lists.bin - номер инвертированного списка каждого вектора (int32)
+        centroids.npy - центроиды списков
+        manifest.json - количество векторов, проиндексированных записей,
+            идентификатор корпуса и параметры
+    Бинарные файлы только дописываются; manifest.json сохраняется последним,
+    поэтому после сбоя недописанный хвост отбрасывается.
+    """
+    
+    def __init__(self, index_dir: str = "data/processed/vector_index", ai_model=None,
+                 dtype=np.float16, nprobe: int = 8):
+        """
+        Инициализация индекса
+        
+        Args:
+            index_dir: Директория индекса
+            ai_model: HistoryAIModel для эмбеддингов фрагментов и запросов
+            dtype: Тип хранения векторов (np.float16 или np.float32)
+            nprobe: Количество просматриваемых списков при поиске
+        """
+        self.index_dir = Path(index_dir)
+        self.ai_model = ai_model
+        self.model_fingerprint = self._fingerprint()
+        self.nprobe = nprobe
+        self.vectors_file = self.index_dir / "vectors.bin"
+        self.passages_file = self.index_dir / "passages.bin"
+        self.lists_file = self.index_dir / "lists.bin"
+        self.centroids_file = self.index_dir / "centroids.npy"
+        self.manifest_file = self.index_dir / "manifest.json"
+        
+        self.manifest = self._load_manifest(np.dtype(dtype).name)
+        self._open()
+    
+    def _model_id(self) -> Optional[str]:
+        return getattr(self.ai_model, 'model_name', None) if self.ai_model is not None else None
+    
+    def _fingerprint(self) -> Optional[str]:
+        """Отпечаток весов модели эмбеддингов: меняется после переобучения в той же директории"""
+        if self.ai_model is None:
+            return None
+        source = getattr(self.ai_model, 'model_path', None) or self._model_id()
+        return model_fingerprint(source) if source else None
+    
+    def _empty_manifest(self, dtype: str) -> Dict:
+        return {"version": VECTOR_INDEX_VERSION, "model": self._model_id(), "model_fingerprint": None,
+                "corpus": None, "dtype": dtype, "dim": 0, "count": 0, "records": 0, "nlist": 0,
+                "trained_count": 0}
+    
+    def _load_manifest(self, dtype: str) -> Dict:
+        if self.manifest_file.exists():
+            try:
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get("version") == VECTOR_INDEX_VERSION:
+                    return manifest
+                logger.info("Формат векторного индекса изменился, индекс будет построен заново")
+            except Exception as e:
+                logger.warning(f"Ошибка загрузки векторного индекса: {e}")
+        return self._empty_manifest(dtype)
+    
+    def _save_manifest(self):
+        """Атомарно сохраняет manifest.json"""
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, prefix=self.manifest_file.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def _open(self):
+        """Отображает файлы индекса в память и строит инвертированные списки"""
+        count, dim = self.manifest["count"], self.manifest["dim"]
+        if not count:
+            self.vectors = np.empty((0, dim), dtype=self.manifest["dtype"])
+            self.passages = np.empty((0, 3), dtype=np.int64)
+            self.lists = np.empty(0, dtype=np.int32)
+        else:
+            self.vectors = np.memmap(self.vectors_file, dtype=self.manifest["dtype"], mode='r', shape=(count, dim))
+            self.passages = np.memmap(self.passages_file, dtype=np.int64, mode='r', shape=(count, 3))
+            self.lists = np.memmap(self.lists_file, dtype=np.int32, mode='r', shape=(count,))
+        
+        self.centroids = np.load(self.centroids_file) if self.manifest["nlist"] else None
+        if self.centroids is not None:
+            # Номера векторов, упорядоченные по спискам, и границы списков
+            self.list_order = np.argsort(self.lists, kind='stable')
+            self.list_bounds = np.searchsorted(self.lists[self.list_order], np.arange(len(self.centroids) + 1))
+    
+    def __len__(self) -> int:
+        return self.manifest["count"]
+    
+    def _is_stale(self, corpus) -> bool:
+        """
+        Проверяет, что индекс построен по другому корпусу (корпус удален и собран
+        заново) или другими весами модели эмбеддингов (модель переобучена)
+        """
+        corpus_id = getattr(corpus, 'corpus_id', None)
+        indexed_id = self.manifest.get("corpus")
+        if corpus_id and indexed_id and corpus_id != indexed_id or self.manifest["records"] > len(corpus):
+            return True
+        indexed_fingerprint = self.manifest.get("model_fingerprint")
+        if self.model_fingerprint and indexed_fingerprint and self.model_fingerprint != indexed_fingerprint:
+            return True
+        model_id = self._model_id()
+        return bool(len(self) and model_id and self.manifest.get("model") and self.manifest["model"] != model_id)
+    
+    def _append(self, vectors: np.ndarray, passages: np.ndarray):
+        """Дописывает векторы и фрагменты в файлы индекса"""
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        count = self.manifest["count"]
+        lists = self._assign(vectors) if self.centroids is not None else np.zeros(len(vectors), dtype=np.int32)
+        row_bytes = vectors.shape[1] * vectors.dtype.itemsize
+        
+        # Хвост, записанный после последнего сохранения manifest.json, отбрасывается
+        for path, data, size in ((self.vectors_file, vectors, row_bytes), (self.passages_file, passages, 24),
+                                 (self.lists_file, lists, 4)):
+            with open(path, 'ab') as f:
+                f.truncate(count * size)
+                data.tofile(f)
+        
+        self.manifest["dim"] = vectors.shape[1]
+        self.manifest["count"] = count + len(vectors)
+    
+    def update(self, corpus, batch_size: int = 64, max_chars: int = PASSAGE_CHARS) -> int:
+        """
+        Добавляет в индекс фрагменты записей корпуса, которых в нем еще нет
+        
+        Args:
+            corpus: CorpusStore (записи только дописываются, поэтому новые
+                записи - это записи после последней проиндексированной)
+            batch_size: Количество фрагментов в одном прямом проходе модели
+            max_chars: Максимальная длина фрагмента
+        
+        Returns:
+            Количество добавленных фрагментов
+        """
+        if self.ai_model is None:
+            raise RuntimeError("Для обновления индекса нужна модель эмбеддингов (ai_model)")
+        if self._is_stale(corpus):
+            logger.warning("Индекс построен по другому корпусу или другой моделью, индекс строится заново")
+            self.reset()
+        self.manifest["corpus"] = getattr(corpus, 'corpus_id', None)
+        self.manifest["model"] = self._model_id()
+        self.manifest["model_fingerprint"] = self.model_fingerprint
+        
+        start_records, added = self.manifest["records"], 0
+        texts, bounds = [], []
+        
+        def flush():
+            nonlocal added
+            embeddings = self.ai_model.get_embeddings(texts, batch_size=batch_size, dtype=np.float32)
+            self._append(_normalize(embeddings).astype(self.manifest["dtype"]), np.array(bounds, dtype=np.int64))
+            added += len(texts)
+            texts.clear()
+            bounds.clear()
+        
+        for record_id, record in enumerate(corpus.iter_records(start_records), start_records):
+            text = record['text']
+            for start, end in split_passages(text, max_chars):
+                texts.append(text[start:end])
+                bounds.append((record_id, start, end))
+            # Фрагменты записи сохраняются вместе с ней: manifest отмечает целые записи
+            if len(texts) >= UPDATE_SAVE_INTERVAL:
+                flush()
+                self.manifest["records"] = record_id + 1
+                self._save_manifest()
+        if texts:
+            flush()
+        self.manifest["records"] = len(corpus)
+        
+        if self.manifest["count"] >= FLAT_SEARCH_LIMIT and \
+                self.manifest["count"] >= RETRAIN_GROWTH * self.manifest["trained_count"]:
+            self._open()
+            self._train()
+        self._save_manifest()
+        self._open()
+        
+        logger.info(f"В векторный индекс добавлено {added} фрагментов "
+                    f"из {len(corpus) - start_records} записей (всего {len(self)})")
+        return added
+    
+    def _train(self, iterations: int = 10, seed: int = 42):
+        """Обучает центроиды (сферический k-means на выборке) и заново назначает списки"""
+        count = len(self)
+        nlist = int(min(4096, max(16, 4 * np.sqrt(count))))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(count, size=min(count, TRAIN_SAMPLE_SIZE), replace=False))
+        data = np.asarray(self.vectors[sample], dtype=np.float32)
+        
+        start = time.perf_counter()
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.concatenate([np.argmax(data[i:i + ASSIGN_BATCH_SIZE] @ centroids.T, axis=1)
+                                         for i in range(0, len(data), ASSIGN_BATCH_SIZE)])
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            sums = np.zeros_like(centroids)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums[~empty] = np.add.reduceat(data[np.argsort(assignment, kind='stable')], starts[~empty])
+            # Пустой список получает случайный вектор выборки
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+        self.centroids = centroids.astype(np.float32)
+        
+        lists = np.concatenate([self._assign(np.asarray(self.vectors[i:i + ASSIGN_BATCH_SIZE]))
+                                for i in range(0, count, ASSIGN_BATCH_SIZE)])
+        np.save(self.centroids_file, self.centroids)
+        lists.tofile(self.lists_file)
+        self.manifest["nlist"] = nlist
+        self.manifest["trained_count"] = count
+        logger.info(f"Центроиды векторного индекса обучены: {nlist} списков, "
+                    f"{count} векторов, {time.perf_counter() - start:.1f} с")
+    
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Номера ближайших центроидов"""
+        return np.argmax(np.asarray(vectors, dtype=np.float32) @ self.centroids.T, axis=1).astype(np.int32)
+    
+    def search_vector(self, query: np.ndarray, top_k: int = 5,
+                      nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Ищет ближайшие фрагменты к вектору запроса
+        
+        Args:
+            query: Эмбеддинг запроса
+            top_k: Количество результатов
+            nprobe: Количество просматриваемых списков (по умолчанию self.nprobe)
+        
+        Returns:
+            Номера фрагментов и косинусная близость по убыванию близости
+        """
+        if not len(self):
+            return []
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        
+        if self.centroids is None:
+            candidates = np.arange(len(self))
+            scores = np.asarray(self.vectors, dtype=np.float32) @ query
+        else:
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            candidates = np.sort(np.concatenate([self.list_order[self.list_bounds[c]:self.list_bounds[c + 1]]
+                                                 for c in probe]))
+            scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+        
+        top_k = min(top_k, len(candidates))
+        if not top_k:
+            return []
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+    
+    def search(self, query: str, records, top_k: int = 5, nprobe: Optional[int] = None) -> List[Dict]:
+        """
+        Ищет фрагменты корпуса, близкие к запросу
+        
+        Args:
+            query: Текст запроса
+            records: Источник записей по номеру (CorpusStore или список записей)
+            top_k: Количество результатов
+            nprobe: Количество просматриваемых списков
+        
+        Returns:
+            Фрагменты: {'record_id', 'filename', 'text', 'score'}
+        """
+        if not len(self):
+            return []
+        if self.ai_model is None:
+            raise RuntimeError("Для поиска по тексту нужна модель эмбеддингов (ai_model)")
+        if self._is_stale(records):
+            logger.warning("Векторный индекс построен по другому корпусу или другой моделью: обновите его (update)")
+            return []
+        
+        query_vector = self.ai_model.get_embeddings([query], dtype=np.float32)[0]
+        results = []
+        for passage_id, score in self.search_vector(query_vector, top_k=top_k, nprobe=nprobe):
+            record_id, start, end = (int(value) for value in self.passages[passage_id])
+            record = records.get(record_id) if hasattr(records, 'get') else records[record_id]
+            results.append({'record_id': record_id, 'filename': record.get('filename'),
+                            'text': record['text'][start:end], 'score': score})
+        return results
+    
+    def reset(self):
+        """Удаляет данные индекса"""
+        for path in (self.vectors_file, self.passages_file, self.lists_file, self.centroids_file,
+                     self.manifest_file):
+            if path.exists():
+                path.unlink()
+        self.manifest = self._empty_manifest(self.manifest["dtype"])
+        self._open()
+
+def main():
+    parser = argparse.ArgumentParser(description='Векторный индекс фрагментов корпуса')
+    parser.add_argument('--model', type=str, required=True, help='Путь к модели для эмбеддингов')
+    parser.add_argument('--corpus', type=str, default='data/processed/pdf_history_data.jsonl',
+                        help='Корпус .jsonl')
+    parser.add_argument('--index', type=str, default='data/processed/vector_index', help='Директория индекса')
+    parser.add_argument('--rebuild', action='store_true', help='Построить индекс заново')
+    parser.add_argument('--query', type=str, help='Найти фрагменты по запросу вместо обновления индекса')
+    parser.add_argument('--top-k', type=int, default=5, help='Количество результатов поиска')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    from corpus_store import CorpusStore
+    from models.history_ai import HistoryAIModel
+    
+    model = HistoryAIModel()
+    model.load_trained_model(args.model, task_type='generation')
+    corpus = CorpusStore(args.corpus)
+    index = VectorIndex(args.index, ai_model=model)
+    
+    if args.query:
+        start = time.perf_counter()
+        results = index.search(args.query, corpus, top_k=args.top_k)
+        print(f"Найдено {len(results)} фрагментов за {(time.perf_counter() - start) * 1000:.1f} мс")
+        for result in results:
+            print(f"\n[{result['score']:.3f}] {result['filename']}\n{result['text'].strip()}")
+        return
+    
+    if args.rebuild:
+        index.reset()
+    index.update(corpus)
+
+if __name__ == "__main__":
+    main()